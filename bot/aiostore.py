@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from writer import StoreWriter
+
+
+class AsyncStore:
+    """Interfaccia asincrona dello store.
+
+    Letture, commit e compattazione girano su un pool di thread limitato,
+    così il parsing e la scrittura dei file non bloccano l'event loop
+    mentre altri utenti sono in conversazione."""
+
+    def __init__(self, store, max_workers=4, window=0.05, max_batch=500):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="store")
+        self.writer = StoreWriter(store, executor=self.executor, window=window, max_batch=max_batch)
+
+    async def run(self, func, *args, **kwargs):
+        """Esegue una funzione bloccante sul pool di thread dello store."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    # -------------- LETTURA --------------
+
+    async def all(self):
+        return await self.run(self.store.all)
+
+    async def count(self):
+        return await self.run(self.store.count)
+
+    async def get_user_markers(self, uid):
+        return await self.run(self.store.user_markers, uid)
+
+    async def user_count(self, uid):
+        return await self.run(self.store.user_count, uid)
+
+    async def has_name(self, uid, name):
+        return await self.run(self.store.has_name, uid, name)
+
+    # -------------- SCRITTURA --------------
+
+    async def apply(self, mutation):
+        """Applica una mutazione tramite il writer e ritorna il suo risultato."""
+        results = await self.writer.submit([mutation])
+        return results[0]
+
+    async def apply_many(self, mutations):
+        """Applica più mutazioni nello stesso commit."""
+        return await self.writer.submit(list(mutations))
+
+    async def compact(self):
+        await self.run(self.store.compact)
+
+    # -------------- CICLO DI VITA --------------
+
+    def start(self):
+        self.writer.start()
+
+    async def stop(self):
+        await self.writer.stop()
+        self.executor.shutdown(wait=True)
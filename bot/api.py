@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import bisect
+import collections
+import gzip
+import json
+import logging
+import math
+import re
+import secrets
+import threading
+
+from aiohttp import web
+
+from export import REGIONS, parse_date
+from feedrows import FEED_FIELDS, feed_row, to_int
+
+GZIP_MIN_BYTES = 1024  # Risposte più piccole non vengono compresse
+CURSOR_SEPARATOR = '\x1f'
+
+
+class QueryError(ValueError):
+    """Parametri della richiesta non validi (risposta 400)."""
+
+
+def parse_bbox(value):
+    try:
+        south, west, north, east = (float(v) for v in value.split(','))
+    except ValueError:
+        raise QueryError("bbox non valido: usa bbox=sud,ovest,nord,est")
+    if not all(math.isfinite(v) for v in (south, west, north, east)):
+        raise QueryError("bbox non valido: servono coordinate numeriche finite")
+    south, north = (max(min(v, 90.0), -90.0) for v in (south, north))
+    west, east = (max(min(v, 180.0), -180.0) for v in (west, east))
+    return min(south, north), min(west, east), max(south, north), max(west, east)
+
+
+def parse_time(value, end=False):
+    """Timestamp Unix o data AAAA-MM-GG (fine giornata con end=True)."""
+    if re.fullmatch(r'\d+', value):
+        return int(value)
+    try:
+        return parse_date(value, end)
+    except ValueError as e:
+        raise QueryError(str(e))
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    try:
+        return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode('utf-8')
+    except ValueError:
+        raise QueryError("cursor non valido")
+
+
+class MarkerAPI:
+    """API HTTP in sola lettura sui marker (integrazione con MapForHam e altri partner).
+
+    GET /api/nodes con filtri bbox=S,O,N,E o region=nome, lat/lon/radius (km),
+    freq, since/until (data o timestamp), source ("telegram" per i nodi
+    inseriti dal bot, "meshcore" per quelli importati); paginazione con
+    cursore (limit, cursor -> campo "next" della risposta).
+
+    Le query usano l'indice a griglia aggiornato dai listener dello store,
+    mai il CSV. L'ETag deriva dalla versione dell'indice (più un epoch
+    casuale per avvio): un partner che ripete la stessa richiesta senza
+    modifiche ai dati riceve 304 senza che la query venga nemmeno letta.
+    I risultati di ogni query e le pagine già serializzate (anche compresse
+    con gzip) restano in una cache limitata, valida finché la versione non
+    cambia: le richieste ripetute non toccano l'indice."""
+
+    def __init__(self, index, frequencies, host='0.0.0.0', port=8086,
+                 default_limit=500, max_limit=5000, max_radius_km=500, cache_size=256, executor=None):
+        self.index = index
+        self.frequencies = frequencies
+        self.host = host
+        self.port = port
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.max_radius_km = max_radius_km
+        self.cache_size = cache_size
+        self.executor = executor
+        self.epoch = secrets.token_hex(4)
+        self.requests = 0
+        self.not_modified = 0
+        self._results = collections.OrderedDict()  # {(versione, filtri): (chiavi ordinate, righe)}
+        self._pages = collections.OrderedDict()    # {(versione, filtri, cursore, limite): (corpo, corpo gzip)}
+        self._cache_lock = threading.Lock()
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_get('/api/nodes', self.nodes)
+        self.app.router.add_get('/api/status', self.status)
+
+    def etag(self, version=None):
+        return f'W/"{self.epoch}-{self.index.version if version is None else version}"'
+
+    # -------------- PARAMETRI --------------
+
+    def parse_filters(self, query):
+        """Filtri della richiesta come tupla ordinata (chiave della cache)."""
+        filters = {}
+        if 'bbox' in query:
+            filters['bbox'] = parse_bbox(query['bbox'])
+        elif 'region' in query:
+            region = query['region'].lower().replace(' ', '-').replace("'", '-')
+            if region not in REGIONS:
+                raise QueryError(f"Regione sconosciuta: {query['region']}")
+            filters['bbox'] = REGIONS[region]
+
+        if 'lat' in query or 'lon' in query or 'radius' in query:
+            try:
+                lat, lon, radius = float(query['lat']), float(query['lon']), float(query['radius'])
+            except (KeyError, ValueError):
+                raise QueryError("Per la ricerca per raggio servono lat, lon e radius (km)")
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius <= self.max_radius_km):
+                raise QueryError(f"lat/lon non validi o radius fuori da 0-{self.max_radius_km} km")
+            filters['center'] = (lat, lon)
+            filters['radius'] = radius
+
+        if 'freq' in query:
+            wanted = query['freq'].lower().replace(' ', '')
+            frequency = next((f for f in self.frequencies if wanted in f.lower().replace(' ', '')), None)
+            if frequency is None:
+                raise QueryError(f"Frequenza non valida: {query['freq']}")
+            filters['frequency'] = frequency
+        if 'since' in query:
+            filters['since'] = parse_time(query['since'])
+        if 'until' in query:
+            filters['until'] = parse_time(query['until'], end=True)
+        if 'source' in query:
+            filters['source'] = query['source'].lower()
+        return tuple(sorted(filters.items()))
+
+    def parse_limit(self, query):
+        try:
+            limit = int(query.get('limit', self.default_limit))
+        except ValueError:
+            raise QueryError("limit non valido")
+        return max(1, min(limit, self.max_limit))
+
+    # -------------- QUERY --------------
+
+    def _select(self, filters):
+        """Esegue la query sull'indice. Ritorna (versione, chiavi ordinate, righe nello stesso ordine)."""
+        params = dict(filters)
+        version, found = self.index.query(params.get('bbox'), params.get('center'), params.get('radius'),
+                                          params.get('frequency'))
+        since, until, source = params.get('since'), params.get('until'), params.get('source')
+        rows = []
+        for marker, km in found:
+            if since is not None or until is not None:
+                ts = to_int(marker.get('timestamp'))
+                if (since is not None and ts < since) or (until is not None and ts > until):
+                    continue
+            if source is not None and marker.get('source', '') != ('' if source == 'telegram' else source):
+                continue
+            row = dict(zip(FEED_FIELDS, feed_row(marker)))
+            if km is not None:
+                row['distance_km'] = round(km, 3)
+            rows.append((marker['ID'] + CURSOR_SEPARATOR + marker['name'], row))
+
+        # Ordine stabile per (ID, nome): il cursore resta valido anche se i dati cambiano tra le pagine
+        rows.sort(key=lambda item: item[0])
+        return version, [key for key, _ in rows], [row for _, row in rows]
+
+    def _cache(self, cache, key, value):
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def page(self, filters, cursor, limit):
+        """Corpo della pagina (normale e gzip) e versione a cui corrisponde. Bloccante: va
+        eseguita fuori dall'event loop se il risultato non è in cache."""
+        version = self.index.version
+        cached = self._pages.get((version, filters, cursor, limit))
+        if cached is not None:
+            return version, cached
+
+        result = self._results.get((version, filters))
+        if result is None:
+            version, keys, rows = self._select(filters)
+            result = (keys, rows)
+            self._cache(self._results, (version, filters), result)
+        keys, rows = result
+
+        # Le righe vengono serializzate solo per le pagine richieste, ognuna una volta per versione
+        start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+        end = min(start + limit, len(keys))
+        body = json.dumps({
+            'version': version,
+            'total': len(keys),
+            'next': encode_cursor(keys[end - 1]) if end < len(keys) else None,
+            'nodes': rows[start:end],
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        pages = (body, gzip.compress(body, 6) if len(body) >= GZIP_MIN_BYTES else None)
+        self._cache(self._pages, (version, filters, cursor, limit), pages)
+        return version, pages
+
+    # -------------- HANDLER --------------
+
+    def _headers(self, etag):
+        return {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding',
+                'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag'}
+
+    @staticmethod
+    def _error(status, message):
+        return web.json_response({'error': message}, status=status, headers={'Access-Control-Allow-Origin': '*'})
+
+    async def nodes(self, request):
+        self.requests += 1
+        etag = self.etag()
+        if etag in request.headers.get('If-None-Match', '').split(', '):
+            self.not_modified += 1
+            return web.Response(status=304, headers=self._headers(etag))
+
+        try:
+            filters = self.parse_filters(request.query)
+            limit = self.parse_limit(request.query)
+            cursor = request.query.get('cursor') or None
+            key = (self.index.version, filters, cursor, limit)
+            cached = self._pages.get(key)
+            if cached is not None:
+                version, (body, compressed) = key[0], cached
+            else:
+                loop = asyncio.get_running_loop()
+                version, (body, compressed) = await loop.run_in_executor(self.executor, self.page, filters, cursor, limit)
+        except QueryError as e:
+            return self._error(400, str(e))
+
+        headers = self._headers(self.etag(version))
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        if compressed is not None and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = compressed
+        return web.Response(body=body, headers=headers)
+
+    async def status(self, request):
+        return web.json_response(
+            {'version': self.index.version, 'epoch': self.epoch, 'nodes': self.index.count},
+            headers={'Access-Control-Allow-Origin': '*'}
+        )
+
+    # -------------- CICLO DI VITA --------------
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"API in ascolto su {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Benchmark dello store e degli handler del bot su mappe sintetiche.
+
+Uso (dalla cartella bot):  python -m bench.run --sizes 10000,100000 --output risultati.json
+Confronto tra due commit:  python -m bench.compare prima.json dopo.json"""
+
+import os
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
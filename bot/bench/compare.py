@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Confronta due file di risultati di bench.run (es. prima e dopo un commit).
+
+Uso: python -m bench.compare prima.json dopo.json [--threshold 0.2]
+Esce con codice 1 se qualche mediana è peggiorata oltre la soglia."""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(before, after, threshold):
+    """Righe (backend, dimensione, misura, prima, dopo, rapporto, esito) delle misure presenti
+    in entrambi; l'esito è "peggiorato" o "migliorato" oltre la soglia, altrimenti vuoto."""
+    rows = []
+    for backend, sizes in sorted(after['runs'].items()):
+        for size, result in sorted(sizes.items(), key=lambda item: int(item[0])):
+            old = before['runs'].get(backend, {}).get(size)
+            if old is None:
+                continue
+            for name, stats in sorted(result['timings'].items()):
+                if name not in old['timings']:
+                    continue
+                old_median, new_median = old['timings'][name]['median'], stats['median']
+                ratio = new_median / old_median if old_median else float('inf')
+                if ratio > 1 + threshold:
+                    outcome = "peggiorato"
+                elif ratio < 1 - threshold:
+                    outcome = "migliorato"
+                else:
+                    outcome = ""
+                rows.append((backend, size, name, old_median, new_median, ratio, outcome))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Confronto tra due risultati di bench.run")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.2, help="peggioramento tollerato (0.2 = +20%%)")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    print(f"Prima: {before['meta'].get('commit')}  Dopo: {after['meta'].get('commit')}")
+    regressions = 0
+    for backend, size, name, old, new, ratio, outcome in compare(before, after, args.threshold):
+        flag = {"peggiorato": "  <-- peggiorato", "migliorato": "  migliorato"}.get(outcome, "")
+        regressions += outcome == "peggiorato"
+        print(f"[{backend} {size:>8}] {name:45} {old * 1000:10.3f} -> {new * 1000:10.3f} ms ({ratio:5.2f}x){flag}")
+    if regressions:
+        print(f"\n{regressions} misure peggiorate oltre il {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import itertools
+import math
+import random
+
+# Città con (lat, lon, peso): i nodi si concentrano attorno ai centri abitati
+CITIES = [
+    ("Roma", 41.9028, 12.4964, 28), ("Milano", 45.4642, 9.1900, 32), ("Napoli", 40.8518, 14.2681, 15),
+    ("Torino", 45.0703, 7.6869, 16), ("Palermo", 38.1157, 13.3615, 7), ("Genova", 44.4056, 8.9463, 8),
+    ("Bologna", 44.4949, 11.3426, 12), ("Firenze", 43.7696, 11.2558, 11), ("Bari", 41.1171, 16.8719, 6),
+    ("Catania", 37.5079, 15.0830, 5), ("Venezia", 45.4408, 12.3155, 7), ("Verona", 45.4384, 10.9916, 7),
+    ("Messina", 38.1938, 15.5540, 3), ("Padova", 45.4064, 11.8768, 8), ("Trieste", 45.6495, 13.7768, 4),
+    ("Brescia", 45.5416, 10.2118, 6), ("Parma", 44.8015, 10.3279, 4), ("Modena", 44.6471, 10.9252, 5),
+    ("Reggio Calabria", 38.1113, 15.6473, 2), ("Perugia", 43.1107, 12.3908, 3), ("Cagliari", 39.2238, 9.1217, 3),
+    ("Ancona", 43.6158, 13.5189, 3), ("Pescara", 42.4618, 14.2161, 3), ("Trento", 46.0748, 11.1217, 4),
+    ("Bolzano", 46.4983, 11.3548, 3), ("Udine", 46.0711, 13.2346, 3), ("Lecce", 40.3515, 18.1750, 2),
+    ("Salerno", 40.6824, 14.7681, 3), ("Sassari", 40.7259, 8.5557, 1), ("Aosta", 45.7370, 7.3154, 1),
+    ("Potenza", 40.6401, 15.8051, 1), ("Campobasso", 41.5603, 14.6627, 1), ("L'Aquila", 42.3498, 13.3995, 1),
+]
+BOUNDS = (35.5, 6.6, 47.1, 18.6)  # sud, ovest, nord, est
+
+FREQUENCIES = [("868 MHz", 85), ("433 MHz", 15)]
+NAME_PREFIXES = ["Rpt", "Node", "Mesh", "Room", "Base", "Mob", "Roof", "Hill"]
+DESCRIPTIONS = [
+    "Ripetitore sul tetto", "Nodo portatile", "Antenna collineare 5 dBi", "Solare con batteria 18650",
+    "Heltec V3 in box stagno", "RAK WisBlock", "Postazione fissa in casa", "Nodo in collina, ottima copertura",
+]
+START_TIMESTAMP = 1704067200   # 01/01/2024
+SPAN_SECONDS = 2 * 365 * 86400
+
+
+def cumulative(weights):
+    return list(itertools.accumulate(weights))
+
+
+def user_weights(users, exponent=0.9):
+    """Distribuzione di Zipf: pochi utenti con molti marker, molti con uno solo."""
+    return cumulative(1 / (rank ** exponent) for rank in range(1, users + 1))
+
+
+def generate(size, seed=42, users=None):
+    """Genera `size` marker realistici (stessi dati a parità di seed)."""
+    rng = random.Random(seed)
+    users = users or max(1, size // 3)
+    user_ids = rng.sample(range(10 ** 8, 10 ** 10), users)
+    user_cum = user_weights(users)
+    city_cum = cumulative(w for *_, w in CITIES)
+    freq_cum = cumulative(w for _, w in FREQUENCIES)
+    south, west, north, east = BOUNDS
+
+    counts = {}  # Marker per utente, per nomi unici
+    markers = []
+    for _ in range(size):
+        user = bisect.bisect_left(user_cum, rng.random() * user_cum[-1])
+        city, lat, lon, _ = CITIES[bisect.bisect_left(city_cum, rng.random() * city_cum[-1])]
+        # Dispersione attorno alla città: metà in centro, il resto in provincia
+        spread = 0.05 if rng.random() < 0.5 else 0.35
+        lat = min(max(rng.gauss(lat, spread), south), north)
+        lon = min(max(rng.gauss(lon, spread / math.cos(math.radians(lat))), west), east)
+        n = counts[user] = counts.get(user, 0) + 1
+        uid = str(user_ids[user])
+        markers.append({
+            'lat': f"{lat:.6f}", 'lon': f"{lon:.6f}",
+            'name': f"{rng.choice(NAME_PREFIXES)}-{city[:3].upper()}-{n}",
+            'desc': rng.choice(DESCRIPTIONS),
+            'node_type': "MeshCore",
+            'frequency': FREQUENCIES[bisect.bisect_left(freq_cum, rng.random() * freq_cum[-1])][0],
+            'link': f"https://example.org/nodi/{uid}/{n}" if rng.random() < 0.3 else "",
+            'ID': uid,
+            'user': f"utente{user}",
+            'timestamp': str(START_TIMESTAMP + rng.randrange(SPAN_SECONDS)),
+            'source': "",
+        })
+    return markers
+
+
+def heaviest_user(markers):
+    """(ID, numero di marker) dell'utente con più marker."""
+    counts = {}
+    for marker in markers:
+        counts[marker['ID']] = counts.get(marker['ID'], 0) + 1
+    return max(counts.items(), key=lambda item: item[1])
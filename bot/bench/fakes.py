@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Oggetti minimi al posto di Update/Context di python-telegram-bot: gli handler
+vengono chiamati direttamente, senza rete. Le risposte vengono solo raccolte."""
+
+import asyncio
+
+
+class FakeUser:
+    def __init__(self, user_id, username=None):
+        self.id = int(user_id)
+        self.username = username
+
+
+class FakeChat:
+    def __init__(self, chat_id, chat_type="private"):
+        self.id = int(chat_id)
+        self.type = chat_type
+
+
+class FakeLocation:
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class FakeMessage:
+    def __init__(self, text=None, location=None, document=None):
+        self.text = text
+        self.location = location
+        self.document = document
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, from_user, message=None):
+        self.data = data
+        self.from_user = from_user
+        self.message = message or FakeMessage()
+        self.edits = []
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+        return self.message
+
+
+class FakeUpdate:
+    def __init__(self, user, message=None, callback_query=None):
+        self.effective_user = user
+        self.effective_chat = FakeChat(user.id)
+        self.message = message
+        self.callback_query = callback_query
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.sent.append((chat_id, document))
+
+
+class FakeApplication:
+    def __init__(self):
+        self.tasks = set()
+
+    def create_task(self, coroutine, *args, **kwargs):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+
+class FakeContext:
+    """Come ContextTypes.DEFAULT_TYPE: user_data persiste tra i passi della stessa conversazione."""
+
+    def __init__(self, args=None, user_data=None):
+        self.args = args or []
+        self.user_data = user_data if user_data is not None else {}
+        self.bot = FakeBot()
+        self.application = FakeApplication()
+        self.error = None
+
+
+def message_update(user, text=None, location=None):
+    return FakeUpdate(user, message=FakeMessage(text, location))
+
+
+def callback_update(user, data):
+    return FakeUpdate(user, callback_query=FakeCallbackQuery(data, user))
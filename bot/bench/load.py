@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""Prova di carico delle conversazioni concorrenti, senza rete.
+
+Costruisce la stessa Application del bot (build_application) con una
+richiesta HTTP finta al posto di Telegram e fa eseguire a N utenti simulati,
+tutti insieme, /add (con posizione e con coordinate scritte), /rename e
+/delete, passando ogni messaggio a process_update. Alla fine riporta
+throughput e latenze (p50/p99) per passo e controlla lo store, in memoria e
+riletto dal disco, per marker persi, duplicati o rimasti dopo l'eliminazione.
+
+Uso (dalla cartella bot):  python -m bench.load --users 300 --markers 10000"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from bench import BOT_DIR
+from bench import dataset
+
+USER_ID_BASE = 10 ** 10  # Fuori dall'intervallo degli ID dei dati sintetici
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': "MeshCore IT", 'username': "meshcore_it_bot",
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+
+class FakeTelegram(BaseRequest):
+    """Richiesta HTTP che risponde al posto dell'API di Telegram e registra i
+    messaggi inviati a ogni chat. Con `latency` ogni chiamata attende quei secondi."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.messages = collections.defaultdict(list)  # {chat_id: [testo, ...]}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, **fields):
+        chat_id = int(params.get('chat_id', 0))
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+        message.update(fields)
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            self.messages[int(params.get('chat_id', 0))].append(params.get('text', ''))
+            result = self._message(params, text=params.get('text', ''))
+        elif endpoint == 'sendDocument':
+            result = self._message(params, document={'file_id': "doc", 'file_unique_id': "doc"})
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def percentile(ordered, fraction):
+    """Percentile con il metodo nearest-rank su una lista ordinata."""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+class SimulatedUser:
+    """Utente che scrive al bot un messaggio alla volta, aspettando la risposta."""
+
+    def __init__(self, harness, index):
+        self.harness = harness
+        self.index = index
+        self.id = USER_ID_BASE + index
+        self.expected = set()  # Nomi che devono restare alla fine
+        self.errors = []
+
+    def update(self, text=None, location=None):
+        message = {
+            'message_id': next(self.harness.message_ids), 'date': int(time.time()),
+            'chat': {'id': self.id, 'type': 'private'},
+            'from': {'id': self.id, 'is_bot': False, 'first_name': f"Utente {self.index}",
+                     'username': f"carico{self.index}"},
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if location is not None:
+            message['location'] = {'latitude': location[0], 'longitude': location[1]}
+        return Update.de_json({'update_id': next(self.harness.update_ids), 'message': message},
+                              self.harness.app.bot)
+
+    async def send(self, step, text=None, location=None):
+        """Invia un messaggio e ritorna le risposte del bot."""
+        messages = self.harness.telegram.messages[self.id]
+        before = len(messages)
+        if self.harness.think:
+            await asyncio.sleep(self.harness.rng.uniform(0, self.harness.think))
+        start = time.perf_counter()
+        await self.harness.app.process_update(self.update(text, location))
+        self.harness.latencies[step].append(time.perf_counter() - start)
+        replies = messages[before:]
+        for reply in replies:
+            if reply in self.harness.error_messages:
+                self.errors.append((step, reply))
+        return replies
+
+    def position(self, name, replies):
+        """Numero del marker `name` nella lista numerata inviata dal bot."""
+        for reply in replies:
+            match = re.search(rf'^(\d+)\. {re.escape(name)}$', reply, re.MULTILINE)
+            if match:
+                return match.group(1)
+        self.errors.append(('list', f"{name} non presente nella lista"))
+        return "0"
+
+    async def run(self):
+        first, second, renamed = f"L{self.index}-a", f"L{self.index}-b", f"L{self.index}-r"
+        lat, lon = self.harness.rng.choice(dataset.CITIES)[1:3]
+
+        # /add con la posizione di Telegram, senza link
+        await self.send('add', "/add")
+        await self.send('add_location', location=(lat, lon))
+        await self.send('add_name', first)
+        await self.send('select_frequency', "868 MHz")
+        await self.send('enter_description', "Prova di carico")
+        await self.send('add_link_ask', "No")
+
+        # /add con coordinate scritte e link
+        await self.send('add', "/add")
+        await self.send('add_lat', f"{lat + 0.01:.5f}")
+        await self.send('add_lon', f"{lon + 0.01:.5f}")
+        await self.send('add_name', second)
+        await self.send('select_frequency', "433 MHz")
+        await self.send('enter_description', "Secondo nodo")
+        await self.send('add_link_ask', "Si")
+        await self.send('add_link', f"https://example.org/carico/{self.index}")
+
+        # /rename del primo e /delete del secondo
+        replies = await self.send('rename', "/rename")
+        await self.send('rename_select', self.position(first, replies))
+        await self.send('rename_new_name', renamed)
+        replies = await self.send('delete', "/delete")
+        await self.send('delete_select', self.position(second, replies))
+        self.expected = {renamed}
+
+
+class LoadHarness:
+    def __init__(self, bot, users, latency=0.0, think=0.0, seed=42):
+        self.bot = bot
+        self.telegram = FakeTelegram(latency)
+        self.app = bot.build_application("123456:CARICO", request=self.telegram)
+        self.users = [SimulatedUser(self, i) for i in range(users)]
+        self.think = think
+        self.rng = random.Random(seed)
+        self.latencies = collections.defaultdict(list)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.error_messages = {bot.MESSAGES[key] for key in ("error_generic", "err_operation_in_progress",
+                                                             "err_duplicate_name", "timed_out")}
+
+    async def run(self):
+        # Stessa sequenza di run_polling, senza il polling: i job e i timeout delle conversazioni sono attivi
+        await self.app.initialize()
+        await self.bot.post_init(self.app)
+        await self.app.start()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(user.run() for user in self.users), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        memory = self.check(self.bot.store.all())
+        await self.app.stop()
+        await self.app.shutdown()
+        await self.bot.post_shutdown(self.app)  # Scrive le modifiche ancora in coda
+        return elapsed, results, memory
+
+    def check(self, markers):
+        """Confronta i marker degli utenti simulati con quelli attesi."""
+        found = collections.defaultdict(list)
+        for marker in markers:
+            uid = int(marker['ID']) if marker['ID'].isdigit() else 0
+            if uid >= USER_ID_BASE:
+                found[uid].append(marker['name'])
+        report = {'lost': [], 'duplicated': [], 'unexpected': []}
+        for user in self.users:
+            names = found.get(user.id, [])
+            counts = collections.Counter(names)
+            report['lost'].extend(f"{user.id}:{n}" for n in sorted(user.expected - set(names)))
+            report['duplicated'].extend(f"{user.id}:{n}" for n, c in sorted(counts.items()) if c > 1)
+            report['unexpected'].extend(f"{user.id}:{n}" for n in sorted(set(names) - user.expected))
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prova di carico delle conversazioni concorrenti")
+    parser.add_argument("--users", type=int, default=200, help="utenti simulati contemporanei")
+    parser.add_argument("--markers", type=int, default=10000, help="marker sintetici già presenti")
+    parser.add_argument("--backend", default="journal", help="csv, journal o sqlite")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="latenza simulata di Telegram (ms)")
+    parser.add_argument("--think", type=float, default=0.0, help="pausa casuale massima tra i messaggi (ms)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="file JSON con i risultati")
+    parser.add_argument("--keep", action="store_true", help="non cancella la cartella temporanea")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix=f"load-{args.backend}-")
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    try:
+        os.chdir(directory)
+        os.makedirs("shared")
+        sys.path.insert(0, BOT_DIR)
+        os.environ.update({'STORAGE_BACKEND': args.backend, 'API_ENABLED': '0', 'METRICS_ENABLED': '0'})
+        from store import write_csv_file
+        write_csv_file("shared/dati.csv", dataset.generate(args.markers, args.seed) if args.markers else [])
+
+        import bot
+        logging.disable(logging.WARNING)
+        bot.LOG_ENABLED = False  # Niente log agli admin: solo il traffico degli utenti
+        harness = LoadHarness(bot, args.users, args.api_latency / 1000, args.think / 1000, args.seed)
+        elapsed, results, memory = asyncio.run(harness.run())
+
+        # Rilettura dal disco: le modifiche confermate devono essere state scritte
+        bot.store._loaded = False
+        bot.store.refresh()
+        disk = harness.check(bot.store.all())
+        bot.astore.executor.shutdown(wait=True)
+        logging.disable(logging.NOTSET)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Dati conservati in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    crashed = [r for r in results if isinstance(r, BaseException)]
+    errors = [e for user in harness.users for e in user.errors]
+    updates = sum(len(samples) for samples in harness.latencies.values())
+    all_samples = [s for samples in harness.latencies.values() for s in samples]
+    result = {
+        'users': args.users,
+        'markers': args.markers,
+        'backend': args.backend,
+        'api_latency_ms': args.api_latency,
+        'elapsed_seconds': round(elapsed, 3),
+        'updates': updates,
+        'updates_per_second': round(updates / elapsed, 1) if elapsed else 0.0,
+        'latency': latency_summary(all_samples),
+        'steps': {step: latency_summary(samples) for step, samples in sorted(harness.latencies.items())},
+        'api_calls': dict(sorted(harness.telegram.calls.items())),
+        'crashed_users': len(crashed),
+        'errors': len(errors),
+        'memory': {k: len(v) for k, v in memory.items()},
+        'disk': {k: len(v) for k, v in disk.items()},
+    }
+
+    print(f"{args.users} utenti, {updates} messaggi in {elapsed:.2f} s ({result['updates_per_second']} msg/s)")
+    print(f"Latenza complessiva: p50 {result['latency']['p50_ms']} ms, p99 {result['latency']['p99_ms']} ms")
+    for step, stats in result['steps'].items():
+        print(f"  {step:20} p50 {stats['p50_ms']:9.3f} ms   p99 {stats['p99_ms']:9.3f} ms   ({stats['n']})")
+    for exc in crashed[:5]:
+        print(f"Utente interrotto da un'eccezione: {exc!r}")
+    for step, text in errors[:10]:
+        print(f"Errore al passo {step}: {text.splitlines()[0] if text else ''}")
+    for where, report in (("in memoria", memory), ("su disco", disk)):
+        print(f"Store {where}: {len(report['lost'])} persi, {len(report['duplicated'])} duplicati, "
+              f"{len(report['unexpected'])} non attesi")
+        for kind, items in report.items():
+            if items:
+                print(f"  {kind}: {', '.join(items[:10])}{' ...' if len(items) > 10 else ''}")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+    ok = not crashed and not errors and not any(memory.values()) and not any(disk.values())
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
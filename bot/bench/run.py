@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Tempi dello store e degli handler al crescere della mappa.
+
+Ogni combinazione (backend, dimensione) gira in un processo separato, in una
+cartella temporanea con il proprio shared/dati.csv sintetico: il modulo del
+bot viene importato da zero e i risultati non dipendono dai run precedenti.
+Il risultato è un file JSON con chiavi ordinate, da confrontare tra commit
+con bench.compare."""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import BOT_DIR
+from bench import dataset
+from bench.fakes import FakeContext, FakeLocation, FakeUser, callback_update, message_update
+
+DEFAULT_SIZES = "10000,100000,1000000"
+BENCH_USER_ID = 99  # Non compare nei dati sintetici (ID da 9 cifre in su)
+ROMA = (41.9028, 12.4964)
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'min': round(ordered[0], 9),
+        'median': round(statistics.median(ordered), 9),
+        'mean': round(statistics.fmean(ordered), 9),
+        'max': round(ordered[-1], 9),
+    }
+
+
+def measure(func, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def ameasure(func, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        await func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_marker(i):
+    return {'lat': str(ROMA[0] + i * 0.001), 'lon': str(ROMA[1]), 'name': f"bench-{i}", 'desc': "bench",
+            'node_type': "MeshCore", 'frequency': "868 MHz", 'link': "", 'ID': str(BENCH_USER_ID),
+            'user': "bench", 'timestamp': str(int(time.time())), 'source': ""}
+
+
+# -------------- MISURE (processo worker) --------------
+
+def storage_timings(bot, heavy_uid, repeat):
+    store = bot.store
+    results = {}
+
+    def full_load(_):
+        store._loaded = False  # Come una modifica esterna del CSV: rilettura completa
+        store.refresh()
+
+    results['store.load'] = measure(full_load, repeat)
+    results['store.refresh_unchanged'] = measure(lambda _: store.refresh(), repeat)
+    results['store.snapshot'] = measure(lambda _: store.snapshot(), repeat)
+    results['store.user_markers'] = measure(lambda _: store.user_markers(heavy_uid), repeat)
+    results['store.name_keys'] = measure(lambda _: store.name_keys(), repeat)
+    results['build_indexes'] = measure(lambda _: bot.build_indexes(), repeat)
+
+    # Commit singoli (il vecchio safe_write_markers): aggiunta, rinomina e rimozione
+    results['store.commit_add'] = measure(
+        lambda i: store.commit([{'op': 'add', 'marker': bench_marker(i)}]), repeat)
+    results['store.commit_rename'] = measure(
+        lambda i: store.commit([{'op': 'rename', 'ID': str(BENCH_USER_ID), 'name': f"bench-{i}",
+                                 'new_name': f"bench-r{i}"}]), repeat)
+    results['store.commit_delete'] = measure(
+        lambda i: store.commit([{'op': 'delete', 'ID': str(BENCH_USER_ID), 'name': f"bench-r{i}"}]), repeat)
+    results['store.compact'] = measure(lambda _: store.compact(), repeat)
+    return results
+
+
+async def handler_timings(bot, heavy_uid, repeat):
+    results = {}
+    user = FakeUser(BENCH_USER_ID, "bench")
+    heavy = FakeUser(heavy_uid, "heavy")
+    admin = FakeUser(bot.ADMIN_IDS[0], "admin")
+
+    results['handler.list_markers'] = await ameasure(
+        lambda _: bot.list_markers(message_update(heavy, "/list"), FakeContext()), repeat)
+    results['handler.admin_stats'] = await ameasure(
+        lambda _: bot.admin_stats(callback_update(admin, "stats"), FakeContext()), repeat)
+
+    async def near(_):
+        context = FakeContext()
+        await bot.near(message_update(user, "/near"), context)
+        await bot.near_location(message_update(user, location=FakeLocation(*ROMA)), context)
+    results['handler.near'] = await ameasure(near, repeat)
+
+    # Marker dell'utente di prova, usati poi da rinomina ed eliminazione
+    applications = []
+
+    async def finish_add(i):
+        context = FakeContext(user_data={'lat': ROMA[0] + i * 0.001, 'lon': ROMA[1], 'name': f"h-{i}",
+                                         'node_type': "MeshCore", 'frequency': "868 MHz", 'desc': "bench"})
+        applications.append(context.application)
+        await bot.finish_add(message_update(user, "no"), context)
+    results['handler.finish_add'] = await ameasure(finish_add, repeat)
+
+    # Ogni passo della conversazione viene misurato a parte, con lo stesso context
+    steps = {}
+
+    async def conversation(name, messages):
+        context = FakeContext()
+        for handler, text in messages:
+            start = time.perf_counter()
+            await handler(message_update(user, text), context)
+            steps.setdefault(f"handler.{name}.{handler.__name__}", []).append(time.perf_counter() - start)
+
+    for i in range(repeat):
+        await conversation("rename", [(bot.rename, "/rename"), (bot.rename_select, "1"),
+                                      (bot.rename_new_name, f"hr-{i}")])
+    for i in range(repeat):
+        await conversation("delete", [(bot.delete, "/delete"), (bot.delete_select, "1")])
+    results.update({name: summarize(samples) for name, samples in steps.items()})
+
+    # Notifiche di zona avviate da finish_add
+    for application in applications:
+        if application.tasks:
+            await asyncio.gather(*application.tasks)
+    return results
+
+
+def file_sizes(paths):
+    return {path: os.path.getsize(path) for path in paths if os.path.exists(path)}
+
+
+def worker(size, backend, seed, repeat, result_path):
+    """Eseguito nella cartella temporanea: genera i dati, importa il bot e misura."""
+    os.makedirs("shared", exist_ok=True)
+    sys.path.insert(0, BOT_DIR)
+    os.environ.update({'STORAGE_BACKEND': backend, 'API_ENABLED': '0', 'METRICS_ENABLED': '0'})
+    from store import write_csv_file
+
+    setup = {}
+    start = time.perf_counter()
+    markers = dataset.generate(size, seed)
+    setup['generate'] = round(time.perf_counter() - start, 6)
+    start = time.perf_counter()
+    write_csv_file("shared/dati.csv", markers)
+    setup['write_csv'] = round(time.perf_counter() - start, 6)
+    heavy_uid, heavy_count = dataset.heaviest_user(markers)
+    users = len({m['ID'] for m in markers})
+    del markers
+
+    start = time.perf_counter()
+    import bot  # Crea lo store (con SQLite importa il CSV)
+    setup['import_bot'] = round(time.perf_counter() - start, 6)
+    logging.disable(logging.WARNING)  # I log degli handler falserebbero i tempi
+    bot.LOG_ENABLED = False
+    bot.store.refresh()
+    bot.build_indexes()
+
+    timings = storage_timings(bot, heavy_uid, repeat)
+    timings.update(asyncio.run(handler_timings(bot, heavy_uid, repeat)))
+    bot.astore.executor.shutdown(wait=True)
+
+    result = {
+        'rows': size,
+        'users': users,
+        'heaviest_user_markers': heavy_count,
+        'setup_seconds': setup,
+        'file_bytes': file_sizes([bot.FILE, bot.JOURNAL_FILE, bot.DB_FILE]),
+        'timings': timings,
+    }
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# -------------- ORCHESTRAZIONE --------------
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_worker(size, backend, seed, repeat, keep=False):
+    directory = tempfile.mkdtemp(prefix=f"bench-{backend}-{size}-")
+    result_path = os.path.join(directory, "result.json")
+    env = dict(os.environ, PYTHONPATH=BOT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    command = [sys.executable, "-m", "bench.run", "--worker", "--sizes", str(size), "--backends", backend,
+               "--seed", str(seed), "--repeat", str(repeat), "--output", result_path]
+    try:
+        subprocess.run(command, cwd=directory, env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path, encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        if keep:
+            print(f"  dati conservati in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_result(backend, result):
+    print(f"\n[{backend}] {result['rows']} righe, {result['users']} utenti "
+          f"(max {result['heaviest_user_markers']} marker per utente)")
+    for name, stats in sorted(result['timings'].items()):
+        print(f"  {name:45} mediana {stats['median'] * 1000:10.3f} ms   min {stats['min'] * 1000:10.3f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dello store e degli handler su mappe sintetiche")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="numero di marker, separati da virgola")
+    parser.add_argument("--backends", default="journal", help="csv, journal e/o sqlite, separati da virgola")
+    parser.add_argument("--repeat", type=int, default=5, help="ripetizioni di ogni misura")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--keep", action="store_true", help="non cancella le cartelle temporanee")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    backends = args.backends.split(",")
+    if args.worker:
+        worker(sizes[0], backends[0], args.seed, args.repeat, args.output)
+        return
+
+    runs = {}
+    for backend in backends:
+        for size in sizes:
+            print(f"Benchmark {backend} con {size} marker...", flush=True)
+            result = run_worker(size, backend, args.seed, args.repeat, args.keep)
+            runs.setdefault(backend, {})[str(size)] = result
+            print_result(backend, result)
+
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'runs': runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"\nRisultati salvati in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,40 @@
 # -*- coding: utf-8 -*-
 
-import csv
 import re
 import os
-import tempfile
-import shutil
 import logging
 import sys
 import json
 import time
+import html
 import traceback
+import asyncio
+import functools
 from telegram.constants import ParseMode
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, Update, ReplyKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters, ConversationHandler, JobQueue
-
-user_operations = {}  # {user_id_str: {'operation': 'add'}
-active_users = set() # Set che tiene traccia degli utenti in conversazione
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters, ConversationHandler, JobQueue, TypeHandler
+from store import MarkerStore, CsvBackend, JournaledCsvBackend, SQLiteBackend, name_key
+from projections import ProjectionWorker, csv_projection
+from feed import FeedWriter
+from tiles import ClusterPyramid
+from coverage import CoverageLayer
+from aiostore import AsyncStore
+from metrics import LoopLagMonitor, MetricsRegistry, TimedBackend, TimedRequest, timed
+from spatial import GridIndex, compass_point
+from subscriptions import SubscriptionIndex
+from dispatcher import MessageDispatcher
+from broadcast import UserRegistry, BroadcastJob
+from stats import StatsAggregator
+from inactive import InactivityTracker
+from export import Exporter, ExportError, parse_export_args, FORMATS
+from importer import BulkImporter, UploadError, report_csv
+from duplicates import find_duplicates, similar_nearby
+from ingest import MeshCoreIngester, SOURCE as MESHCORE_SOURCE
+from api import MarkerAPI
+from dispatcher import split_text
+from sessions import SessionManager
+from textutils import clean_text
 
 ############################################
 #                                          #
@@ -30,15 +49,141 @@ FILE = "shared/dati.csv"
 ENCODING = "utf-8"
 LOG_STATE_FILE = "log_state.json"
 
+# Backend di archiviazione:
+#   "journal" -> CSV condiviso + journal delle modifiche, compattato periodicamente
+#   "csv"     -> il CSV condiviso viene riscritto a ogni modifica
+#   "sqlite"  -> database WAL, il CSV condiviso viene rigenerato in background
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "journal")
+DB_FILE = "markers.db"
+PROJECTION_DELAY_SECONDS = 1
+
+# Feed precompilato per la pagina web (shared/nodes.json + .gz/.br + manifest)
+FEED_DIR = "shared"
+FEED_NAME = "nodes"
+
+# Piramide di cluster precalcolata per la mappa (shared/tiles/<insieme>/z/x/y.json).
+# Si salvano solo gli zoom fino a TILES_MAX_ZOOM: oltre, la pagina disegna i singoli nodi
+# dell'area visibile dal feed che ha già caricato.
+TILES_DIR = "shared/tiles"
+TILES_MAX_ZOOM = 12
+TILES_CELL_PX = 64
+
+# Copertura stimata dei nodi (shared/coverage/<insieme>/<riga>_<colonna>.png + index.json).
+# Modello log-distance per banda: la stima ignora il terreno, serve solo come indicazione.
+COVERAGE_DIR = "shared/coverage"
+COVERAGE_BOUNDS = (35.0, 6.0, 47.5, 19.0)  # sud, ovest, nord, est
+COVERAGE_CELL_DEG = 0.01                   # Circa 1 km
+COVERAGE_CACHE_MB = 64                     # Contributi dei singoli nodi tenuti in memoria
+COVERAGE_MODELS = {
+    "433 MHz": {"frequency_mhz": 433, "tx_power_dbm": 20, "antenna_gain_dbi": 2,
+                "sensitivity_dbm": -120, "exponent": 3.5, "max_km": 50},
+    "868 MHz": {"frequency_mhz": 868, "tx_power_dbm": 22, "antenna_gain_dbi": 2,
+                "sensitivity_dbm": -120, "exponent": 3.5, "max_km": 50},
+}
+
+# Importazione dei nodi MeshCore da un'API JSON o da un file esportato (vuoti = disattivata).
+# A ogni sync vengono scritti solo i nodi nuovi, cambiati o spariti.
+INGEST_URL = os.getenv("MESHCORE_API_URL", "")
+INGEST_FILE = os.getenv("MESHCORE_NODES_FILE", "")
+INGEST_STATE_FILE = "ingest_state.json"
+INGEST_SECONDS = 900
+INGEST_BOUNDS = (35.0, 6.0, 47.5, 19.0)  # Solo i nodi in Italia: sud, ovest, nord, est
+INGEST_REMOVE_MISSING = True            # Rimuove i nodi importati non più presenti nella lista
+
+# API HTTP in sola lettura per i partner (es. MapForHam): GET http://<host>:API_PORT/api/nodes
+API_ENABLED = os.getenv("API_ENABLED", "1") == "1"
+API_HOST = "0.0.0.0"
+API_PORT = int(os.getenv("API_PORT", "8086"))
+API_DEFAULT_LIMIT = 500
+API_MAX_LIMIT = 5000
+API_CACHE_ENTRIES = 256  # Pagine e risultati serializzati tenuti in memoria per la versione corrente
+
+# Ricerca dei nodi vicini (/near): griglia con celle di NEAR_CELL_DEG gradi
+NEAR_CELL_DEG = 0.1
+NEAR_RESULTS = 5
+
+# Notifiche "nuovo nodo nella tua zona" (/subscribe)
+SUBSCRIPTIONS_FILE = "subscriptions.json"
+SUBSCRIPTION_CELL_DEG = 0.25
+SUBSCRIPTION_RADII = [5, 10, 25, 50]  # Raggi proposti sulla tastiera (km)
+MAX_SUBSCRIPTION_RADIUS_KM = 100
+MAX_SUBSCRIPTIONS_PER_USER = 5
+
+# Esportazioni (/export): file gzip in cache per (versione dati, parametri)
+EXPORT_DIR = "exports"
+EXPORT_CACHE_FILES = 20
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # Limite Telegram per i documenti inviati dai bot
+
+# Possibili duplicati: nodi entro DUPLICATE_DISTANCE_KM con nomi simili (somiglianza 0-1)
+DUPLICATE_DISTANCE_KM = 0.2
+DUPLICATE_SIMILARITY = 0.85
+DUPLICATE_WARNING = True  # Avvisa durante /add se vicino c'è già un nodo con nome simile
+DUPLICATE_REPORT_GROUPS = 30
+
+# Importazione in blocco (/import): limite di download dei file per i bot
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+MAX_IMPORT_ROWS = 100000
+
+# Messaggi in uscita: limite globale (messaggi/secondo) e intervallo minimo per chat
+OUTBOUND_RATE = 25
+OUTBOUND_CHAT_INTERVAL = 1.0
+LOG_DIGEST_SECONDS = 300  # Intervallo del riepilogo log per gli admin (se attivo dal menu)
+
+# Conferma dei nodi inattivi: dopo INACTIVE_CONFIRM_DAYS dall'ultima conferma il proprietario
+# riceve una richiesta; senza risposta entro INACTIVE_GRACE_DAYS il nodo viene rimosso
+CONFIRM_STATE_FILE = "confirm_state.json"
+INACTIVE_CONFIRM_DAYS = 180
+INACTIVE_GRACE_DAYS = 14
+INACTIVE_SWEEP_SECONDS = 3600
+INACTIVE_MAX_PROMPTS = 500  # Richieste per giro (le altre al giro successivo)
+
+# Registro utenti e annunci (/broadcast)
+USERS_FILE = "users.json"
+USERS_SAVE_SECONDS = 60
+BROADCAST_STATE_FILE = "broadcast_state.json"  # Checkpoint per riprendere l'invio dopo un riavvio
+BROADCAST_BLOCK = 50             # Destinatari per blocco (il checkpoint è salvato dopo ogni blocco)
+BROADCAST_PROGRESS_SECONDS = 5   # Intervallo di aggiornamento del messaggio di avanzamento
+
+# Scritture raggruppate: le modifiche arrivate entro questa finestra vengono salvate insieme
+WRITE_BATCH_SECONDS = 0.05
+WRITE_BATCH_MAX = 500
+
+# Thread dedicati alle operazioni su file (lettura/scrittura dei marker)
+STORAGE_WORKERS = 4
+
+# Monitoraggio reattività dell'event loop
+LOOP_LAG_INTERVAL = 0.5
+LOOP_LAG_WARN_SECONDS = 0.2
+
+# Metriche in formato Prometheus (latenze degli handler, store, API Telegram, code):
+# GET http://METRICS_HOST:METRICS_PORT/metrics e/o file riscritto ogni METRICS_SAVE_SECONDS
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_FILE = os.getenv("METRICS_FILE", "")  # Es. per il textfile collector di node_exporter
+METRICS_SAVE_SECONDS = 15
+
+# Journal delle modifiche (backend "journal")
+JOURNAL_FILE = "shared/dati.journal"
+JOURNAL_HISTORY_FILE = "journal_history.jsonl"
+JOURNAL_MAX_BYTES = 1024 * 1024  # Oltre questa dimensione il journal viene compattato subito
+JOURNAL_COMPACT_SECONDS = 30     # Intervallo di compattazione (aggiorna il CSV letto dal web)
+
 # Limiti di input
 MAX_NAME_LENGTH = 18
 MAX_DESC_LENGTH = 130
 MAX_LINK_LENGTH = 70
+URL_PATTERN = r'^https?://[^\s]+$'  # Link accettati
 MAX_MARKERS_PER_USER = 6
 MAX_MARKERS_FOR_SPECIAL_USERS = MAX_MARKERS_PER_USER*2
 
-# Timeout conversazioni
+# Timeout conversazioni (anche scadenza delle sessioni, rinnovata a ogni passo)
 TIMEOUT_SECONDS = 300
+MAX_SESSIONS = 10000           # Oltre questo numero vengono scartate le sessioni meno recenti
+SESSIONS_SWEEP_SECONDS = 60
+# Le conversazioni di python-telegram-bot non sono persistenti: dopo un riavvio
+# ripartono da zero, quindi di default anche le sessioni non vengono salvate
+SESSIONS_FILE = None
 
 # Utenti speciali (da usare come array numerici)
 ADMIN_IDS = [1608289624]
@@ -51,6 +196,8 @@ MESSAGES = {
              "✏️ Rinomina marker - /rename\n"
              "🗑️ Elimina marker - /delete\n"
              "📍 Lista marker - /list\n"
+             "📡 Nodi vicini - /near\n"
+             "🔔 Avvisi nuovi nodi in zona - /subscribe\n"
              "🛑 Annulla operazione - /abort",
     "unknown_command": "❌ Comando non riconosciuto. Usa /start per iniziare",
     "no_markers": "❌ Non hai ancora aggiunto marker",
@@ -70,6 +217,7 @@ MESSAGES = {
     "error_position": "❌ Valore non valido. Invia la posizione o inserisci le coordinate manualmente",
     "error_value": "❌ Valore non valido",
     "err_no_active_operation": "❌ Nessuna operazione in corso",
+    "err_invalid_frequency": f"❌ Frequenza non valida. Usa: {', '.join(FREQUENCIES)}",
     "cancelled": "🛑 Operazione annullata",
     "add_lat": "📍 Inserisci la latitudine oppure invia la posizione:",
     "add_lon": "📍 Inserisci la longitudine:",
@@ -86,6 +234,47 @@ MESSAGES = {
     "marker_added": "✅ Marker aggiunto con successo!",
     "marker_deleted": "🗑️ Marker eliminato",
     "name_updated": "✅ Nome aggiornato!",
+    "near_location": "📍 Invia la posizione o scrivi le coordinate (es. 45.54, 10.22):",
+    "near_results": "📡 <b>Nodi più vicini</b>\n\n",
+    "near_none": "❌ Nessun nodo trovato",
+    "subscribe_location": "📍 Invia la posizione o scrivi le coordinate del centro della zona (es. 45.54, 10.22):",
+    "subscribe_radius": f"📏 Inserisci il raggio in km (max {MAX_SUBSCRIPTION_RADIUS_KM}):",
+    "err_invalid_radius": f"❌ Raggio non valido. Inserisci un numero di km tra 1 e {MAX_SUBSCRIPTION_RADIUS_KM}",
+    "err_max_subscriptions": f"❌ Hai già {MAX_SUBSCRIPTIONS_PER_USER} zone. Eliminane una con /unsubscribe",
+    "subscribed": "🔔 Iscrizione salvata! Riceverai un messaggio per ogni nuovo nodo nella zona",
+    "no_subscriptions": "❌ Non hai zone attive. Usa /subscribe per aggiungerne una",
+    "your_subscriptions": "🔔 Le tue zone:\n\n",
+    "unsubscribe_usage": "\nUsa /unsubscribe <numero> per eliminarne una, /unsubscribe tutte per eliminarle tutte",
+    "unsubscribed": "🔕 Iscrizione eliminata",
+    "unsubscribed_all": "🔕 Tutte le iscrizioni sono state eliminate",
+    "export_usage": "📤 Uso: /export [csv|geojson|kml|gpx] [regione=lombardia | bbox=sud,ovest,nord,est] "
+                    "[freq=868] [dal=AAAA-MM-GG] [al=AAAA-MM-GG]",
+    "export_running": "⏳ Esportazione in corso...",
+    "export_too_large": "❌ File troppo grande per Telegram. Restringi l'esportazione con i filtri",
+    "import_file": "📥 Invia il file da importare (.csv o .geojson) come documento.\n"
+                   "Colonne: lat, lon, name, frequency e facoltative desc, link, node_type, ID, user, timestamp.\n"
+                   "Le righe senza ID vengono assegnate a te. Usa /abort per annullare",
+    "import_not_document": "❌ Invia il file come documento (.csv o .geojson)",
+    "import_too_large": f"❌ File troppo grande. Massimo {MAX_IMPORT_BYTES // (1024 * 1024)} MB",
+    "import_running": "⏳ Importazione in corso...",
+    "duplicate_warning": "⚠️ Vicino a questa posizione ci sono già nodi con un nome simile:\n{nodes}\n"
+                         "Se è lo stesso nodo usa /abort, altrimenti prosegui.",
+    "duplicates_none": "✅ Nessun possibile duplicato trovato",
+    "duplicates_usage": "🔁 Uso: /duplicates [distanza in metri]",
+    "sync_disabled": "❌ Importazione MeshCore non configurata (MESHCORE_API_URL o MESHCORE_NODES_FILE)",
+    "sync_running": "⏳ Sincronizzazione dei nodi MeshCore in corso...",
+    "sync_unchanged": "✅ Nodi MeshCore già aggiornati",
+    "broadcast_usage": "📣 Uso: /broadcast <testo dell'annuncio>",
+    "broadcast_too_long": "❌ L'annuncio è troppo lungo (massimo 4096 caratteri)",
+    "broadcast_running": "❌ C'è già un annuncio in invio",
+    "broadcast_cancelled": "🛑 Annuncio annullato",
+    "broadcast_stopping": "🛑 Interruzione dell'invio in corso...",
+    "inactive_prompt": "🕰️ Da tempo non confermi questi nodi. Sono ancora attivi?\n"
+                       "Senza risposta entro {days} giorni verranno rimossi dalla mappa.",
+    "inactive_confirmed": "✅ Confermato: {name}",
+    "inactive_removed_by_user": "🗑️ Rimosso: {name}",
+    "inactive_removed": "🗑️ Questi nodi sono stati rimossi dalla mappa perché non confermati:\n{names}",
+    "inactive_unknown": "❌ Nodo non più presente",
     "not_authorized": "⛔ Accesso negato",
     "timed_out": "⏳ Sessione scaduta per inattività. Usa /start per ricominciare."
 }
@@ -94,8 +283,113 @@ MESSAGES = {
 (
     ADD_LAT, ADD_LON, ADD_NAME, ADD_LINK_ASK, 
     ADD_LINK, RENAME_SELECT, RENAME_NEW_NAME, DELETE_SELECT, 
-    SELECT_NODE_TYPE, SELECT_FREQUENCY, ENTER_DESCRIPTION
-) = range(11)
+    SELECT_NODE_TYPE, SELECT_FREQUENCY, ENTER_DESCRIPTION,
+    NEAR_LOCATION, SUBSCRIBE_LOCATION, SUBSCRIBE_RADIUS, IMPORT_FILE
+) = range(15)
+
+# Metriche: durate degli handler, dello store, delle proiezioni e delle chiamate a Telegram
+metrics = MetricsRegistry()
+handler_seconds = metrics.histogram("handler_seconds", "Durata degli handler e degli stati delle conversazioni", ["handler"])
+handler_errors = metrics.counter("handler_errors_total", "Eccezioni negli handler", ["handler"])
+storage_seconds = metrics.histogram("storage_seconds", "Durata delle operazioni del backend di archiviazione", ["operation"])
+projection_seconds = metrics.histogram("projection_seconds", "Durata della rigenerazione dei file derivati", ["projection"])
+telegram_seconds = metrics.histogram("telegram_request_seconds", "Durata delle chiamate all'API di Telegram", ["method"])
+telegram_errors = metrics.counter("telegram_request_errors_total", "Errori di rete verso l'API di Telegram", ["method"])
+
+# Archivio marker in memoria, indicizzato per utente
+if STORAGE_BACKEND == "sqlite":
+    backend = SQLiteBackend(DB_FILE, import_csv=FILE, encoding=ENCODING)
+elif STORAGE_BACKEND == "journal":
+    backend = JournaledCsvBackend(
+        FILE, JOURNAL_FILE,
+        history_path=JOURNAL_HISTORY_FILE,
+        max_bytes=JOURNAL_MAX_BYTES,
+        encoding=ENCODING
+    )
+else:
+    backend = CsvBackend(FILE, ENCODING)
+store = MarkerStore(TimedBackend(backend, storage_seconds))
+
+# Interfaccia asincrona: I/O su pool di thread, unico writer che raggruppa i commit concorrenti
+astore = AsyncStore(store, max_workers=STORAGE_WORKERS, window=WRITE_BATCH_SECONDS, max_batch=WRITE_BATCH_MAX)
+loop_lag = LoopLagMonitor(interval=LOOP_LAG_INTERVAL, warn_threshold=LOOP_LAG_WARN_SECONDS)
+
+# File derivati dallo store, rigenerati in background
+projections = ProjectionWorker(store, delay=PROJECTION_DELAY_SECONDS, histogram=projection_seconds)
+if STORAGE_BACKEND == "sqlite":
+    projections.register("csv", csv_projection(FILE))
+feed = FeedWriter(FEED_DIR, FEED_NAME)
+projections.register("feed", feed.projection())
+cluster_tiles = ClusterPyramid(TILES_DIR, max_zoom=TILES_MAX_ZOOM, cell_px=TILES_CELL_PX)
+projections.register("tiles", cluster_tiles.projection())
+coverage = CoverageLayer(COVERAGE_DIR, COVERAGE_MODELS, bounds=COVERAGE_BOUNDS,
+                         cell_deg=COVERAGE_CELL_DEG, cache_mb=COVERAGE_CACHE_MB)
+projections.register("coverage", coverage.projection())
+
+# Indice spaziale per /near e per l'API e statistiche admin, aggiornati a ogni commit dello store
+near_index = GridIndex(cell_deg=NEAR_CELL_DEG)
+store.add_listener(near_index.apply)
+api = MarkerAPI(near_index, FREQUENCIES, host=API_HOST, port=API_PORT, default_limit=API_DEFAULT_LIMIT,
+                max_limit=API_MAX_LIMIT, cache_size=API_CACHE_ENTRIES, executor=astore.executor)
+marker_stats = StatsAggregator()
+store.add_listener(marker_stats.apply)
+
+# Nodi MeshCore importati (hash per nodo aggiornati a ogni commit dello store)
+ingester = MeshCoreIngester(INGEST_STATE_FILE, FREQUENCIES, url=INGEST_URL or None, path=INGEST_FILE or None,
+                            bounds=INGEST_BOUNDS, remove_missing=INGEST_REMOVE_MISSING)
+store.add_listener(ingester.apply)
+ingest_lock = asyncio.Lock()
+
+# Scadenze di conferma dei nodi (heap), aggiornate a ogni commit dello store
+inactivity = InactivityTracker(CONFIRM_STATE_FILE, INACTIVE_CONFIRM_DAYS * 86400, INACTIVE_GRACE_DAYS * 86400)
+store.add_listener(inactivity.apply)
+
+# Coda dei messaggi in uscita (log admin, notifiche)
+dispatcher = MessageDispatcher(
+    rate=OUTBOUND_RATE,
+    chat_interval=OUTBOUND_CHAT_INTERVAL,
+    digest_interval=LOG_DIGEST_SECONDS
+)
+
+# Esportazioni in streaming con cache
+exporter = Exporter(store, EXPORT_DIR, max_files=EXPORT_CACHE_FILES)
+
+# Importazione in blocco con le stesse regole dell'inserimento manuale
+importer = BulkImporter(FREQUENCIES, MAX_NAME_LENGTH, MAX_DESC_LENGTH, MAX_LINK_LENGTH, URL_PATTERN,
+                        max_rows=MAX_IMPORT_ROWS)
+
+# Operazione in corso per utente (add, rename, ...), con scadenza
+sessions = SessionManager(TIMEOUT_SECONDS, max_sessions=MAX_SESSIONS, path=SESSIONS_FILE)
+
+# Utenti che hanno scritto al bot (destinatari degli annunci) e annuncio in corso
+users = UserRegistry(USERS_FILE)
+broadcast_job = None
+
+# Zone per le notifiche dei nuovi nodi
+subscriptions = SubscriptionIndex(SUBSCRIPTIONS_FILE, cell_deg=SUBSCRIPTION_CELL_DEG)
+
+# Metriche lette al momento dell'esposizione
+def file_sizes():
+    paths = [FILE, DB_FILE if STORAGE_BACKEND == "sqlite" else JOURNAL_FILE, JOURNAL_HISTORY_FILE,
+             feed.path(".json"), USERS_FILE, SUBSCRIPTIONS_FILE, CONFIRM_STATE_FILE]
+    return {path: os.path.getsize(path) for path in paths if os.path.exists(path)}
+
+metrics.gauge("file_bytes", "Dimensione dei file di dati", ["path"], func=file_sizes)
+metrics.gauge("queue_depth", "Elementi in attesa nelle code interne", ["queue"], func=lambda: {
+    "outbound": dispatcher.pending,
+    "store_writer": astore.writer.pending,
+    "projections": projections.pending,
+})
+metrics.gauge("markers", "Marker sulla mappa", func=lambda: near_index.count)
+metrics.gauge("store_version", "Versione dello store (ultima mutazione)", func=lambda: store.version)
+metrics.gauge("sessions", "Operazioni in corso (conversazioni aperte)", func=lambda: len(sessions))
+metrics.gauge("users", "Utenti registrati", func=lambda: len(users))
+metrics.gauge("loop_lag_seconds", "Ultimo ritardo misurato dell'event loop", func=lambda: loop_lag.last)
+metrics.gauge("loop_lag_max_seconds", "Massimo ritardo dell'event loop dall'avvio", func=lambda: loop_lag.max)
+metrics.gauge("outbound_messages", "Messaggi in uscita dall'avvio", ["result"],
+              func=lambda: {"sent": dispatcher.sent, "failed": dispatcher.failed})
+metrics.gauge("api_requests", "Richieste all'API dei partner dall'avvio", ["result"],
+              func=lambda: {"total": api.requests, "not_modified": api.not_modified})
 
 
 ################################################
@@ -104,80 +398,205 @@ MESSAGES = {
 #                                              #
 ################################################
 
-# Handler per timeout della chat
 def check_err_operation_in_progress(uid, operation=None):
     """Verifica se l'utente ha un'operazione attiva e non scaduta.
        Se 'operation' è specificata, controlla che sia la stessa."""
-    op = user_operations.get(uid)
-    if not op:
-        return False
-    if operation and op['operation'] == operation:
-        return False
-    return True
+    return sessions.busy(uid, operation)
+
+def session_step(operation):
+    """Decoratore per gli handler delle conversazioni: rinnova la sessione a ogni
+    passo e la chiude quando l'handler termina la conversazione, anche con
+    un'uscita anticipata o un errore."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            uid = str(update.effective_user.id)
+            try:
+                state = await handler(update, context)
+            except Exception:
+                sessions.end(uid, operation)
+                raise
+            if state == ConversationHandler.END:
+                sessions.end(uid, operation)
+            else:
+                sessions.touch(uid)
+            return state
+        return wrapper
+    return decorator
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stato TIMEOUT delle conversazioni: chiude la sessione e avvisa l'utente."""
+    if update.effective_user is None:
+        return
+    sessions.end(update.effective_user.id)
+    context.user_data.clear()
+    try:
+        await context.bot.send_message(
+            chat_id=update.effective_user.id,
+            text=MESSAGES["timed_out"],
+            reply_markup=ReplyKeyboardRemove()
+        )
+    except Exception as e:
+        logging.warning(f"Avviso di timeout non inviato a {update.effective_user.id}: {e}")
+
+async def sweep_sessions(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodico: elimina le sessioni scadute (e le salva, se abilitato)."""
+    removed = sessions.sweep()
+    if removed:
+        logger.info(f"Sessioni scadute eliminate: {removed}")
+    if SESSIONS_FILE:
+        try:
+            await astore.run(sessions.save, sessions.dump())
+        except Exception as e:
+            logging.error(f"Errore salvataggio sessioni: {e}")
 
 async def abort_outside_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
-    if user_id in active_users:
+    if sessions.end(user_id):
         # Se per qualche motivo il conversation handler non ha gestito l'abort
-        active_users.discard(user_id)
+        context.user_data.clear()
         await update.message.reply_text(MESSAGES["cancelled"])
     else:
         await update.message.reply_text(MESSAGES["err_no_active_operation"])
 
-def clean_text(text):
-    """Pulisce il testo rimuovendo caratteri speciali SENZA limitare la lunghezza"""
-    text = text.strip('"\'')  # Rimuove apici all'inizio/fine
-    text = re.sub(r'[^\w\s\-.,!?@#&%â‚¬:/\U0001F300-\U0001FAFF]', '', text, flags=re.UNICODE)
-    return text
-
 def is_valid_url(url):
     """Verifica se una stringa è un URL valido."""
-    return re.match(r'^https?://[^\s]+$', url)
+    return re.match(URL_PATTERN, url)
+
+def parse_coordinates(text):
+    """Estrae (lat, lon) da un testo come "45.54, 10.22". None se non valido."""
+    parts = re.split(r'[,;\s]+', text.strip())
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+def parse_frequency(args):
+    """Frequenza indicata negli argomenti di un comando ("868" -> "868 MHz").
+    Ritorna (valida, frequenza) con frequenza None se non indicata."""
+    if not args:
+        return True, None
+    wanted = " ".join(args).lower().replace(" ", "")
+    frequency = next((f for f in FREQUENCIES if wanted in f.lower().replace(" ", "")), None)
+    return frequency is not None, frequency
+
+def format_distance(km):
+    return f"{km * 1000:.0f} m" if km < 1 else f"{km:.1f} km"
+
+def read_file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
 
 def read_markers():
-    """Legge tutti i marker dal file CSV."""
-    if not os.path.exists(FILE):
-        return []
-    
-    with open(FILE, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        if reader.fieldnames and reader.fieldnames[0].startswith('\ufeff'):
-            reader.fieldnames[0] = reader.fieldnames[0].replace('\ufeff', '')
-        
-        fieldnames = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp']
-        markers = []
-        
-        for row in reader:
-            if not row.get('lat') or not row.get('lon') or not row.get('ID'):
-                continue
-            
-            marker = {field: row.get(field, '') for field in fieldnames}
-            if not marker['user']:
-                marker['user'] = 'anonimo'
-                
-            markers.append(marker)
-        
-        return markers
+    """Legge tutti i marker (dalla cache, il file viene riletto solo se cambia)."""
+    return store.all()
 
 def safe_write_markers(markers):
     """Scrive i marker su file in modo sicuro con file temporaneo."""
-    fieldnames = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp']
-    
-    temp_file = tempfile.NamedTemporaryFile('w', newline='', delete=False, encoding='utf-8-sig')
-    with temp_file as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for marker in markers:
-            clean_marker = {field: marker.get(field, '') for field in fieldnames}
-            writer.writerow(clean_marker)
-    
-    shutil.move(temp_file.name, FILE)
+    store.replace_all(markers)
+
+async def compact_journal(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodico: consolida il journal nel CSV condiviso."""
+    if getattr(store.backend, 'dirty', False):
+        try:
+            await astore.compact()
+        except Exception as e:
+            logging.error(f"Errore compattazione journal: {e}")
+
+def build_indexes():
+    """Costruisce all'avvio gli indici derivati dallo store (poi aggiornati dai listener)."""
+    version, markers = store.snapshot()
+    near_index.rebuild(markers, version)
+    marker_stats.rebuild(markers, version)
+    inactivity.rebuild(markers, version)
+    ingester.rebuild(markers, version)
+
+async def post_init(application):
+    metrics.gauge("update_queue", "Aggiornamenti di Telegram in attesa di essere gestiti",
+                  func=application.update_queue.qsize)
+    astore.start()
+    loop_lag.start()
+    dispatcher.start(application.bot)
+    await astore.run(build_indexes)
+    await astore.run(sessions.load)
+    await astore.run(exporter.clear)
+    if API_ENABLED:
+        await api.start()
+    if METRICS_ENABLED:
+        await metrics.start(METRICS_HOST, METRICS_PORT)
+    resume_broadcast()
+
+async def post_shutdown(application):
+    if broadcast_job is not None and broadcast_job.task is not None:
+        broadcast_job.task.cancel()  # Il checkpoint resta: l'invio riprende al prossimo avvio
+    await save_users()
+    await save_inactivity()
+    await api.stop()
+    await metrics.stop()
+    await dispatcher.stop()
+    await loop_lag.stop()
+    await astore.stop()
+
+def instrument_handlers(application):
+    """Misura la durata di tutti gli handler registrati, anche quelli negli stati
+    delle conversazioni, con il nome della callback come etichetta."""
+    def wrap(handler):
+        callback = handler.callback
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                handler_errors.inc(handler=name)
+                raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - start, handler=name)
+        handler.callback = wrapper
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                for nested in handler.entry_points + handler.fallbacks:
+                    wrap(nested)
+                for state_handlers in handler.states.values():
+                    for nested in state_handlers:
+                        wrap(nested)
+            else:
+                wrap(handler)
+
+async def save_metrics(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodico: scrive le metriche su METRICS_FILE."""
+    try:
+        await astore.run(metrics.save, METRICS_FILE)
+    except Exception as e:
+        logging.error(f"Errore salvataggio metriche: {e}")
+
+async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Registra chi scrive al bot in privato (gruppo -1: eseguito prima degli altri handler)."""
+    if update.effective_user and update.effective_chat and update.effective_chat.type == "private":
+        users.touch(update.effective_user)
+
+async def save_users(context: ContextTypes.DEFAULT_TYPE = None):
+    """Job periodico: salva il registro utenti se è cambiato."""
+    if users.dirty:
+        try:
+            await astore.run(users.save, users.dump())
+        except Exception as e:
+            logging.error(f"Errore salvataggio utenti: {e}")
 
 async def fallback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
-    if user_id not in active_users:
+    if not sessions.active(user_id):
         # L'utente non è in conversazione, quindi lo invitiamo a usare /start
         await update.message.reply_text(
             MESSAGES["start"],
@@ -215,32 +634,44 @@ logger.addHandler(console_handler)
 def load_log_state():
     try:
         with open(LOG_STATE_FILE, 'r') as f:
-            return json.load(f).get('enabled', True)
+            return json.load(f)
     except:
-        return True
+        return {}
 
-def save_log_state(enabled):
+def save_log_state(enabled, digest=False):
     with open(LOG_STATE_FILE, 'w') as f:
-        json.dump({'enabled': enabled}, f)
+        json.dump({'enabled': enabled, 'digest': digest}, f)
 
-LOG_ENABLED = load_log_state()
+log_state = load_log_state()
+LOG_ENABLED = log_state.get('enabled', True)
+dispatcher.digest = log_state.get('digest', False)
 
 # -------------- MENU ADMIN --------------
 
 async def send_log_to_admins(context: ContextTypes.DEFAULT_TYPE, message: str):
-    """Invia un messaggio di log a tutti gli admin se i log sono abilitati"""
+    """Accoda un messaggio di log per tutti gli admin se i log sono abilitati.
+       L'invio avviene in background (o nel riepilogo periodico), senza attese."""
     global LOG_ENABLED
     if not LOG_ENABLED:
         return
-        
+
     for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"📢 LOG\n\n{message}"
-            )
-        except Exception as e:
-            logging.error(f"Errore invio log all'admin {admin_id}: {e}")
+        dispatcher.log(admin_id, message if dispatcher.digest else f"📢 LOG\n\n{message}")
+
+def admin_menu_keyboard():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔈 Abilita Log" if not LOG_ENABLED else "🔇 Disabilita Log",
+         callback_data="log_off" if LOG_ENABLED else "log_on")],
+        [InlineKeyboardButton("🧾 Log immediati" if dispatcher.digest else "🧾 Log in riepilogo",
+         callback_data="digest_off" if dispatcher.digest else "digest_on")],
+        [InlineKeyboardButton("📊 Statistiche", callback_data="stats")],
+        [InlineKeyboardButton("📤 Esporta dati", callback_data="export")],
+        [InlineKeyboardButton("🔁 Possibili duplicati", callback_data="duplicates")]
+    ])
+
+def admin_menu_text():
+    return (f"🛠️ *Menu Admin* - Stato log: {'✅ ON' if LOG_ENABLED else '❌ OFF'}"
+            f" ({'riepilogo' if dispatcher.digest else 'immediati'})")
 
 async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menu di gestione per admin"""
@@ -248,22 +679,10 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["not_authorized"])
         return
 
-    # Bottone per invertire lo stato
-    log_button = InlineKeyboardButton(
-        "🔈 Abilita Log" if not LOG_ENABLED else "🔇 Disabilita Log",
-        callback_data="log_on" if not LOG_ENABLED else "log_off"
-    )
-    
-    keyboard = [
-        [log_button],
-        [InlineKeyboardButton("📊 Statistiche", callback_data="stats")],
-        [InlineKeyboardButton("📤 Esporta dati", callback_data="export")]
-    ]
-    
     await update.message.reply_text(
-        f"🛠️ *Menu Admin* - Stato log: {'✅ ON' if LOG_ENABLED else '❌ OFF'}",
+        admin_menu_text(),
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=admin_menu_keyboard()
     )
 
 async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -281,7 +700,7 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     # Gestione delle diverse azioni
     if query.data == "log_on":
         LOG_ENABLED = True
-        save_log_state(True)  # Salva lo stato su file
+        await astore.run(save_log_state, True, dispatcher.digest)  # Salva lo stato su file
         await query.edit_message_text(
             "✅ Log abilitati\n\n"
             "Tutte le azioni degli utenti verranno inviate agli admin",
@@ -292,7 +711,7 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         
     elif query.data == "log_off":
         LOG_ENABLED = False
-        save_log_state(False)  # Salva lo stato su file
+        await astore.run(save_log_state, False, dispatcher.digest)  # Salva lo stato su file
         await query.edit_message_text(
             "❌ Log disabilitati\n\n"
             "Nessuna notifica verrà inviata agli admin",
@@ -301,24 +720,42 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             ])
         )
         
+    elif query.data in ("digest_on", "digest_off"):
+        dispatcher.digest = query.data == "digest_on"
+        if not dispatcher.digest:
+            dispatcher.flush_digests()  # Invia subito i log già raccolti
+        await astore.run(save_log_state, LOG_ENABLED, dispatcher.digest)
+        await query.edit_message_text(
+            f"🧾 Log raccolti in un riepilogo ogni {LOG_DIGEST_SECONDS // 60} minuti" if dispatcher.digest else
+            "🧾 Log inviati subito a ogni azione",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔙 Torna al menu", callback_data="back_to_menu")]
+            ])
+        )
+
     elif query.data == "stats":
         await admin_stats(update, context)
         
     elif query.data == "export":
         await admin_export(update, context)
+
+    elif query.data == "duplicates":
+        report = await duplicates_report(DUPLICATE_DISTANCE_KM)
+        await query.edit_message_text(
+            split_text(report)[0],
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔙 Torna al menu", callback_data="back_to_menu")]
+            ])
+        )
         
     elif query.data == "back_to_menu":
         # Ricrea il menu principale
-        keyboard = [
-            [InlineKeyboardButton("🔈 Abilita Log" if not LOG_ENABLED else "🔇 Disabilita Log", 
-             callback_data="log_off" if LOG_ENABLED else "log_on")],
-            [InlineKeyboardButton("📊 Statistiche", callback_data="stats")],
-            [InlineKeyboardButton("📤 Esporta dati", callback_data="export")]
-        ]
         await query.edit_message_text(
-            "🛠️ *Menu Admin* - Stato log: " + ("✅ ON" if LOG_ENABLED else "❌ OFF"),
+            admin_menu_text(),
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=admin_menu_keyboard()
         )
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -330,17 +767,11 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(MESSAGES["not_authorized"])
         return
 
-    markers = read_markers()
-    total_markers = len(markers)
-    
-    # Statistiche utenti
-    users = {}
-    for marker in markers:
-        user_id = marker['ID']
-        users[user_id] = users.get(user_id, 0) + 1
-    
-    top_users = sorted(users.items(), key=lambda x: x[1], reverse=True)[:5]
-    markers_with_links = sum(1 for m in markers if m.get('link'))
+    # Statistiche mantenute a ogni modifica: nessuna lettura dei marker
+    summary = marker_stats.summary()
+    total_markers = summary['total']
+    markers_with_links = summary['with_link']
+    top_users = marker_stats.top_users(5)
 
     # Calcola percentuale solo se ci sono marker
     link_percentage = f"{markers_with_links / total_markers:.1%}" if total_markers else "0%"
@@ -349,22 +780,34 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     stats_message = (
         "📊 <b>Statistiche Admin</b>\n\n"
         f"📍 <b>Marker totali:</b> {total_markers}\n"
-        f"👥 <b>Utenti unici:</b> {len(users)}\n"
-        f"🔗 <b>Marker con link:</b> {markers_with_links} ({link_percentage})\n\n"
-        "🏆 <b>Top contributor:</b>\n"
+        f"👥 <b>Utenti unici:</b> {summary['users']}\n"
+        f"📡 <b>Nodi importati da MeshCore:</b> {dict(summary['by_source']).get(MESHCORE_SOURCE, 0)}\n"
+        f"🔗 <b>Marker con link:</b> {markers_with_links} ({link_percentage})\n"
+        f"🆕 <b>Aggiunti:</b> {marker_stats.added_since(1)} oggi, {marker_stats.added_since(7)} in 7 giorni, "
+        f"{marker_stats.added_since(30)} in 30 giorni\n\n"
+        "📶 <b>Per frequenza:</b>\n"
     )
+    for frequency, count in summary['by_frequency']:
+        stats_message += f"• {html.escape(frequency or 'N/D')}: {count}\n"
+    stats_message += "\n🛰️ <b>Per tipo di nodo:</b>\n"
+    for node_type, count in summary['by_node_type']:
+        stats_message += f"• {html.escape(node_type or 'N/D')}: {count}\n"
+    stats_message += "\n🏆 <b>Top contributor:</b>\n"
     
     if top_users:
-        for i, (user_id, count) in enumerate(top_users, 1):
-            user_info = next((m for m in markers if m['ID'] == user_id), None)
-            username = f"@{user_info['user']}" if user_info and user_info.get('user') else f"Utente #{user_id}"
+        for i, (user_id, username, count) in enumerate(top_users, 1):
+            username = f"@{html.escape(username)}" if username else f"Utente #{user_id}"
             stats_message += f"{i}. {username}: {count} marker\n"
     else:
         stats_message += "Nessun marker registrato.\n"
 
     stats_message += (
-        f"\n⭐ <b>Utenti speciali:</b> {sum(1 for uid in users if int(uid) in SPECIAL_USERS)}\n"
-        f"🔢 <b>Max marker per utente:</b> {MAX_MARKERS_PER_USER} (normali), {MAX_MARKERS_FOR_SPECIAL_USERS} (speciali)"
+        f"\n⭐ <b>Utenti speciali:</b> {sum(1 for uid in SPECIAL_USERS if str(uid) in marker_stats.by_user)}\n"
+        f"🔢 <b>Max marker per utente:</b> {MAX_MARKERS_PER_USER} (normali), {MAX_MARKERS_FOR_SPECIAL_USERS} (speciali)\n"
+        f"⏱️ <b>Ritardo event loop:</b> {loop_lag.avg * 1000:.1f} ms (max {loop_lag.max * 1000:.0f} ms)\n"
+        f"👤 <b>Utenti registrati:</b> {len(users)} ({users.blocked_count()} hanno bloccato il bot)\n"
+        f"💬 <b>Operazioni in corso:</b> {len(sessions)}\n"
+        f"📨 <b>Messaggi in uscita:</b> {dispatcher.sent} inviati, {dispatcher.failed} falliti, {dispatcher.pending} in coda"
     )
     
     await query.edit_message_text(
@@ -377,7 +820,7 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Esporta tutti i marker in un file CSV."""
+    """Esporta tutti i marker in un file CSV compresso."""
     query = update.callback_query
     await query.answer()  # Chiude l'indicatore di caricamento
     
@@ -386,12 +829,7 @@ async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        with open(FILE, 'rb') as f:
-            await context.bot.send_document(
-                chat_id=query.from_user.id,
-                document=f,
-                filename='markers_export.csv'
-            )
+        await send_export(context, query.from_user.id, parse_export_args([], FREQUENCIES))
         await query.edit_message_text(
             "✅ File esportato con successo!",
             reply_markup=InlineKeyboardMarkup([
@@ -402,6 +840,210 @@ async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.error(f"Errore esportazione: {str(e)}")
         await query.edit_message_text(MESSAGES["error_generic"])
 
+async def send_export(context: ContextTypes.DEFAULT_TYPE, chat_id, params):
+    """Genera (o prende dalla cache) l'esportazione e la invia come documento."""
+    path, count, cached = await astore.run(exporter.export, params)
+    size = await astore.run(os.path.getsize, path)
+    if size > MAX_UPLOAD_BYTES:
+        await context.bot.send_message(chat_id=chat_id, text=MESSAGES["export_too_large"])
+        return False
+
+    data = await astore.run(read_file_bytes, path)
+    await context.bot.send_document(
+        chat_id=chat_id,
+        document=data,
+        filename=f"markers_export{FORMATS[params['format']]}",
+        caption=f"📤 {count} nodi" + (" (dalla cache)" if cached else "")
+    )
+    return True
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Esportazione con formato e filtri: /export [formato] [regione=..|bbox=..] [freq=..] [dal=..] [al=..]"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return
+
+    try:
+        params = parse_export_args(context.args or [], FREQUENCIES)
+    except ExportError as e:
+        await update.message.reply_text(f"❌ {e}\n\n{MESSAGES['export_usage']}")
+        return
+
+    await update.message.reply_text(MESSAGES["export_running"])
+    try:
+        await send_export(context, update.effective_chat.id, params)
+    except Exception as e:
+        logging.error(f"Errore esportazione: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+async def duplicates_report(max_km):
+    """Testo (HTML) con i gruppi di possibili duplicati su tutta la mappa."""
+    _, markers = await astore.run(store.iter_markers)
+    markers = list(markers)
+    groups = await astore.run(find_duplicates, markers, max_km, DUPLICATE_SIMILARITY)
+    if not groups:
+        return MESSAGES["duplicates_none"]
+
+    text = (f"🔁 <b>Possibili duplicati</b> (entro {format_distance(max_km)}, nomi simili): "
+            f"{len(groups)} gruppi, {sum(len(g) for g in groups)} nodi\n\n")
+    for n, group in enumerate(groups[:DUPLICATE_REPORT_GROUPS], 1):
+        text += f"{n}.\n"
+        for i in group:
+            m = markers[i]
+            text += (f"    • <b>{html.escape(m['name'])}</b> - @{html.escape(m['user'])} (ID: {m['ID']}) "
+                     f"{m['lat']}, {m['lon']}\n")
+    if len(groups) > DUPLICATE_REPORT_GROUPS:
+        text += f"\n... e altri {len(groups) - DUPLICATE_REPORT_GROUPS} gruppi"
+    return text
+
+async def duplicates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Report dei possibili duplicati: /duplicates [distanza in metri]"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return
+
+    max_km = DUPLICATE_DISTANCE_KM
+    if context.args:
+        try:
+            max_km = float(context.args[0]) / 1000
+        except ValueError:
+            max_km = 0
+        if not 0 < max_km <= 5:
+            await update.message.reply_text(MESSAGES["duplicates_usage"])
+            return
+
+    report = await duplicates_report(max_km)
+    for part in split_text(report):
+        await update.message.reply_text(part, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+@session_step("import")
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Avvia l'importazione in blocco: l'admin invia poi un file CSV o GeoJSON."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return ConversationHandler.END
+    if check_err_operation_in_progress(str(update.effective_user.id), "import"):
+        await update.message.reply_text(MESSAGES["err_operation_in_progress"])
+        return ConversationHandler.END
+
+    sessions.start(update.effective_user.id, "import")
+    await update.message.reply_text(MESSAGES["import_file"])
+    return IMPORT_FILE
+
+@session_step("import")
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Valida il file in un solo passaggio, aggiunge le righe valide con un unico commit
+    e rimanda all'admin il report delle righe scartate."""
+    uid = str(update.effective_user.id)
+    username = update.effective_user.username or "anonimo"
+    document = update.message.document
+    if document is None:
+        await update.message.reply_text(MESSAGES["import_not_document"])
+        return IMPORT_FILE
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await update.message.reply_text(MESSAGES["import_too_large"])
+        return IMPORT_FILE
+
+    await update.message.reply_text(MESSAGES["import_running"])
+    try:
+        telegram_file = await document.get_file()
+        data = bytes(await telegram_file.download_as_bytearray())
+        existing = await astore.run(store.name_keys)
+        markers, report = await astore.run(importer.prepare, data, document.file_name, existing, uid, username)
+    except UploadError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return ConversationHandler.END
+    except Exception as e:
+        logging.error(f"Errore importazione: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+        return ConversationHandler.END
+
+    try:
+        results = await astore.apply_many({'op': 'add', 'marker': m} for m in markers) if markers else []
+    except Exception as e:
+        logging.error(f"Errore salvataggio importazione: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+        return ConversationHandler.END
+
+    added = sum(1 for r in results if r)
+    msg = f"✅ Importazione completata: {added} marker aggiunti"
+    if added < len(markers):
+        # Nomi usati da altri inserimenti tra la validazione e il commit
+        msg += f"\n⚠️ {len(markers) - added} righe saltate perché il nome è stato usato nel frattempo"
+    if len(report):
+        msg += f"\n❌ {len(report)} righe scartate: dettagli nel file allegato"
+    await update.message.reply_text(msg)
+    if len(report):
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=await astore.run(report_csv, report),
+            filename="errori_importazione.csv"
+        )
+
+    logger.info(f"Importazione di {username} (ID: {uid}): {added} aggiunti, {len(report)} scartati")
+    if LOG_ENABLED:
+        await send_log_to_admins(context, (
+            f"📥 Importazione in blocco\n"
+            f"👤 Admin: {username} (ID: {uid})\n"
+            f"➕ Marker aggiunti: {added}\n"
+            f"❌ Righe scartate: {len(report)}\n"
+        ))
+    return ConversationHandler.END
+
+async def ingest_sync(force=False):
+    """Sincronizza i nodi MeshCore: scarica la lista (solo se cambiata) e scrive
+    con un unico commit le sole modifiche. Ritorna i conteggi o None se la lista
+    non è cambiata."""
+    async with ingest_lock:
+        fetched = await astore.run(ingester.fetch, force)
+        if fetched is None:
+            return None
+        nodes, cursor = fetched
+        mutations, counts = await astore.run(ingester.plan, nodes)
+        if mutations:
+            await astore.apply_many(mutations)
+        await astore.run(ingester.commit, cursor)  # Solo dopo il commit: se fallisce il sync viene ripetuto
+    logger.info(f"Sync MeshCore: {counts}")
+    return counts
+
+def format_sync_counts(counts):
+    return (f"➕ Nuovi: {counts['added']}\n"
+            f"✏️ Aggiornati: {counts['updated']}\n"
+            f"🗑️ Rimossi: {counts['removed']}\n"
+            f"➖ Invariati: {counts['unchanged']}\n"
+            f"⏭️ Scartati (senza posizione, fuori area o altra frequenza): {counts['skipped']}")
+
+async def ingest_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodico: sync dei nodi MeshCore."""
+    try:
+        counts = await ingest_sync()
+    except Exception as e:
+        logging.error(f"Errore sync MeshCore: {e}", exc_info=True)
+        return
+    if counts and (counts['added'] or counts['updated'] or counts['removed']) and LOG_ENABLED:
+        await send_log_to_admins(context, f"📡 Sync nodi MeshCore\n{format_sync_counts(counts)}")
+
+async def sync_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sync immediato dei nodi MeshCore (admin), anche se la lista non risulta cambiata."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return
+    if not ingester.enabled:
+        await update.message.reply_text(MESSAGES["sync_disabled"])
+        return
+
+    await update.message.reply_text(MESSAGES["sync_running"])
+    try:
+        counts = await ingest_sync(force=True)
+    except Exception as e:
+        logging.error(f"Errore sync MeshCore: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+        return
+    if counts is None:
+        await update.message.reply_text(MESSAGES["sync_unchanged"])
+    else:
+        await update.message.reply_text(f"📡 Sync completato ({ingester.count()} nodi MeshCore)\n\n{format_sync_counts(counts)}")
+
 
 #########################################
 #                                       #
@@ -428,10 +1070,8 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await start(update, context)
 
 async def abort(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uid = str(update.effective_user.id)
-    active_users.discard(uid)
     # Pulisci operazioni
-    user_operations.pop(uid, None)
+    sessions.end(update.effective_user.id)
     # Pulisci user_data
     context.user_data.clear()
     await update.message.reply_text(MESSAGES["cancelled"], reply_markup=ReplyKeyboardRemove())
@@ -445,15 +1085,8 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if isinstance(context.error, TimeoutError):
-        uid = str(update.effective_user.id)
-        user_operations.pop(uid, None)
-        await update.message.reply_text(
-            MESSAGES["timed_out"],
-            reply_markup=ReplyKeyboardRemove()
-        )
-    else:
-        logging.error(f"Errore: {context.error}")
+    # I timeout delle conversazioni sono gestiti dallo stato TIMEOUT (conversation_timeout)
+    logging.error(f"Errore: {context.error}")
 
 #######################################################
 #                                                     #
@@ -463,9 +1096,9 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # -------------- AGGIUNTA MARKER --------------
 
+@session_step("add")
 async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    active_users.add(uid)
 
     # Controllo se un'altra operazione è in corso 
     if check_err_operation_in_progress(uid, "add"):
@@ -473,11 +1106,10 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     # Registra l'operazione
-    user_operations[uid] = {'operation': 'add'}
+    sessions.start(uid, "add")
     
     # Inizio operazione add
-    markers = read_markers()
-    user_markers = [m for m in markers if m['ID'] == uid]
+    user_marker_count = await astore.user_count(uid)
 
     # Gestione limiti marker
     if int(uid) in ADMIN_IDS:
@@ -487,7 +1119,7 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         max_markers = MAX_MARKERS_PER_USER
 
-    if len(user_markers) >= max_markers:
+    if user_marker_count >= max_markers:
         await update.message.reply_text(
             f"Hai già {max_markers if max_markers != float('inf') else '∞'} marker. "
             "Elimina uno per aggiungerne un altro." if max_markers != float('inf') else "Sei un admin, puoi aggiungere tutti i marker che vuoi."
@@ -497,6 +1129,7 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(MESSAGES["add_lat"])
     return ADD_LAT
 
+@session_step("add")
 async def add_lat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestisce l'inserimento della latitudine."""
     uid = str(update.effective_user.id)
@@ -532,9 +1165,9 @@ async def add_lat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logging.error(f"Errore in add_lat per {uid}: {str(e)}", exc_info=True)
         await update.message.reply_text(MESSAGES["error_generic"])
-        user_operations.pop(uid, None)
         return ConversationHandler.END
 
+@session_step("add")
 async def add_lon(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestisce l'inserimento della longitudine."""
     uid = str(update.effective_user.id)
@@ -547,7 +1180,6 @@ async def add_lon(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         if 'lat' not in context.user_data:
             await update.message.reply_text(MESSAGES["error_generic"])
-            user_operations.pop(uid, None)
             return ConversationHandler.END
             
         lon = float(update.message.text)
@@ -564,9 +1196,9 @@ async def add_lon(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logging.error(f"Errore in add_lon per {uid}: {str(e)}", exc_info=True)
         await update.message.reply_text(MESSAGES["error_generic"])
-        user_operations.pop(uid, None)
         return ConversationHandler.END
 
+@session_step("add")
 async def add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
     
@@ -584,16 +1216,21 @@ async def add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ADD_NAME
 
         # Controllo duplicati
-        existing_markers = read_markers()
-        user_markers = [m for m in existing_markers if str(m['ID']) == uid]  # Confronta come stringa
-        
-        if any(m['name'].lower() == name.lower() for m in user_markers):
+        if await astore.has_name(uid, name):
             await update.message.reply_text(
                 MESSAGES["err_duplicate_name"]
             )
             # Rimane nello stesso step, richiede di nuovo il nome
             return ADD_NAME
 
+        # Avviso (non bloccante) se lo stesso nodo sembra già registrato da qualcuno
+        if DUPLICATE_WARNING:
+            similar = similar_nearby(near_index, float(context.user_data['lat']), float(context.user_data['lon']),
+                                     name, DUPLICATE_DISTANCE_KM, DUPLICATE_SIMILARITY)
+            if similar:
+                nodes = "\n".join(f"• {m['name']} ({format_distance(km)}, @{m['user']})" for m, km in similar[:5])
+                await update.message.reply_text(MESSAGES["duplicate_warning"].format(nodes=nodes))
+
         # Salva il nome
         context.user_data['name'] = name
         context.user_data['timestamp'] = time.time()  # Aggiorna timestamp
@@ -619,9 +1256,9 @@ async def add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.error(f"Errore in add_name per {uid}: {str(e)}", exc_info=True)
         await update.message.reply_text(MESSAGES["error_generic"])
         logging.error(traceback.format_exc())
-        user_operations.pop(uid, None)
         return ConversationHandler.END
 
+@session_step("add")
 async def select_frequency(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
 
@@ -644,6 +1281,7 @@ async def select_frequency(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ENTER_DESCRIPTION
 
+@session_step("add")
 async def enter_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestisce l'inserimento della descrizione."""
     uid = str(update.effective_user.id)
@@ -660,7 +1298,6 @@ async def enter_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 MESSAGES["err_desc_too_long"],
                 reply_markup=ReplyKeyboardRemove()
             )
-            user_operations.pop(uid, None)
             return ConversationHandler.END
         
         context.user_data['desc'] = free_desc
@@ -680,9 +1317,9 @@ async def enter_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logging.error(f"Errore in enter_description per {uid}: {str(e)}")
         await update.message.reply_text(MESSAGES["error_generic"])
-        user_operations.pop(uid, None)
         return ConversationHandler.END
 
+@session_step("add")
 async def add_link_ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
 
@@ -715,6 +1352,7 @@ async def add_link_ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ADD_LINK_ASK
 
+@session_step("add")
 async def add_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
 
@@ -742,6 +1380,7 @@ async def add_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['link'] = link
     return await finish_add(update, context)
 
+@timed(handler_seconds, handler="finish_add")
 async def finish_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Completa il processo di aggiunta marker."""
     uid = str(update.effective_user.id)
@@ -766,10 +1405,14 @@ async def finish_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'timestamp': int(time.time())
         })
 
-        # Salvataggio
-        markers = read_markers()
-        markers.append(marker)
-        safe_write_markers(markers)
+        # Salvataggio (il writer raggruppa i commit concorrenti)
+        added = await astore.apply({'op': 'add', 'marker': marker})
+        if not added:
+            await update.message.reply_text(
+                MESSAGES["err_duplicate_name"],
+                reply_markup=ReplyKeyboardRemove()
+            )
+            return ConversationHandler.END
 
         if LOG_ENABLED:  # Solo se i log sono abilitati
             log_message = (
@@ -789,6 +1432,9 @@ async def finish_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Marker aggiunto da {update.effective_user.username or 'anonimo'} (ID: {uid}) - "
             f"Nome: {context.user_data['name']}, Link: {context.user_data.get('link', '')}, "
             f"Frequency: {context.user_data.get('frequency')}, Node Type: {context.user_data.get('node_type')}")
+
+        # Avvisi agli iscritti della zona in background, senza ritardare la risposta
+        context.application.create_task(notify_subscribers(dict(marker), uid))
         return ConversationHandler.END
 
     except Exception as e:
@@ -796,15 +1442,12 @@ async def finish_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["error_generic"])
         logger.error(f"Errore in finish_add per utente {uid}: {str(e)}", exc_info=True)
         return ConversationHandler.END
-    finally:
-        user_operations.pop(str(update.effective_user.id), None)
-        active_users.discard(uid)
 
 # -------------- RINOMINA MARKER --------------
 
+@session_step("rename")
 async def rename(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    active_users.add(uid)
 
     # Controllo se un'altra operazione è in corso 
     if check_err_operation_in_progress(uid, "rename"):
@@ -812,9 +1455,9 @@ async def rename(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     # Registra l'operazione
-    user_operations[uid] = {'operation': 'rename'}
+    sessions.start(uid, "rename")
         
-    markers = [m for m in read_markers() if m['ID'] == uid]
+    markers = await astore.get_user_markers(uid)
     if not markers:
         await update.message.reply_text(MESSAGES["no_markers_to_rename"])
         return ConversationHandler.END
@@ -826,6 +1469,7 @@ async def rename(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg)
     return RENAME_SELECT
 
+@session_step("rename")
 async def rename_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
 
@@ -846,6 +1490,7 @@ async def rename_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(MESSAGES["rename_new_name"])
     return RENAME_NEW_NAME
 
+@session_step("rename")
 async def rename_new_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
 
@@ -865,25 +1510,21 @@ async def rename_new_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["err_name_too_long"])
         return RENAME_NEW_NAME
 
-    if any(m['name'] == new_name for m in read_markers() if m['ID'] == uid):
+    # Controllo duplicati (case-insensitive come lo store), escluso il marker stesso:
+    # cambiare solo maiuscole/minuscole del proprio nome è consentito
+    selected = context.user_data['markers'][idx]
+    if name_key(new_name) != name_key(selected['name']) and await astore.has_name(uid, new_name):
         await update.message.reply_text(
             MESSAGES["err_duplicate_name"]
         )
         # Rimane nello stesso step, richiede di nuovo il nome
         return RENAME_NEW_NAME
 
-    markers = read_markers()
-    count = -1
-    old_name = None
-    for m in markers:
-        if m['ID'] == uid:
-            count += 1
-            if count == idx:
-                old_name = m['name']  # Memorizza il vecchio nome prima di aggiornare
-                m['name'] = new_name
-                break
-
-    safe_write_markers(markers)
+    old_name = await astore.apply({'op': 'rename', 'ID': uid, 'name': selected['name'], 'new_name': new_name})
+    if old_name is None:
+        # Marker eliminato o nome occupato nel frattempo
+        await update.message.reply_text(MESSAGES["error_generic"])
+        return ConversationHandler.END
 
     # Invia log agli admin
     if LOG_ENABLED:
@@ -897,16 +1538,14 @@ async def rename_new_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Marker rinominato da {update.effective_user.username or 'anonimo'} (ID: {uid}) - "
             f"Vecchio nome: {old_name}, Nuovo nome: {new_name}")
 
-    user_operations.pop(uid, None)
-    active_users.discard(uid)
     await update.message.reply_text(MESSAGES["name_updated"])
     return ConversationHandler.END
 
 # -------------- ELIMINAZIONE MARKER --------------
 
+@session_step("delete")
 async def delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    active_users.add(uid)
 
     # Controllo se un'altra operazione è in corso 
     if check_err_operation_in_progress(uid, "delete"):
@@ -914,9 +1553,9 @@ async def delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     # Registra l'operazione
-    user_operations[uid] = {'operation': 'delete'}
+    sessions.start(uid, "delete")
         
-    markers = [m for m in read_markers() if m['ID'] == uid]
+    markers = await astore.get_user_markers(uid)
     if not markers:
         await update.message.reply_text(MESSAGES["no_markers_to_delete"])
         return ConversationHandler.END
@@ -928,6 +1567,7 @@ async def delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg)
     return DELETE_SELECT
 
+@session_step("delete")
 async def delete_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
 
@@ -945,10 +1585,8 @@ async def delete_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     deleted_marker = context.user_data['markers'][idx]
 
-    # Cancella dal file tutti i marker dell'utente e riscrive senza quello selezionato
-    all_markers = read_markers()
-    all_markers = [m for i, m in enumerate(all_markers) if not (m['ID'] == uid and m['name'] == deleted_marker['name'])]
-    safe_write_markers(all_markers)
+    # Elimina il marker selezionato
+    await astore.apply({'op': 'delete', 'ID': uid, 'name': deleted_marker['name']})
 
     if LOG_ENABLED:
         log_message = f"🗑️ Marker eliminato\n"
@@ -960,7 +1598,7 @@ async def delete_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(MESSAGES["marker_deleted"])
 
-    updated = [m for m in read_markers() if m['ID'] == uid]
+    updated = await astore.get_user_markers(uid)
     if updated:
         msg = MESSAGES["your_markers"]
         for m in updated:
@@ -973,15 +1611,13 @@ async def delete_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, disable_web_page_preview=True)
     logger.info(f"Marker eliminato da {update.effective_user.username or 'anonimo'} (ID: {uid}) - Nome: {deleted_marker['name']}, Link: {deleted_marker.get('link', '')}")
 
-    user_operations.pop(uid, None)
-    active_users.discard(uid)
     return ConversationHandler.END
 
 # -------------- STAMPA MARKER --------------
 async def list_markers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
     
-    markers = [m for m in read_markers() if m['ID'] == uid]
+    markers = await astore.get_user_markers(uid)
     if not markers:
         await update.message.reply_text(MESSAGES["no_markers"])
     else:
@@ -994,6 +1630,404 @@ async def list_markers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(msg, disable_web_page_preview=True)
 
 
+# -------------- NODI VICINI --------------
+
+@session_step("near")
+async def near(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Avvia la ricerca dei nodi vicini: /near [frequenza]"""
+    uid = str(update.effective_user.id)
+
+    if check_err_operation_in_progress(uid, "near"):
+        await update.message.reply_text(MESSAGES["err_operation_in_progress"])
+        return ConversationHandler.END
+
+    valid, frequency = parse_frequency(context.args)
+    if not valid:
+        await update.message.reply_text(MESSAGES["err_invalid_frequency"])
+        return ConversationHandler.END
+
+    sessions.start(uid, "near")
+    context.user_data['near_frequency'] = frequency
+    await update.message.reply_text(MESSAGES["near_location"])
+    return NEAR_LOCATION
+
+@session_step("near")
+async def near_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Riceve la posizione e mostra i nodi più vicini con distanza e direzione."""
+    if update.message.location:
+        point = (update.message.location.latitude, update.message.location.longitude)
+    else:
+        point = parse_coordinates(update.message.text or "")
+        if point is None:
+            await update.message.reply_text(MESSAGES["error_position"])
+            return NEAR_LOCATION
+
+    frequency = context.user_data.pop('near_frequency', None)
+    results = near_index.nearest(point[0], point[1], k=NEAR_RESULTS, frequency=frequency)
+
+    if not results:
+        await update.message.reply_text(MESSAGES["near_none"])
+        return ConversationHandler.END
+
+    msg = MESSAGES["near_results"]
+    for i, (marker, km, bearing) in enumerate(results, 1):
+        msg += (f"{i}. <b>{html.escape(marker['name'])}</b> ({html.escape(marker['frequency'])})\n"
+                f"    {format_distance(km)} {compass_point(bearing)} ({bearing:.0f}°)\n")
+    await update.message.reply_text(msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    return ConversationHandler.END
+
+# -------------- CONFERMA NODI INATTIVI --------------
+
+async def save_inactivity():
+    if inactivity.dirty:
+        try:
+            await astore.run(inactivity.save, inactivity.dump())
+        except Exception as e:
+            logging.error(f"Errore salvataggio conferme: {e}")
+
+def inactive_keyboard(nodes):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"✅ {name}", callback_data=f"inactive_yes:{entry_id}"),
+         InlineKeyboardButton("🗑️ Rimuovi", callback_data=f"inactive_no:{entry_id}")]
+        for entry_id, name in nodes
+    ])
+
+async def inactive_sweep(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodico: invia le richieste di conferma scadute e rimuove, con un solo
+    commit, i nodi non confermati entro il periodo di grazia."""
+    prompts, expired = inactivity.due(time.time(), INACTIVE_MAX_PROMPTS)
+
+    # Un messaggio per utente con un pulsante per nodo (al massimo 20 nodi per messaggio).
+    # Si attende l'esito: i nodi la cui richiesta non è arrivata non vanno in scadenza.
+    batches = [(uid, nodes[start:start + 20]) for uid, nodes in prompts.items() for start in range(0, len(nodes), 20)]
+    outcomes = await asyncio.gather(*(
+        dispatcher.deliver(int(uid), MESSAGES["inactive_prompt"].format(days=INACTIVE_GRACE_DAYS),
+                           reply_markup=inactive_keyboard(batch))
+        for uid, batch in batches
+    ))
+    undelivered = [entry_id for (_, batch), outcome in zip(batches, outcomes) if outcome != "sent"
+                   for entry_id, _ in batch]
+    if undelivered:
+        inactivity.undelivered(undelivered, time.time())
+        logger.warning(f"Richieste di conferma non consegnate: {len(undelivered)} nodi, nuovo invio più tardi")
+
+    if expired:
+        try:
+            results = await astore.apply_many({'op': 'delete', 'ID': uid, 'name': name} for _, uid, name in expired)
+        except Exception as e:
+            logging.error(f"Errore rimozione nodi inattivi: {e}", exc_info=True)
+            results = [0] * len(expired)
+
+        removed = {}
+        for (entry_id, uid, name), result in zip(expired, results):
+            if result:
+                removed.setdefault(uid, []).append(name)
+            else:
+                inactivity.retry(entry_id)
+        for uid, names in removed.items():
+            dispatcher.send(int(uid), MESSAGES["inactive_removed"].format(names="\n".join(f"• {n}" for n in names)))
+
+        total = sum(len(names) for names in removed.values())
+        if total:
+            logger.info(f"Rimossi {total} nodi non confermati")
+            if LOG_ENABLED:
+                await send_log_to_admins(context, (
+                    f"🕰️ Nodi inattivi rimossi: {total}\n" +
+                    "\n".join(f"👤 ID {uid}: {', '.join(names)}" for uid, names in removed.items())
+                ))
+
+    if prompts or expired:
+        logger.info(f"Conferma nodi: {sum(len(n) for n in prompts.values())} richieste, {len(expired)} scaduti")
+    await save_inactivity()
+
+async def inactive_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Risposta del proprietario a una richiesta di conferma."""
+    query = update.callback_query
+    action, entry_id = query.data.split(":")
+    entry_id = int(entry_id)
+    uid = str(query.from_user.id)
+
+    entry = inactivity.get(entry_id)
+    if entry is None or entry['ID'] != uid:
+        await query.answer(MESSAGES["inactive_unknown"])
+    elif action == "inactive_yes":
+        name = inactivity.confirm(entry_id, uid, time.time())
+        await query.answer(MESSAGES["inactive_confirmed"].format(name=name))
+        await save_inactivity()
+    else:
+        removed = await astore.apply({'op': 'delete', 'ID': uid, 'name': entry['name']})
+        await query.answer(MESSAGES["inactive_removed_by_user"].format(name=entry['name']) if removed
+                           else MESSAGES["inactive_unknown"])
+        if removed and LOG_ENABLED:
+            await send_log_to_admins(context, (
+                f"🗑️ Marker eliminato (conferma inattività)\n"
+                f"👤 Utente: {query.from_user.username or 'anonimo'} (ID: {uid})\n"
+                f"📍 Nome: {entry['name']}\n"
+            ))
+
+    # Toglie dal messaggio la riga del nodo gestito
+    rows = [row for row in query.message.reply_markup.inline_keyboard
+            if row[0].callback_data != f"inactive_yes:{entry_id}"]
+    try:
+        await query.edit_message_reply_markup(InlineKeyboardMarkup(rows) if rows else None)
+    except BadRequest:
+        pass  # Messaggio già aggiornato
+
+
+# -------------- NOTIFICHE DI ZONA --------------
+
+async def save_subscriptions():
+    await astore.run(subscriptions.save, subscriptions.dump())
+
+async def chat_blocked(chat_id):
+    """Il bot è stato bloccato dall'utente: le sue iscrizioni non servono più."""
+    users.mark_blocked(chat_id)
+    if subscriptions.remove_chat(chat_id):
+        await save_subscriptions()
+
+dispatcher.on_forbidden = chat_blocked
+
+async def notify_subscribers(marker, author_id):
+    """Avvisa gli iscritti nella cui zona è stato aggiunto il nodo."""
+    try:
+        # Un solo messaggio per chat, con la zona più vicina
+        chats = {}
+        for sub, km in subscriptions.match(marker):
+            if sub['chat_id'] != author_id and (sub['chat_id'] not in chats or km < chats[sub['chat_id']]):
+                chats[sub['chat_id']] = km
+
+        for chat_id, km in chats.items():
+            text = (
+                "🔔 <b>Nuovo nodo nella tua zona</b>\n\n"
+                f"📍 {html.escape(marker['name'])} ({html.escape(marker['frequency'])})\n"
+                f"📏 {format_distance(km)} dal centro della zona\n"
+                f"👤 @{html.escape(marker['user'])}"
+            )
+            dispatcher.send(int(chat_id), text, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logging.error(f"Errore nelle notifiche di zona: {e}", exc_info=True)
+
+@session_step("subscribe")
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Avvia l'iscrizione a una zona: /subscribe [frequenza]"""
+    uid = str(update.effective_user.id)
+
+    if check_err_operation_in_progress(uid, "subscribe"):
+        await update.message.reply_text(MESSAGES["err_operation_in_progress"])
+        return ConversationHandler.END
+
+    valid, frequency = parse_frequency(context.args)
+    if not valid:
+        await update.message.reply_text(MESSAGES["err_invalid_frequency"])
+        return ConversationHandler.END
+
+    if subscriptions.count(uid) >= MAX_SUBSCRIPTIONS_PER_USER:
+        await update.message.reply_text(MESSAGES["err_max_subscriptions"])
+        return ConversationHandler.END
+
+    sessions.start(uid, "subscribe")
+    context.user_data['subscribe_frequency'] = frequency
+    await update.message.reply_text(MESSAGES["subscribe_location"])
+    return SUBSCRIBE_LOCATION
+
+@session_step("subscribe")
+async def subscribe_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.location:
+        point = (update.message.location.latitude, update.message.location.longitude)
+    else:
+        point = parse_coordinates(update.message.text or "")
+        if point is None:
+            await update.message.reply_text(MESSAGES["error_position"])
+            return SUBSCRIBE_LOCATION
+
+    context.user_data['subscribe_point'] = point
+    await update.message.reply_text(
+        MESSAGES["subscribe_radius"],
+        reply_markup=ReplyKeyboardMarkup(
+            [[str(r) for r in SUBSCRIPTION_RADII]],
+            one_time_keyboard=True,
+            resize_keyboard=True,
+            input_field_placeholder="Raggio in km..."
+        )
+    )
+    return SUBSCRIBE_RADIUS
+
+@session_step("subscribe")
+async def subscribe_radius(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = str(update.effective_user.id)
+
+    try:
+        radius = float(update.message.text.replace(",", ".").lower().replace("km", "").strip())
+        if not 1 <= radius <= MAX_SUBSCRIPTION_RADIUS_KM:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(MESSAGES["err_invalid_radius"])
+        return SUBSCRIBE_RADIUS
+
+    lat, lon = context.user_data.pop('subscribe_point')
+    frequency = context.user_data.pop('subscribe_frequency', None)
+    subscriptions.add(uid, lat, lon, radius, frequency)
+
+    try:
+        await save_subscriptions()
+    except Exception as e:
+        logging.error(f"Errore salvataggio iscrizioni: {e}")
+
+    logger.info(f"Iscrizione zona di {update.effective_user.username or 'anonimo'} (ID: {uid}): "
+                f"{lat}, {lon} raggio {radius} km, frequenza {frequency or 'tutte'}")
+    await update.message.reply_text(MESSAGES["subscribed"], reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
+
+def format_subscriptions(subs):
+    msg = MESSAGES["your_subscriptions"]
+    for i, sub in enumerate(subs, 1):
+        msg += f"{i}. {sub['lat']:.4f}, {sub['lon']:.4f} — {sub['radius_km']:g} km ({sub['frequency'] or 'tutte le frequenze'})\n"
+    return msg
+
+async def list_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = str(update.effective_user.id)
+    subs = subscriptions.for_chat(uid)
+    if not subs:
+        await update.message.reply_text(MESSAGES["no_subscriptions"])
+        return
+    await update.message.reply_text(format_subscriptions(subs) + MESSAGES["unsubscribe_usage"])
+
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Elimina un'iscrizione: /unsubscribe <numero> oppure /unsubscribe tutte"""
+    uid = str(update.effective_user.id)
+    subs = subscriptions.for_chat(uid)
+    if not subs:
+        await update.message.reply_text(MESSAGES["no_subscriptions"])
+        return
+
+    arg = context.args[0].lower() if context.args else ""
+    if arg in ("tutte", "all"):
+        subscriptions.remove_chat(uid)
+        await save_subscriptions()
+        await update.message.reply_text(MESSAGES["unsubscribed_all"])
+        return
+
+    try:
+        idx = int(arg) - 1
+        if idx < 0 or idx >= len(subs):
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(format_subscriptions(subs) + MESSAGES["unsubscribe_usage"])
+        return
+
+    subscriptions.remove(subs[idx]['id'])
+    await save_subscriptions()
+    await update.message.reply_text(MESSAGES["unsubscribed"])
+
+# -------------- ANNUNCI --------------
+
+def broadcast_options():
+    return dict(
+        dispatcher=dispatcher,
+        run_io=astore.run,
+        window=BROADCAST_BLOCK,
+        progress_interval=BROADCAST_PROGRESS_SECONDS,
+        on_progress=broadcast_progress
+    )
+
+def resume_broadcast():
+    """Riprende l'annuncio interrotto dall'ultimo riavvio, se c'è."""
+    global broadcast_job
+    broadcast_job = BroadcastJob.resume(BROADCAST_STATE_FILE, **broadcast_options())
+    if broadcast_job is not None:
+        state = broadcast_job.state
+        logging.info(f"Annuncio ripreso da {state['position']}/{broadcast_job.total}")
+        broadcast_job.state['status_message'] = None  # Nuovo messaggio di avanzamento
+        broadcast_job.start()
+
+async def broadcast_progress(job, done):
+    """Aggiorna il messaggio di avanzamento dell'annuncio per l'admin."""
+    state = job.state
+    text = (
+        f"📣 Annuncio: {state['position']}/{job.total}\n"
+        f"✅ Inviati: {state['sent']}\n"
+        f"🚫 Bot bloccato: {state['blocked']}\n"
+        f"❌ Errori: {state['failed']}"
+    )
+    if done:
+        text += "\n\n🛑 Invio interrotto" if job.stopped else "\n\n🏁 Invio completato"
+    markup = None if done else InlineKeyboardMarkup([[InlineKeyboardButton("🛑 Interrompi", callback_data="bc_stop")]])
+
+    bot = dispatcher.bot
+    if state['status_message'] is None:
+        message = await bot.send_message(chat_id=state['admin_chat'], text=text, reply_markup=markup)
+        state['status_message'] = message.message_id
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=state['admin_chat'], message_id=state['status_message'], reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Prepara un annuncio per tutti gli utenti: /broadcast <testo>"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return
+
+    parts = update.message.text.split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    if not text:
+        await update.message.reply_text(MESSAGES["broadcast_usage"])
+        return
+    if len(text) > 4096:
+        await update.message.reply_text(MESSAGES["broadcast_too_long"])
+        return
+    if broadcast_job is not None and broadcast_job.running:
+        await update.message.reply_text(MESSAGES["broadcast_running"])
+        return
+
+    context.user_data['broadcast_text'] = text
+    await update.message.reply_text(
+        f"📣 Anteprima annuncio ({len(users.recipients())} destinatari):\n\n{text}",
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Invia", callback_data="bc_send"),
+            InlineKeyboardButton("❌ Annulla", callback_data="bc_cancel")
+        ]])
+    )
+
+async def broadcast_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Conferma, annullamento e interruzione dell'annuncio."""
+    global broadcast_job
+    query = update.callback_query
+    await query.answer()
+
+    if query.from_user.id not in ADMIN_IDS:
+        await query.edit_message_text(MESSAGES["not_authorized"])
+        return
+
+    if query.data == "bc_cancel":
+        context.user_data.pop('broadcast_text', None)
+        await query.edit_message_text(MESSAGES["broadcast_cancelled"])
+
+    elif query.data == "bc_send":
+        text = context.user_data.pop('broadcast_text', None)
+        if text is None:
+            await query.edit_message_text(MESSAGES["error_generic"])
+            return
+        if broadcast_job is not None and broadcast_job.running:
+            await query.edit_message_text(MESSAGES["broadcast_running"])
+            return
+
+        broadcast_job = BroadcastJob.create(text, query.from_user.id, users.recipients(),
+                                            path=BROADCAST_STATE_FILE, **broadcast_options())
+        broadcast_job.state['status_message'] = query.message.message_id
+        await broadcast_progress(broadcast_job, False)
+        broadcast_job.start()
+
+        logger.info(f"Annuncio avviato da {query.from_user.username or 'anonimo'} per {broadcast_job.total} utenti")
+        await send_log_to_admins(context, f"📣 Annuncio avviato per {broadcast_job.total} utenti")
+
+    elif query.data == "bc_stop":
+        if broadcast_job is not None and broadcast_job.running:
+            broadcast_job.stop()
+            await query.edit_message_text(MESSAGES["broadcast_stopping"])
+
 
 ############################################
 #                                          #
@@ -1001,17 +2035,23 @@ async def list_markers(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #                                          #
 ############################################
 
-if __name__ == '__main__':
-    # Crea l'applicazione
-    token = os.getenv("BOT_TOKEN")
-    # app = ApplicationBuilder().token(token).build()
+def build_application(token, request=None):
+    """Crea l'applicazione con tutti gli handler e i job periodici (senza avviarla).
+
+    `request` sostituisce la richiesta HTTP verso Telegram: gli script di
+    prova (bench/load.py) passano una richiesta finta, senza rete."""
+    if request is None:
+        # Durata delle chiamate all'API (il long polling di getUpdates resta sulla richiesta predefinita)
+        request = TimedRequest(telegram_seconds, telegram_errors, connection_pool_size=256,
+                               read_timeout=30, write_timeout=30)
     app = (
         ApplicationBuilder()
         .token(token)
-        .read_timeout(30)
-        .write_timeout(30)
+        .request(request)
         .concurrent_updates(True)
         .job_queue(JobQueue())  # <-- Aggiungi questa linea
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -1029,6 +2069,7 @@ if __name__ == '__main__':
             ENTER_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_description)],
             ADD_LINK_ASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_link_ask)],
             ADD_LINK: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_link)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
         },
         fallbacks=[CommandHandler("abort", abort)],
         conversation_timeout=TIMEOUT_SECONDS,
@@ -1040,6 +2081,7 @@ if __name__ == '__main__':
         states={
             RENAME_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, rename_select)],
             RENAME_NEW_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, rename_new_name)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
         },
         fallbacks=[CommandHandler("abort", abort)],
         conversation_timeout=TIMEOUT_SECONDS,
@@ -1050,6 +2092,50 @@ if __name__ == '__main__':
         entry_points=[CommandHandler("delete", delete)],
         states={
             DELETE_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_select)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
+        },
+        fallbacks=[CommandHandler("abort", abort)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
+    near_conv = ConversationHandler(
+        entry_points=[CommandHandler("near", near)],
+        states={
+            NEAR_LOCATION: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, near_location),
+                MessageHandler(filters.LOCATION, near_location),
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
+        },
+        fallbacks=[CommandHandler("abort", abort)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
+    subscribe_conv = ConversationHandler(
+        entry_points=[CommandHandler("subscribe", subscribe)],
+        states={
+            SUBSCRIBE_LOCATION: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, subscribe_location),
+                MessageHandler(filters.LOCATION, subscribe_location),
+            ],
+            SUBSCRIBE_RADIUS: [MessageHandler(filters.TEXT & ~filters.COMMAND, subscribe_radius)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
+        },
+        fallbacks=[CommandHandler("abort", abort)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler("import", import_command)],
+        states={
+            IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, import_file),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, import_file),
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
         },
         fallbacks=[CommandHandler("abort", abort)],
         conversation_timeout=TIMEOUT_SECONDS,
@@ -1059,19 +2145,30 @@ if __name__ == '__main__':
     # Registra gli handler
     app.add_handler(CallbackQueryHandler(
         admin_button_handler, 
-        pattern="^(log_on|log_off|stats|export|back_to_menu)$"
+        pattern="^(log_on|log_off|digest_on|digest_off|stats|export|duplicates|back_to_menu)$"
     ))
+    app.add_handler(TypeHandler(Update, track_user), group=-1)
+    app.add_handler(CallbackQueryHandler(broadcast_button, pattern="^bc_(send|cancel|stop)$"))
+    app.add_handler(CallbackQueryHandler(inactive_button, pattern=r"^inactive_(yes|no):\d+$"))
+    app.add_handler(CommandHandler("broadcast", broadcast))
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help))    
     app.add_handler(CommandHandler("list", list_markers))
     app.add_handler(CommandHandler("stats", admin_stats))
     app.add_handler(CommandHandler("admin", admin_menu))
-    app.add_handler(CommandHandler("export", admin_export))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("duplicates", duplicates_command))
+    app.add_handler(CommandHandler("sync", sync_command))
+    app.add_handler(CommandHandler("subscriptions", list_subscriptions))
+    app.add_handler(CommandHandler("unsubscribe", unsubscribe))
 
     # ConversationHandler
     app.add_handler(add_conv)
     app.add_handler(rename_conv)
     app.add_handler(delete_conv)
+    app.add_handler(near_conv)
+    app.add_handler(subscribe_conv)
+    app.add_handler(import_conv)
 
     # Abort "globale" SOLO se non in conversazione
     app.add_handler(CommandHandler("abort", abort_outside_conversation))
@@ -1083,6 +2180,26 @@ if __name__ == '__main__':
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, fallback_handler))
     
     app.add_error_handler(error_handler)
+    instrument_handlers(app)
+
+    # Job periodici
+    app.job_queue.run_repeating(save_users, interval=USERS_SAVE_SECONDS, first=USERS_SAVE_SECONDS)
+    if METRICS_FILE:
+        app.job_queue.run_repeating(save_metrics, interval=METRICS_SAVE_SECONDS, first=METRICS_SAVE_SECONDS)
+    app.job_queue.run_repeating(sweep_sessions, interval=SESSIONS_SWEEP_SECONDS, first=SESSIONS_SWEEP_SECONDS)
+    app.job_queue.run_repeating(inactive_sweep, interval=INACTIVE_SWEEP_SECONDS, first=60)
+    if ingester.enabled:
+        app.job_queue.run_repeating(ingest_job, interval=INGEST_SECONDS, first=30)
+    if STORAGE_BACKEND == "journal":
+        app.job_queue.run_repeating(compact_journal, interval=JOURNAL_COMPACT_SECONDS, first=JOURNAL_COMPACT_SECONDS)
+
+    return app
+
+if __name__ == '__main__':
+    app = build_application(os.getenv("BOT_TOKEN"))
 
     # Avvia il bot
-    app.run_polling()
\ No newline at end of file
+    projections.start()
+    app.run_polling()
+    projections.stop()
+    store.compact()
\ No newline at end of file
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from store import write_bytes_atomic, read_json, write_json
+
+
+class UserRegistry:
+    """Registro degli utenti che hanno scritto al bot (destinatari degli annunci).
+
+    Aggiornato in memoria a ogni update; il file viene riscritto solo quando
+    è cambiato qualcosa, da un job periodico (vedi `dirty`/`dump`)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._users = read_json(path, {})  # {ID: {'username', 'first_seen', 'last_seen', 'blocked'}}
+        self.dirty = False
+
+    def touch(self, user):
+        uid = str(user.id)
+        now = int(time.time())
+        entry = self._users.get(uid)
+        if entry is None:
+            self._users[uid] = {'username': user.username or "", 'first_seen': now,
+                                'last_seen': now, 'blocked': False}
+            self.dirty = True
+            return
+        # Il timestamp viene salvato al più una volta all'ora, per non riscrivere il file a ogni messaggio
+        if now - entry['last_seen'] > 3600 or entry['blocked'] or entry['username'] != (user.username or ""):
+            entry.update(username=user.username or "", last_seen=now, blocked=False)
+            self.dirty = True
+
+    def mark_blocked(self, uid):
+        entry = self._users.get(str(uid))
+        if entry is not None and not entry['blocked']:
+            entry['blocked'] = True
+            self.dirty = True
+
+    def recipients(self):
+        """ID degli utenti raggiungibili, in ordine stabile."""
+        return sorted((uid for uid, e in self._users.items() if not e['blocked']), key=int)
+
+    def __len__(self):
+        return len(self._users)
+
+    def blocked_count(self):
+        return sum(1 for e in self._users.values() if e['blocked'])
+
+    def dump(self):
+        """Copia dei dati da salvare con save() (anche da un altro thread)."""
+        self.dirty = False
+        return json.dumps(self._users, ensure_ascii=False).encode('utf-8')
+
+    def save(self, data=None):
+        write_bytes_atomic(self.path, data if data is not None else self.dump())
+
+
+class BroadcastJob:
+    """Invio di un annuncio a tutti gli utenti, in background e riprendibile.
+
+    Gli invii passano dal MessageDispatcher (quindi rispettano i suoi limiti)
+    a blocchi di `window` destinatari. Dopo ogni blocco la posizione viene
+    salvata nel file di checkpoint: dopo un riavvio l'invio riprende da lì
+    (al più un blocco può essere inviato due volte). La lista dei destinatari
+    è scritta una sola volta, in un file accanto al checkpoint; entrambi
+    vengono eliminati a invio concluso o annullato."""
+
+    def __init__(self, state, path, dispatcher, run_io, window=50, progress_interval=5, on_progress=None):
+        self.state = state
+        self.path = path
+        self.dispatcher = dispatcher
+        self.run_io = run_io            # async (funzione, *argomenti): I/O fuori dall'event loop
+        self.window = window
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress  # async (job, concluso)
+        self.stopped = False
+        self.task = None
+
+    @classmethod
+    def create(cls, text, admin_chat, recipients, **kwargs):
+        state = {
+            'text': text,
+            'admin_chat': admin_chat,
+            'recipients': recipients,
+            'position': 0,
+            'sent': 0,
+            'blocked': 0,
+            'failed': 0,
+            'started': int(time.time()),
+            'status_message': None,
+        }
+        return cls(state, **kwargs)
+
+    @classmethod
+    def resume(cls, path, **kwargs):
+        """Job interrotto da riprendere (None se non c'è un checkpoint)."""
+        state = read_json(path, None)
+        recipients = read_json(path + '.recipients', None)
+        if not state or recipients is None or state['position'] >= len(recipients):
+            return None
+        state['recipients'] = recipients
+        return cls(state, path, **kwargs)
+
+    @property
+    def total(self):
+        return len(self.state['recipients'])
+
+    async def checkpoint(self):
+        state = {k: v for k, v in self.state.items() if k != 'recipients'}
+        await self.run_io(write_json, self.path, state)
+
+    async def _send_block(self, block):
+        results = await asyncio.gather(*(self.dispatcher.deliver(int(uid), self.state['text']) for uid in block))
+        for result in results:
+            self.state[result] += 1
+
+    async def run(self):
+        state = self.state
+        last_progress = 0.0
+        try:
+            if state['position'] == 0:
+                await self.run_io(write_json, self.path + '.recipients', state['recipients'])
+            await self.checkpoint()
+            while state['position'] < self.total and not self.stopped:
+                block = state['recipients'][state['position']:state['position'] + self.window]
+                await self._send_block(block)
+                state['position'] += len(block)
+                await self.checkpoint()
+
+                now = time.monotonic()
+                if self.on_progress is not None and now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    await self._report(False)
+
+            await self.run_io(self._remove_checkpoint)
+            await self._report(True)
+        except asyncio.CancelledError:
+            raise  # Arresto del bot: il checkpoint resta per la ripresa
+        except Exception as e:
+            logging.error(f"Errore durante l'invio dell'annuncio: {e}", exc_info=True)
+
+    async def _report(self, done):
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(self, done)
+        except Exception as e:
+            logging.error(f"Errore aggiornamento avanzamento annuncio: {e}")
+
+    def _remove_checkpoint(self):
+        for path in (self.path, self.path + '.recipients'):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        return self.task
+
+    def stop(self):
+        """Annulla l'invio dopo il blocco in corso."""
+        self.stopped = True
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
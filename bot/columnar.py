@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import struct
+import sys
+from array import array
+
+from feedrows import feed_row
+
+# Formato binario a colonne dei marker (little endian):
+#
+#   header    MAGIC, versione (u16), riservato (u16), nodi (u32), sezioni (u32)
+#   sezioni   per ognuna: nome (8 byte), tipo (2 byte, es. "f4"), riservato (2 byte),
+#             offset (u32), numero di elementi (u32)
+#   dati      le sezioni, ognuna allineata a 8 byte
+#
+# Coordinate Float32, timestamp u32, frequenza, tipo nodo e origine come codici in un
+# piccolo dizionario, tutte le altre stringhe come indici in un'unica tabella
+# di stringhe senza duplicati (offset u32 + byte UTF-8).
+MAGIC = b'MCNB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+SECTION = struct.Struct('<8s2s2xII')
+ALIGN = 8
+
+# Tipo della sezione -> codice di array/memoryview
+TYPECODES = {'f4': 'f', 'u1': 'B', 'u2': 'H', 'u4': 'I'}
+STRING_COLUMNS = ['name', 'desc', 'link', 'ID', 'user']
+DICT_COLUMNS = ['frequency', 'node_type', 'source']
+
+
+class StringTable:
+    """Tabella di stringhe senza duplicati."""
+
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def add(self, value):
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def sections(self):
+        offsets = array('I', [0])
+        data = bytearray()
+        for value in self.values:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+        return offsets, data
+
+
+def _code_type(size):
+    return 'u1' if size <= 0xFF else 'u2' if size <= 0xFFFF else 'u4'
+
+
+def build_snapshot(markers):
+    """Serializza i marker nel formato a colonne. Ritorna (dati, numero di nodi)."""
+    strings = StringTable()
+    columns = {'lat': array('f'), 'lon': array('f'), 'timestamp': array('I')}
+    columns.update({name: array('I') for name in STRING_COLUMNS})
+    dictionaries = {name: {} for name in DICT_COLUMNS}
+    codes = {name: [] for name in DICT_COLUMNS}
+
+    for marker in markers:
+        row = feed_row(marker)
+        if row is None:
+            continue
+        columns['lat'].append(row[0])
+        columns['lon'].append(row[1])
+        columns['timestamp'].append(min(max(row[9], 0), 0xFFFFFFFF))
+        for name in STRING_COLUMNS:
+            columns[name].append(strings.add(str(marker.get(name, ''))))
+        for name in DICT_COLUMNS:
+            entries = dictionaries[name]
+            value = str(marker.get(name, ''))
+            if value not in entries:
+                entries[value] = len(entries)
+            codes[name].append(entries[value])
+
+    sections = [('lat', 'f4', columns['lat']), ('lon', 'f4', columns['lon']),
+                ('ts', 'u4', columns['timestamp'])]
+    for name in DICT_COLUMNS:
+        entries = dictionaries[name]
+        kind = _code_type(len(entries))
+        sections.append((name[:8], kind, array(TYPECODES[kind], codes[name])))
+        # Il dizionario rimanda alla tabella di stringhe
+        sections.append(((name[:6] + '.d'), 'u4', array('I', map(strings.add, entries))))
+    for name in STRING_COLUMNS:
+        sections.append((name, 'u4', columns[name]))
+
+    offsets, data = strings.sections()
+    sections.append(('str.off', 'u4', offsets))
+    sections.append(('str.data', 'u1', data))
+
+    count = len(columns['lat'])
+    offset = _align(HEADER.size + SECTION.size * len(sections))
+    table, blobs = [], []
+    for name, kind, values in sections:
+        blob = _to_little_endian(values, kind)
+        table.append(SECTION.pack(name.encode('ascii'), kind.encode('ascii'), offset, len(values)))
+        padding = _align(len(blob)) - len(blob)
+        blobs.append(blob + b'\0' * padding)
+        offset += len(blob) + padding
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, count, len(sections)) + b''.join(table)
+    header += b'\0' * (_align(len(header)) - len(header))
+    return header + b''.join(blobs), count
+
+
+def _align(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _to_little_endian(values, kind):
+    if kind == 'u1':
+        return bytes(values)
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ColumnarSnapshot:
+    """Lettura del formato a colonne senza copie (mmap + memoryview.cast).
+
+    Le colonne sono viste sul file mappato in memoria: lat, lon, timestamp,
+    frequency, node_type (codici) e gli indici delle stringhe. Le stringhe
+    vengono decodificate solo quando richieste."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # File vuoto
+            self._file.close()
+            raise ValueError(f"Snapshot non valido: {path}")
+        self._view = memoryview(self._mmap)
+        self.sections = {}
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self):
+        magic, version, _, self.count, n_sections = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Snapshot non valido o di una versione non supportata")
+
+        for i in range(n_sections):
+            name, kind, offset, length = SECTION.unpack_from(self._view, HEADER.size + i * SECTION.size)
+            name = name.rstrip(b'\0').decode('ascii')
+            kind = kind.decode('ascii')
+            size = int(kind[1])
+            view = self._view[offset:offset + length * size]
+            if kind == 'u1':
+                self.sections[name] = view
+            elif sys.byteorder == 'little':
+                self.sections[name] = view.cast(TYPECODES[kind])
+            else:
+                # Architettura big endian: serve una copia convertita
+                values = array(TYPECODES[kind], view.tobytes())
+                values.byteswap()
+                self.sections[name] = values
+
+        self.lat = self.sections['lat']
+        self.lon = self.sections['lon']
+        self.timestamp = self.sections['ts']
+        self._offsets = self.sections['str.off']
+        self._data = self.sections['str.data']
+        self._dictionaries = {
+            name: [self.string(i) for i in self.sections[name[:6] + '.d']] for name in DICT_COLUMNS
+        }
+
+    def __len__(self):
+        return self.count
+
+    def string(self, index):
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def value(self, name, i):
+        """Valore testuale della colonna `name` per il nodo i."""
+        if name in DICT_COLUMNS:
+            return self._dictionaries[name][self.sections[name[:8]][i]]
+        return self.string(self.sections[name][i])
+
+    def row(self, i):
+        """Marker i come dizionario (stessi campi del CSV)."""
+        marker = {
+            'lat': str(round(self.lat[i], 6)),
+            'lon': str(round(self.lon[i], 6)),
+            'timestamp': str(self.timestamp[i]),
+        }
+        for name in STRING_COLUMNS + DICT_COLUMNS:
+            marker[name] = self.value(name, i)
+        return marker
+
+    def __iter__(self):
+        return (self.row(i) for i in range(self.count))
+
+    def close(self):
+        # Le viste vanno rilasciate prima di chiudere la mappatura
+        for view in self.sections.values():
+            if isinstance(view, memoryview):
+                view.release()
+        self.sections = {}
+        self.lat = self.lon = self.timestamp = self._offsets = self._data = None
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import zlib
+
+import numpy as np
+
+from store import write_bytes_atomic
+from feedrows import to_float
+from spatial import KM_PER_DEGREE, haversine_km
+from tiles import frequency_slug
+
+NO_SIGNAL = -128  # Valore del raster dove nessun nodo arriva sopra la sensibilità
+
+# Colori della sovrapposizione per margine sopra la sensibilità (dB): (soglia, RGBA)
+COVERAGE_LEVELS = [
+    (0, (244, 67, 54, 90)),     # Segnale debole
+    (10, (255, 193, 7, 110)),   # Discreto
+    (20, (76, 175, 80, 130)),   # Buono
+]
+
+
+class PathLossModel:
+    """Modello log-distance della perdita di percorso per una banda.
+
+    perdita(d) = FSPL a 1 km + 10 * esponente * log10(d km). Con esponente 2
+    è lo spazio libero; valori tra 3 e 4 approssimano ostacoli e terreno.
+    Il margine è la potenza ricevuta meno la sensibilità del ricevitore."""
+
+    def __init__(self, frequency_mhz, tx_power_dbm=20, antenna_gain_dbi=2, sensitivity_dbm=-125,
+                 exponent=3.5, max_km=50):
+        self.frequency_mhz = frequency_mhz
+        self.tx_power_dbm = tx_power_dbm
+        self.antenna_gain_dbi = antenna_gain_dbi
+        self.sensitivity_dbm = sensitivity_dbm
+        self.exponent = exponent
+        self.max_km = max_km
+        self.loss_1km = 20 * math.log10(frequency_mhz) + 32.44  # FSPL a 1 km (dB)
+        self.budget = tx_power_dbm + 2 * antenna_gain_dbi - sensitivity_dbm
+
+    def params(self):
+        return (self.frequency_mhz, self.tx_power_dbm, self.antenna_gain_dbi,
+                self.sensitivity_dbm, self.exponent, self.max_km)
+
+    @property
+    def range_km(self):
+        """Distanza oltre la quale il margine è negativo (al massimo max_km)."""
+        return min(self.max_km, 10 ** ((self.budget - self.loss_1km) / (10 * self.exponent)))
+
+    def margin_db(self, distances_km):
+        distances_km = np.maximum(distances_km, 0.01)
+        return self.budget - self.loss_1km - 10 * self.exponent * np.log10(distances_km)
+
+
+def encode_png(rgba):
+    """PNG RGBA (array altezza x larghezza x 4 uint8) senza dipendenze esterne."""
+    height, width, _ = rgba.shape
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)  # Primo byte di ogni riga: filtro 0
+    rows[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+class CoverageLayer:
+    """Copertura stimata dei nodi, come raster per banda e tile PNG statici.
+
+    Per ogni banda (modello in `models`) il raster su `bounds` (celle di
+    `cell_deg` gradi) contiene il miglior margine in dB tra tutti i nodi.
+    Il contributo di un nodo è calcolato con numpy solo nella finestra del
+    suo raggio massimo ed è tenuto in una cache LRU con chiave (lat, lon,
+    frequenza, parametri del modello): un nuovo nodo aggiorna solo la sua
+    finestra; alla rimozione la finestra viene ricomposta dai soli nodi la
+    cui finestra la interseca (trovati tramite blocchi di `bucket_cells`
+    celle). Vengono riscritti solo i tile PNG (`tile_px` celle di lato)
+    cambiati, per ogni banda e per l'insieme "all"."""
+
+    def __init__(self, directory, models, bounds=(35.0, 6.0, 47.5, 19.0), cell_deg=0.01, tile_px=256,
+                 cache_mb=64, bucket_cells=16):
+        self.directory = directory
+        self.models = {frequency: PathLossModel(**params) for frequency, params in models.items()}
+        self.bounds = bounds  # (sud, ovest, nord, est)
+        self.cell_deg = cell_deg
+        self.tile_px = tile_px
+        self.bucket_cells = bucket_cells
+        self.cache_bytes = cache_mb * 1024 * 1024
+        self.height = int(math.ceil((bounds[2] - bounds[0]) / cell_deg))
+        self.width = int(math.ceil((bounds[3] - bounds[1]) / cell_deg))
+        self.version = 0  # Ultima mutazione inclusa
+        self._reset()
+
+    def _reset(self):
+        self._rasters = {f: np.full((self.height, self.width), NO_SIGNAL, dtype=np.int8) for f in self.models}
+        self._counts = collections.Counter()  # {chiave: marker con quella chiave}
+        self._by_marker = {}                  # {(ID, nome): [chiave, ...]}
+        self._by_bucket = {}                  # {(frequenza, riga, colonna) del blocco: set(chiavi)}
+        self._cache = collections.OrderedDict()  # {chiave: (riga, colonna, margini)}
+        self._cache_size = 0
+        self._dirty = set()                   # {(frequenza, riga, colonna)}
+
+    # -------------- CONTRIBUTO DI UN NODO --------------
+
+    def _key(self, marker):
+        lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+        model = self.models.get(marker.get('frequency'))
+        if lat is None or lon is None or model is None:
+            return None
+        return (round(lat, 5), round(lon, 5), marker['frequency'], model.params())
+
+    def _window(self, key):
+        """Celle (r0, r1, c0, c1) del raster entro il raggio del nodo, vuota se fuori dall'area."""
+        lat, lon, frequency, _ = key
+        radius = self.models[frequency].range_km
+        dlat = radius / KM_PER_DEGREE
+        dlon = radius / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        _, west, north, _ = self.bounds
+        r0 = max(int(math.floor((north - lat - dlat) / self.cell_deg)), 0)
+        r1 = min(int(math.ceil((north - lat + dlat) / self.cell_deg)), self.height)
+        c0 = max(int(math.floor((lon - dlon - west) / self.cell_deg)), 0)
+        c1 = min(int(math.ceil((lon + dlon - west) / self.cell_deg)), self.width)
+        return r0, max(r1, r0), c0, max(c1, c0)
+
+    def _contribution(self, key):
+        """(r0, c0, margini int8) del nodo, dalla cache o calcolato con numpy."""
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        lat, lon, frequency, _ = key
+        model = self.models[frequency]
+        r0, r1, c0, c1 = self._window(key)
+        north, west = self.bounds[2], self.bounds[1]
+        lats = north - (np.arange(r0, r1) + 0.5) * self.cell_deg
+        lons = west + (np.arange(c0, c1) + 0.5) * self.cell_deg
+        distances = haversine_km(lat, lon, lats[:, None], lons[None, :])
+        margin = model.margin_db(distances)
+        margin[(margin < 0) | (distances > model.range_km)] = NO_SIGNAL
+        result = (r0, c0, np.clip(np.round(margin), NO_SIGNAL, 127).astype(np.int8))
+
+        self._cache[key] = result
+        self._cache_size += result[2].nbytes
+        while self._cache_size > self.cache_bytes and len(self._cache) > 1:
+            _, (_, _, old) = self._cache.popitem(last=False)
+            self._cache_size -= old.nbytes
+        return result
+
+    def _tiles(self, frequency, window):
+        r0, r1, c0, c1 = window
+        if r1 <= r0 or c1 <= c0:
+            return []
+        return [(frequency, ty, tx)
+                for ty in range(r0 // self.tile_px, (r1 - 1) // self.tile_px + 1)
+                for tx in range(c0 // self.tile_px, (c1 - 1) // self.tile_px + 1)]
+
+    def _buckets(self, frequency, window):
+        r0, r1, c0, c1 = window
+        if r1 <= r0 or c1 <= c0:
+            return []
+        size = self.bucket_cells
+        return [(frequency, by, bx)
+                for by in range(r0 // size, (r1 - 1) // size + 1)
+                for bx in range(c0 // size, (c1 - 1) // size + 1)]
+
+    # -------------- AGGIORNAMENTO --------------
+
+    def _add_key(self, key):
+        self._counts[key] += 1
+        if self._counts[key] > 1:
+            return  # Stessa posizione e banda di un nodo già presente
+        r0, c0, margin = self._contribution(key)
+        if not margin.size:
+            return
+        view = self._rasters[key[2]][r0:r0 + margin.shape[0], c0:c0 + margin.shape[1]]
+        np.maximum(view, margin, out=view)
+        window = self._window(key)
+        for bucket in self._buckets(key[2], window):
+            self._by_bucket.setdefault(bucket, set()).add(key)
+        self._dirty.update(self._tiles(key[2], window))
+
+    def _remove_key(self, key):
+        self._counts[key] -= 1
+        if self._counts[key] > 0:
+            return
+        del self._counts[key]
+        frequency = key[2]
+        window = self._window(key)
+        r0, r1, c0, c1 = window
+        self._dirty.update(self._tiles(frequency, window))
+
+        # Nodi la cui finestra interseca quella del nodo rimosso (i blocchi sono solo un filtro)
+        others = set()
+        for bucket in self._buckets(frequency, window):
+            members = self._by_bucket.get(bucket)
+            if members is None:
+                continue
+            members.discard(key)
+            if not members:
+                del self._by_bucket[bucket]
+                continue
+            for other in members:
+                if other in others:
+                    continue
+                o0, o1, p0, p1 = self._window(other)
+                if o0 < r1 and r0 < o1 and p0 < c1 and c0 < p1:
+                    others.add(other)
+
+        # Ricompone la finestra del nodo rimosso con quei nodi
+        area = self._rasters[frequency][r0:r1, c0:c1]
+        area[:] = NO_SIGNAL
+        for other in others:
+            o0, p0, margin = self._contribution(other)
+            top, bottom = max(r0, o0), min(r1, o0 + margin.shape[0])
+            left, right = max(c0, p0), min(c1, p0 + margin.shape[1])
+            if top < bottom and left < right:
+                view = area[top - r0:bottom - r0, left - c0:right - c0]
+                np.maximum(view, margin[top - o0:bottom - o0, left - p0:right - p0], out=view)
+
+    def add(self, marker):
+        key = self._key(marker)
+        if key is not None:
+            self._by_marker.setdefault((marker['ID'], marker['name']), []).append(key)
+            self._add_key(key)
+
+    def remove(self, uid, name):
+        for key in self._by_marker.pop((uid, name), []):
+            self._remove_key(key)
+
+    def rename(self, uid, name, new_name):
+        keys = self._by_marker.get((uid, name))
+        if not keys:
+            return
+        key = keys.pop(0)
+        if not keys:
+            del self._by_marker[(uid, name)]
+        self._by_marker.setdefault((uid, new_name), []).append(key)
+
+    def rebuild(self, markers):
+        self._reset()
+        for marker in markers:
+            self.add(marker)
+        self._dirty = {(f, ty, tx) for f in self.models
+                       for ty in range((self.height - 1) // self.tile_px + 1)
+                       for tx in range((self.width - 1) // self.tile_px + 1)}
+
+    def apply(self, mutations):
+        for mutation in mutations:
+            if mutation.get('seq', 0) <= self.version:
+                continue  # Già inclusa nell'ultima ricostruzione
+            self.version = mutation['seq']
+            op = mutation['op']
+            if op == 'add':
+                self.add(mutation['marker'])
+            elif op == 'rename':
+                self.rename(mutation['ID'], mutation['name'], mutation['new_name'])
+            elif op == 'delete':
+                self.remove(mutation['ID'], mutation['name'])
+
+    # -------------- TILE PNG --------------
+
+    def _tile_path(self, name, ty, tx):
+        return os.path.join(self.directory, name, f"{ty}_{tx}.png")
+
+    def _tile_rgba(self, margins):
+        rgba = np.zeros(margins.shape + (4,), dtype=np.uint8)
+        for threshold, color in COVERAGE_LEVELS:
+            rgba[margins >= threshold] = color
+        return rgba
+
+    def _write_tile(self, name, ty, tx, margins):
+        path = self._tile_path(name, ty, tx)
+        if not (margins >= 0).any():
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_bytes_atomic(path, encode_png(self._tile_rgba(margins)), sync=False)
+
+    def write_dirty(self):
+        """Riscrive i tile cambiati (per banda e per l'insieme "all"). Ritorna quanti."""
+        written = set()
+        for frequency, ty, tx in self._dirty:
+            rows = slice(ty * self.tile_px, (ty + 1) * self.tile_px)
+            cols = slice(tx * self.tile_px, (tx + 1) * self.tile_px)
+            self._write_tile(frequency_slug(frequency), ty, tx, self._rasters[frequency][rows, cols])
+            if (ty, tx) not in written:
+                combined = np.maximum.reduce([r[rows, cols] for r in self._rasters.values()])
+                self._write_tile('all', ty, tx, combined)
+                written.add((ty, tx))
+        count = len(self._dirty)
+        self._dirty = set()
+        return count
+
+    def remove_stale(self):
+        """Cancella i file rimasti da configurazioni precedenti (bande o area diverse)."""
+        names = {'all'} | {frequency_slug(f) for f in self.models}
+        rows = (self.height - 1) // self.tile_px + 1
+        cols = (self.width - 1) // self.tile_px + 1
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            folder = os.path.join(self.directory, name)
+            if not os.path.isdir(folder):
+                continue
+            if name not in names:
+                shutil.rmtree(folder, ignore_errors=True)
+                continue
+            for file in os.listdir(folder):
+                try:
+                    ty, tx = (int(v) for v in file[:-4].split('_'))
+                    valid = file.endswith('.png') and ty < rows and tx < cols
+                except ValueError:
+                    valid = False
+                if not valid:
+                    os.unlink(os.path.join(folder, file))
+
+    def write_index(self, version):
+        """Indice letto dalla pagina: area, griglia dei tile e tile presenti per insieme."""
+        sets = {}
+        for name in ['all'] + [frequency_slug(f) for f in self.models]:
+            folder = os.path.join(self.directory, name)
+            files = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+            sets[name] = [[int(v) for v in f[:-4].split('_')] for f in files if f.endswith('.png')]
+        index = {
+            'version': version,
+            'bounds': list(self.bounds),
+            'cell_deg': self.cell_deg,
+            'height': self.height,
+            'width': self.width,
+            'tile_px': self.tile_px,
+            'sets': sets,
+            'levels': [[threshold, list(color)] for threshold, color in COVERAGE_LEVELS],
+        }
+        write_bytes_atomic(os.path.join(self.directory, 'index.json'),
+                           json.dumps(index, separators=(',', ':')).encode('utf-8'), sync=False)
+
+    def projection(self):
+        """Funzione da registrare nel ProjectionWorker."""
+        def project(markers, mutations, version):
+            full = mutations is None or any(m['op'] == 'replace' for m in mutations)
+            if full:
+                # Tutti i tile vengono riscritti sopra quelli esistenti: la pagina non resta senza file
+                self.rebuild(markers)
+                self.version = version
+            else:
+                self.apply(mutations)
+            os.makedirs(self.directory, exist_ok=True)
+            written = self.write_dirty()
+            if full:
+                self.remove_stale()
+            self.write_index(version)
+            logging.debug(f"Copertura aggiornata: {written} tile")
+        return project
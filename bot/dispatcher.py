@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """Divide un testo in parti entro il limite di Telegram, preferibilmente a fine riga."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+class MessageDispatcher:
+    """Coda centrale dei messaggi in uscita, svuotata da un task in background.
+
+    Gli handler accodano con `send()` e proseguono subito. Il task rispetta un
+    limite globale (`rate` messaggi al secondo) e uno per chat (un messaggio
+    ogni `chat_interval` secondi), mantiene l'ordine dei messaggi della stessa
+    chat e riprova dopo un RetryAfter o un errore di rete.
+
+    Con `deliver()` si può invece attendere l'esito del singolo invio.
+
+    Con `log()` i messaggi di log per gli admin possono essere raccolti e
+    inviati come un unico riepilogo ogni `digest_interval` secondi."""
+
+    def __init__(self, rate=25, chat_interval=1.0, max_retries=3, max_in_flight=8,
+                 digest_interval=300, on_forbidden=None):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self.digest_interval = digest_interval
+        self.digest = False  # Se True i log vengono raccolti nel riepilogo periodico
+        self.on_forbidden = on_forbidden  # async (chat_id): bot bloccato dall'utente
+        self.bot = None
+        self.sent = 0
+        self.failed = 0
+        self._queues = {}           # {chat_id: deque di (testo, opzioni, tentativi, future)}
+        self._heap = []             # [(pronta_dal, seq, chat_id)] una voce per chat in attesa
+        self._scheduled = set()     # Chat presenti nell'heap o con un invio in corso
+        self._chat_ready = {}       # {chat_id: istante del prossimo invio consentito}
+        self._digests = collections.defaultdict(list)
+        self._seq = itertools.count()
+        self._next_send = 0.0       # Prossimo invio consentito dal limite globale
+        self._wakeup = None
+        self._slots = None
+        self._tasks = set()
+        self._task = None
+        self._digest_task = None
+
+    @property
+    def pending(self):
+        return sum(len(q) for q in self._queues.values())
+
+    # -------------- ACCODAMENTO --------------
+
+    def send(self, chat_id, text, **kwargs):
+        """Accoda un messaggio (opzioni come bot.send_message). Non attende l'invio."""
+        if self.bot is None:
+            logging.warning(f"Dispatcher non avviato, messaggio a {chat_id} scartato")
+            return
+        for part in split_text(text):
+            self._queues.setdefault(chat_id, collections.deque()).append((part, kwargs, 0, None))
+        self._schedule(chat_id)
+
+    async def deliver(self, chat_id, text, **kwargs):
+        """Accoda un messaggio e ne attende l'esito: "sent", "blocked" o "failed"."""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, collections.deque()).append((text, kwargs, 0, future))
+        self._schedule(chat_id)
+        return await future
+
+    def log(self, chat_id, text):
+        """Messaggio di log: inviato subito o raccolto nel riepilogo se `digest` è attivo."""
+        if self.digest:
+            self._digests[chat_id].append(text)
+        else:
+            self.send(chat_id, text)
+
+    def _loop_time(self):
+        return asyncio.get_running_loop().time()
+
+    def _schedule(self, chat_id):
+        if chat_id in self._scheduled or not self._queues.get(chat_id):
+            return
+        now = self._loop_time()
+        if len(self._chat_ready) > 10000:
+            # Dimentica le chat il cui intervallo è già trascorso
+            self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+        ready = max(now, self._chat_ready.get(chat_id, 0.0))
+        heapq.heappush(self._heap, (ready, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+        self._wakeup.set()
+
+    # -------------- INVIO --------------
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._wait(None)
+                continue
+
+            ready, _, chat_id = self._heap[0]
+            delay = max(ready, self._next_send) - self._loop_time()
+            if delay > 0:
+                await self._wait(delay)
+                continue
+
+            await self._slots.acquire()
+            heapq.heappop(self._heap)
+            self._next_send = self._loop_time() + 1.0 / self.rate
+            task = asyncio.get_running_loop().create_task(self._deliver(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, chat_id):
+        queue = self._queues[chat_id]
+        text, kwargs, attempts, future = queue.popleft()
+        result = None  # Esito da comunicare a chi attende (None = nuovo tentativo)
+        retry_in = 0
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            self.sent += 1
+            result = "sent"
+        except RetryAfter as e:
+            # Limite superato: riprova più tardi e rallenta anche gli altri invii
+            retry_in = e.retry_after
+            if hasattr(retry_in, 'total_seconds'):  # timedelta nelle versioni più recenti
+                retry_in = retry_in.total_seconds()
+            queue.appendleft((text, kwargs, attempts, future))
+            self._next_send = max(self._next_send, self._loop_time() + retry_in)
+            logging.warning(f"RetryAfter per {chat_id}: nuovo tentativo tra {retry_in}s")
+        except Forbidden:
+            # Bot bloccato: i messaggi rimasti per questa chat non servono più
+            self.failed += 1 + len(queue)
+            result = "blocked"
+            for *_, waiting in queue:
+                if waiting is not None and not waiting.done():
+                    waiting.set_result("blocked")
+            queue.clear()
+            if self.on_forbidden is not None:
+                try:
+                    await self.on_forbidden(chat_id)
+                except Exception as e:
+                    logging.error(f"Errore gestione chat bloccata {chat_id}: {e}")
+        except NetworkError as e:
+            if attempts + 1 < self.max_retries:
+                retry_in = 2 ** attempts
+                queue.appendleft((text, kwargs, attempts + 1, future))
+            else:
+                self.failed += 1
+                result = "failed"
+                logging.error(f"Invio a {chat_id} fallito dopo {self.max_retries} tentativi: {e}")
+        except Exception as e:
+            self.failed += 1
+            result = "failed"
+            logging.error(f"Errore invio messaggio a {chat_id}: {e}")
+        finally:
+            if result is not None and future is not None and not future.done():
+                future.set_result(result)
+            self._chat_ready[chat_id] = self._loop_time() + max(self.chat_interval, retry_in)
+            self._scheduled.discard(chat_id)
+            if queue:
+                self._schedule(chat_id)
+            else:
+                del self._queues[chat_id]
+            self._slots.release()
+            self._wakeup.set()
+
+    # -------------- RIEPILOGO LOG --------------
+
+    def flush_digests(self):
+        """Accoda un messaggio di riepilogo per ogni chat con log in attesa."""
+        digests, self._digests = self._digests, collections.defaultdict(list)
+        for chat_id, entries in digests.items():
+            header = f"📢 LOG - riepilogo di {len(entries)} eventi\n\n"
+            self.send(chat_id, header + "\n\n".join(entries))
+
+    async def _digest_loop(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            self.flush_digests()
+
+    # -------------- AVVIO / ARRESTO --------------
+
+    def start(self, bot):
+        if self._task is None:
+            self.bot = bot
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            loop = asyncio.get_running_loop()
+            self._task = loop.create_task(self._run())
+            self._digest_task = loop.create_task(self._digest_loop())
+
+    async def stop(self, timeout=10):
+        """Invia i riepiloghi e i messaggi in coda (entro `timeout` secondi) e si ferma."""
+        if self._task is None:
+            return
+        self._digest_task.cancel()
+        self.flush_digests()
+
+        deadline = self._loop_time() + timeout
+        while (self._heap or self._tasks) and self._loop_time() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending:
+            logging.warning(f"Dispatcher fermato con {self.pending} messaggi non inviati")
+
+        self._task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        self._task = None
+        self._digest_task = None
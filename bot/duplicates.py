@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import difflib
+import math
+import re
+
+import numpy as np
+
+from feedrows import to_float
+from spatial import KM_PER_DEGREE, haversine_km
+
+# Celle confrontate con ogni cella: se stessa e le vicine "in avanti",
+# così ogni coppia di celle adiacenti viene esaminata una sola volta
+FORWARD_CELLS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+CELL_KEY_ROW = 1 << 32  # Chiave di cella: riga * CELL_KEY_ROW + colonna
+
+
+def simplify_name(name):
+    """Nome ridotto a lettere e cifre minuscole ("RPT-Brescia 1" -> "rptbrescia1")."""
+    return re.sub(r'[\W_]+', '', (name or '').casefold())
+
+
+def name_similarity(a, b):
+    """Somiglianza tra 0 e 1 di due nomi già semplificati."""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    shorter, longer = sorted((a, b), key=len)
+    if len(shorter) >= 4 and shorter in longer:
+        return 0.9  # Uno contiene l'altro: "brescia" / "rptbrescia"
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def candidate_pairs(lats, lons, max_km):
+    """Coppie (a, b) di punti entro `max_km`, senza confrontare ogni punto con tutti.
+
+    I punti sono divisi in celle di lato almeno `max_km` e ordinati per cella;
+    per ogni punto le celle vicine si trovano con una ricerca binaria
+    (O(n log n) in tutto). Le coppie delle celle vicine sono generate e
+    filtrate per distanza in blocco con numpy."""
+    # Celle di max_km anche in longitudine, alla latitudine più lontana dall'equatore
+    lat_cell = max_km / KM_PER_DEGREE
+    max_lat = min(float(np.abs(lats).max()), 89.0)
+    lon_cell = lat_cell / max(math.cos(math.radians(max_lat)), 1e-6)
+
+    rows = np.floor(lats / lat_cell).astype(np.int64)
+    cols = np.floor(lons / lon_cell).astype(np.int64)
+    keys = rows * CELL_KEY_ROW + (cols + CELL_KEY_ROW // 2)  # Ordinate per (riga, colonna)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    all_a, all_b = [], []
+    for drow, dcol in FORWARD_CELLS:
+        target = keys + drow * CELL_KEY_ROW + dcol
+        lo = np.searchsorted(sorted_keys, target, 'left')
+        counts = np.searchsorted(sorted_keys, target, 'right') - lo
+        total = int(counts.sum())
+        if not total:
+            continue
+        # Ogni punto "a" ripetuto per i punti della cella vicina, presi da order[lo:hi]
+        a = np.repeat(np.arange(len(keys)), counts)
+        positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        b = order[np.repeat(lo, counts) + positions]
+        if (drow, dcol) == (0, 0):
+            keep = a < b  # Nella stessa cella ogni coppia una sola volta
+            a, b = a[keep], b[keep]
+        all_a.append(a)
+        all_b.append(b)
+
+    if not all_a:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    a, b = np.concatenate(all_a), np.concatenate(all_b)
+    close = haversine_km(lats[a], lons[a], lats[b], lons[b]) <= max_km
+    return a[close], b[close]
+
+
+def find_duplicates(markers, max_km=0.2, min_similarity=0.8):
+    """Gruppi di marker probabilmente duplicati: entro `max_km` l'uno dall'altro
+    e con nomi simili (anche di utenti diversi).
+
+    Il confronto dei nomi avviene solo sulle coppie già vicine. Le coppie
+    trovate sono unite in gruppi (A simile a B e B simile a C -> un solo
+    gruppo). Ritorna una lista di gruppi, ciascuno lista di indici in
+    `markers`, dai più numerosi."""
+    indexes, lats, lons = [], [], []
+    for i, marker in enumerate(markers):
+        lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+        if lat is not None and lon is not None:
+            indexes.append(i)
+            lats.append(lat)
+            lons.append(lon)
+    if not indexes:
+        return []
+
+    pairs_a, pairs_b = candidate_pairs(np.array(lats), np.array(lons), max_km)
+
+    names = {}
+    parent = {}
+
+    def simple(i):
+        if i not in names:
+            names[i] = simplify_name(markers[i].get('name'))
+        return names[i]
+
+    def find(i):
+        while parent.get(i, i) != i:
+            parent[i] = parent.get(parent[i], parent[i])
+            i = parent[i]
+        return i
+
+    for a, b in zip(pairs_a.tolist(), pairs_b.tolist()):
+        a, b = indexes[a], indexes[b]
+        if name_similarity(simple(a), simple(b)) >= min_similarity:
+            parent.setdefault(a, a)
+            parent.setdefault(b, b)
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    groups = {}
+    for i in parent:
+        groups.setdefault(find(i), []).append(i)
+    return sorted((sorted(g) for g in groups.values()), key=lambda g: (-len(g), g[0]))
+
+
+def similar_nearby(index, lat, lon, name, max_km=0.2, min_similarity=0.8, k=20):
+    """Marker già presenti vicino a (lat, lon) con un nome simile a `name`,
+    cercati nell'indice a griglia. Ritorna una lista di (marker, distanza_km)."""
+    wanted = simplify_name(name)
+    return [(marker, km) for marker, km, _ in index.nearest(lat, lon, k=k, max_km=max_km)
+            if name_similarity(wanted, simplify_name(marker.get('name'))) >= min_similarity]
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+from store import FIELDNAMES
+from feedrows import to_float, to_int
+
+# Riquadri approssimativi delle regioni (sud, ovest, nord, est)
+REGIONS = {
+    'abruzzo': (41.68, 13.01, 42.90, 14.79),
+    'basilicata': (39.90, 15.33, 41.14, 16.87),
+    'calabria': (37.91, 15.63, 40.15, 17.21),
+    'campania': (39.99, 13.76, 41.51, 15.81),
+    'emilia-romagna': (43.73, 9.20, 45.14, 12.76),
+    'friuli-venezia-giulia': (45.58, 12.32, 46.65, 13.92),
+    'lazio': (40.78, 11.45, 42.84, 14.03),
+    'liguria': (43.78, 7.49, 44.68, 10.07),
+    'lombardia': (44.68, 8.50, 46.64, 11.43),
+    'marche': (42.69, 12.18, 43.97, 13.92),
+    'molise': (41.36, 13.94, 42.07, 15.16),
+    'piemonte': (44.06, 6.63, 46.46, 9.21),
+    'puglia': (39.79, 14.93, 42.23, 18.52),
+    'sardegna': (38.86, 8.13, 41.31, 9.83),
+    'sicilia': (35.49, 11.93, 38.82, 15.65),
+    'toscana': (42.24, 9.69, 44.47, 12.37),
+    'trentino-alto-adige': (45.67, 10.38, 47.09, 12.48),
+    'umbria': (42.36, 11.89, 43.62, 13.26),
+    'valle-d-aosta': (45.47, 6.80, 45.99, 7.94),
+    'veneto': (44.79, 10.62, 46.68, 13.10),
+}
+
+FORMATS = {
+    'csv': '.csv.gz',
+    'geojson': '.geojson.gz',
+    'kml': '.kml.gz',
+    'gpx': '.gpx.gz',
+}
+
+
+class ExportError(ValueError):
+    """Parametri di esportazione non validi (il messaggio è per l'utente)."""
+
+
+def parse_date(value, end=False):
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"Data non valida: {value} (usa AAAA-MM-GG)")
+    moment = datetime.datetime.combine(day, datetime.time.max if end else datetime.time.min)
+    return int(moment.timestamp())
+
+
+def parse_export_args(args, frequencies):
+    """Parametri di /export: [formato] [bbox=S,O,N,E | regione=nome] [freq=868] [dal=data] [al=data]."""
+    params = {'format': 'csv', 'bbox': None, 'frequency': None, 'since': None, 'until': None}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        key = key.lower()
+        if not sep:
+            if key not in FORMATS:
+                raise ExportError(f"Formato non valido: {arg} (usa {', '.join(FORMATS)})")
+            params['format'] = key
+        elif key == 'bbox':
+            try:
+                south, west, north, east = (float(v) for v in value.split(','))
+            except ValueError:
+                raise ExportError("bbox non valido: usa bbox=sud,ovest,nord,est")
+            params['bbox'] = (min(south, north), min(west, east), max(south, north), max(west, east))
+        elif key == 'regione':
+            region = value.lower().replace(' ', '-').replace("'", '-')
+            if region not in REGIONS:
+                raise ExportError(f"Regione sconosciuta: {value}")
+            params['bbox'] = REGIONS[region]
+        elif key == 'freq':
+            wanted = value.lower().replace(' ', '')
+            frequency = next((f for f in frequencies if wanted in f.lower().replace(' ', '')), None)
+            if frequency is None:
+                raise ExportError(f"Frequenza non valida: {value}")
+            params['frequency'] = frequency
+        elif key == 'dal':
+            params['since'] = parse_date(value)
+        elif key == 'al':
+            params['until'] = parse_date(value, end=True)
+        else:
+            raise ExportError(f"Parametro sconosciuto: {key}")
+    return params
+
+
+def marker_filter(params):
+    """Funzione che dice se un marker rientra nei filtri."""
+    bbox, frequency = params['bbox'], params['frequency']
+    since, until = params['since'], params['until']
+
+    def accept(marker):
+        if frequency is not None and marker.get('frequency') != frequency:
+            return False
+        if bbox is not None:
+            lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+            if lat is None or lon is None or not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]):
+                return False
+        if since is not None or until is not None:
+            ts = to_int(marker.get('timestamp'))
+            if (since is not None and ts < since) or (until is not None and ts > until):
+                return False
+        return True
+    return accept
+
+
+# -------------- FORMATI --------------
+# Ogni formato scrive intestazione, una riga per marker e chiusura sul file di testo.
+
+def iso_time(marker):
+    ts = to_int(marker.get('timestamp'))
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class CsvFormat:
+    def __init__(self, out):
+        self.out = out
+        self.writer = csv.DictWriter(out, fieldnames=FIELDNAMES, extrasaction='ignore')
+
+    def header(self):
+        self.out.write('\ufeff')  # BOM come il CSV condiviso, per Excel
+        self.writer.writeheader()
+
+    def row(self, marker):
+        self.writer.writerow(marker)
+
+    def footer(self):
+        pass
+
+
+class GeoJsonFormat:
+    def __init__(self, out):
+        self.out = out
+        self.first = True
+
+    def header(self):
+        self.out.write('{"type":"FeatureCollection","features":[\n')
+
+    def row(self, marker):
+        lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+        if lat is None or lon is None:
+            return
+        properties = {k: v for k, v in marker.items() if k not in ('lat', 'lon')}
+        feature = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                   'properties': properties}
+        self.out.write(('' if self.first else ',\n') + json.dumps(feature, ensure_ascii=False))
+        self.first = False
+
+    def footer(self):
+        self.out.write('\n]}\n')
+
+
+class KmlFormat:
+    def __init__(self, out):
+        self.out = out
+
+    def header(self):
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+                       '<name>Nodi MeshCore Italia</name>\n')
+
+    def row(self, marker):
+        lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+        if lat is None or lon is None:
+            return
+        description = f"{marker.get('desc', '')}\n{marker.get('frequency', '')} - @{marker.get('user', '')}"
+        if marker.get('link'):
+            description += f"\n{marker['link']}"
+        self.out.write(
+            f"<Placemark><name>{escape(marker.get('name', ''))}</name>"
+            f"<description>{escape(description)}</description>"
+            f"<TimeStamp><when>{iso_time(marker)}</when></TimeStamp>"
+            f"<Point><coordinates>{lon},{lat}</coordinates></Point></Placemark>\n"
+        )
+
+    def footer(self):
+        self.out.write('</Document></kml>\n')
+
+
+class GpxFormat:
+    def __init__(self, out):
+        self.out = out
+
+    def header(self):
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<gpx version="1.1" creator="MeshCoreIT-map" xmlns="http://www.topografix.com/GPX/1/1">\n')
+
+    def row(self, marker):
+        lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+        if lat is None or lon is None:
+            return
+        link = f"<link href={quoteattr(marker['link'])}/>" if marker.get('link') else ""
+        self.out.write(
+            f'<wpt lat="{lat}" lon="{lon}"><time>{iso_time(marker)}</time>'
+            f"<name>{escape(marker.get('name', ''))}</name>"
+            f"<desc>{escape(marker.get('desc', ''))} ({escape(marker.get('frequency', ''))})</desc>"
+            f"{link}<type>{escape(marker.get('node_type', ''))}</type></wpt>\n"
+        )
+
+    def footer(self):
+        self.out.write('</gpx>\n')
+
+
+WRITERS = {'csv': CsvFormat, 'geojson': GeoJsonFormat, 'kml': KmlFormat, 'gpx': GpxFormat}
+
+
+class Exporter:
+    """Esportazioni dei marker scritte in streaming su file gzip, con cache.
+
+    I marker vengono letti e scritti uno alla volta, quindi la memoria non
+    cresce con il dataset. I file sono conservati in `directory` con un nome
+    derivato da (versione dello store, parametri): la stessa esportazione
+    sugli stessi dati viene riusata senza rigenerarla. All'avvio `clear()`
+    cancella le esportazioni precedenti (la versione di alcuni backend
+    riparte da zero), e solo quelle: gli altri file della cartella restano."""
+
+    # Nomi dei file della cache: <sha256 troncato>.<formato>.gz (+ .count) e temporanei
+    CACHE_FILE = re.compile(r'^([0-9a-f]{20}\.[a-z]+\.gz(\.count)?|\.export-.*)$')
+
+    def __init__(self, store, directory, max_files=20):
+        self.store = store
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Cancella le esportazioni rimaste da un avvio precedente."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for name in os.listdir(self.directory):
+                if self.CACHE_FILE.match(name):
+                    os.unlink(os.path.join(self.directory, name))
+
+    def _cache_path(self, version, params):
+        key = json.dumps([version, params], sort_keys=True)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.directory, digest + FORMATS[params['format']])
+
+    def _prune(self):
+        """Tiene solo le `max_files` esportazioni usate più di recente."""
+        files = sorted((os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                        if f.endswith('.gz') and not f.startswith('.')), key=os.path.getmtime)
+        for path in files[:-self.max_files]:
+            for stale in (path, path + '.count'):
+                if os.path.exists(stale):
+                    os.unlink(stale)
+
+    def export(self, params):
+        """Genera (o riusa) l'esportazione. Ritorna (percorso, numero di marker, da_cache)."""
+        version, markers = self.store.iter_markers()
+        path = self._cache_path(version, params)
+        count_path = path + '.count'
+        with self._lock:
+            if os.path.exists(path) and os.path.exists(count_path):
+                os.utime(path)
+                with open(count_path) as f:
+                    return path, int(f.read()), True
+
+            accept = marker_filter(params)
+            count = 0
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.export-')
+            try:
+                with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as gz:
+                    out = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+                    writer = WRITERS[params['format']](out)
+                    writer.header()
+                    for marker in markers:
+                        if accept(marker):
+                            writer.row(marker)
+                            count += 1
+                    writer.footer()
+                    out.flush()
+                    out.detach()
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+
+            with open(count_path, 'w') as f:
+                f.write(str(count))
+            self._prune()
+            return path, count, False
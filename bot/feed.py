@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import time
+
+from store import write_bytes_atomic
+from feedrows import FEED_FIELDS, feed_row
+from columnar import build_snapshot
+
+try:
+    import brotli
+except ImportError:  # Opzionale: senza brotli viene scritto solo il .gz
+    brotli = None
+
+
+def build_feed(markers):
+    """Serializza i marker nel feed JSON compatto (righe come array).
+    Ritorna (dati, numero di nodi)."""
+    rows = [row for row in map(feed_row, markers) if row is not None]
+    feed = {'fields': FEED_FIELDS, 'nodes': rows}
+    return json.dumps(feed, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), len(rows)
+
+
+def feed_change(mutation):
+    """Voce del registro modifiche per una mutazione dello store."""
+    op = mutation['op']
+    if op == 'add':
+        row = feed_row(mutation['marker'])
+        return {'v': mutation['seq'], 'op': 'add', 'node': row} if row is not None else None
+    if op == 'rename':
+        return {'v': mutation['seq'], 'op': 'rename', 'id': mutation['ID'],
+                'name': mutation['name'], 'new_name': mutation['new_name']}
+    if op == 'delete':
+        return {'v': mutation['seq'], 'op': 'delete', 'id': mutation['ID'], 'name': mutation['name']}
+    return None
+
+
+class FeedWriter:
+    """Scrive il feed precompilato per la pagina web accanto al CSV.
+
+    Genera <nome>.json con le sue varianti compresse .gz e .br (se brotli è
+    installato), lo snapshot binario a colonne <nome>.bin, il registro delle ultime modifiche <nome>.changes.json e un
+    piccolo manifest con hash e versione, così i client scaricano il feed solo
+    quando è cambiato e, se sono rimasti indietro di poco, solo le modifiche.
+
+    L'epoch cambia a ogni avvio del bot: un client con un epoch diverso
+    ricarica sempre il feed completo."""
+
+    def __init__(self, directory, name='nodes', max_changes=500):
+        self.directory = directory
+        self.name = name
+        self.hash = None
+        self.files = {}
+        self.manifest = None
+        self.epoch = secrets.token_hex(6)
+        self.changes = collections.deque(maxlen=max_changes)
+        self.changes_from = 0  # Le modifiche coprono le versioni (changes_from, versione]
+
+    def path(self, suffix):
+        return os.path.join(self.directory, self.name + suffix)
+
+    def _record_changes(self, mutations, version):
+        if mutations is None:
+            # Ricostruzione completa: il registro riparte dalla versione attuale
+            self.changes.clear()
+            self.changes_from = version
+            return
+
+        for mutation in mutations:
+            seq = mutation.get('seq')
+            if seq is None or seq <= self.changes_from:
+                continue
+            if mutation['op'] == 'replace':
+                # Contenuto sostituito: i client devono ricaricare il feed completo
+                self.changes.clear()
+                self.changes_from = seq
+                continue
+            change = feed_change(mutation)
+            if change is None:
+                continue
+            if len(self.changes) == self.changes.maxlen:
+                self.changes_from = self.changes[0]['v']
+            self.changes.append(change)
+
+    def _write_changes(self):
+        log = {
+            'epoch': self.epoch,
+            'from': self.changes_from,
+            'version': self.changes[-1]['v'] if self.changes else self.changes_from,
+            'fields': FEED_FIELDS,
+            'changes': list(self.changes),
+        }
+        data = json.dumps(log, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        write_bytes_atomic(self.path('.changes.json'), data)
+
+    def write(self, markers, mutations=None, version=0):
+        self._record_changes(mutations, version)
+        self._write_changes()
+
+        data, count = build_feed(markers)
+        digest = hashlib.sha256(data).hexdigest()
+        if digest != self.hash or not os.path.exists(self.path('.json')):
+            files = {'json': len(data)}
+            write_bytes_atomic(self.path('.json'), data)
+
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            write_bytes_atomic(self.path('.json.gz'), gz)
+            files['gz'] = len(gz)
+
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                write_bytes_atomic(self.path('.json.br'), br)
+                files['br'] = len(br)
+
+            # Snapshot binario a colonne per le mappe molto grandi
+            snapshot, _ = build_snapshot(markers)
+            write_bytes_atomic(self.path('.bin'), snapshot)
+            snapshot_gz = gzip.compress(snapshot, compresslevel=6, mtime=0)
+            write_bytes_atomic(self.path('.bin.gz'), snapshot_gz)
+            files['bin'] = len(snapshot)
+            files['bin_gz'] = len(snapshot_gz)
+
+            self.hash = digest
+            self.files = files
+
+        manifest = {
+            'epoch': self.epoch,
+            'version': version,
+            'hash': digest,
+            'count': count,
+            'feed': self.name + '.json',
+            'changes': self.name + '.changes.json',
+            'snapshot': self.name + '.bin',
+            'files': self.files,
+        }
+        if manifest == self.manifest:
+            return False
+
+        # Il manifest è scritto per ultimo: quando il client lo legge i file a cui rimanda esistono già
+        manifest_data = json.dumps(dict(manifest, generated=int(time.time()))).encode('utf-8')
+        write_bytes_atomic(self.path('.manifest.json'), manifest_data)
+        self.manifest = manifest
+        return True
+
+    def projection(self):
+        """Funzione da registrare nel ProjectionWorker."""
+        def project(markers, mutations, version):
+            self.write(markers, mutations, version)
+        return project
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+# Colonne del feed, nell'ordine delle righe
+FEED_FIELDS = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp', 'source']
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def feed_row(marker):
+    """Riga del feed con i tipi già convertiti (None se le coordinate non sono valide)."""
+    lat, lon = to_float(marker.get('lat')), to_float(marker.get('lon'))
+    if lat is None or lon is None:
+        return None
+    return [
+        lat, lon,
+        marker.get('name', ''), marker.get('desc', ''), marker.get('node_type', ''),
+        marker.get('frequency', ''), marker.get('link', ''), marker.get('ID', ''),
+        marker.get('user', ''), to_int(marker.get('timestamp')), marker.get('source', ''),
+    ]
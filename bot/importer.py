@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import os
+import time
+
+import pandas as pd
+
+from store import FIELDNAMES, NAME_KEY_SEPARATOR
+from textutils import UNSAFE_CHARS
+
+
+# Colonne di testo mostrate sulla mappa: pulite come l'input del bot (vedi clean_text)
+TEXT_COLUMNS = ['name', 'desc', 'node_type', 'user']
+
+
+class UploadError(ValueError):
+    """File di importazione non leggibile (il messaggio è per l'utente)."""
+
+
+class BulkImporter:
+    """Importazione di molti marker da un file CSV o GeoJSON caricato da un admin.
+
+    Tutte le regole dell'inserimento manuale (coordinate, frequenza,
+    lunghezze, link, nomi già usati dall'utente) sono verificate su colonne
+    intere con pandas, senza un ciclo Python per riga. `prepare` ritorna i
+    marker validi, da scrivere con un solo commit, e il report degli errori."""
+
+    def __init__(self, frequencies, max_name, max_desc, max_link, url_pattern,
+                 default_node_type="MeshCore", max_rows=100000):
+        self.frequencies = frequencies
+        self.max_name = max_name
+        self.max_desc = max_desc
+        self.max_link = max_link
+        self.url_pattern = url_pattern
+        self.default_node_type = default_node_type
+        self.max_rows = max_rows
+        # "868 MHz", "868mhz" e "868" indicano la stessa frequenza
+        self._frequency_aliases = {}
+        for frequency in frequencies:
+            alias = frequency.lower().replace(' ', '')
+            self._frequency_aliases[alias] = frequency
+            self._frequency_aliases[alias.removesuffix('mhz')] = frequency
+
+    # -------------- LETTURA --------------
+
+    def read(self, data, filename):
+        """DataFrame di stringhe con le colonne di FIELDNAMES e il numero di riga nel file."""
+        extension = os.path.splitext(filename or '')[1].lower()
+        if extension == '.csv':
+            frame = self._read_csv(data)
+            first_row = 2  # La riga 1 è l'intestazione
+        elif extension in ('.geojson', '.json'):
+            frame = self._read_geojson(data)
+            first_row = 1
+        else:
+            raise UploadError("Formato non supportato: usa un file .csv o .geojson")
+
+        if frame.empty:
+            raise UploadError("Il file non contiene marker")
+        if len(frame) > self.max_rows:
+            raise UploadError(f"Troppe righe: massimo {self.max_rows}")
+
+        # Nomi di colonna senza distinzione tra maiuscole e minuscole ("id" -> "ID")
+        columns = {field.lower(): field for field in FIELDNAMES}
+        frame = frame.rename(columns=lambda c: columns.get(str(c).strip().lower(), c))
+        if 'lat' not in frame or 'lon' not in frame or 'name' not in frame:
+            raise UploadError("Colonne obbligatorie mancanti: lat, lon, name")
+
+        frame = frame.reindex(columns=FIELDNAMES, fill_value='').fillna('').astype(str)
+        frame = frame.apply(lambda column: column.str.strip())
+        frame['row'] = range(first_row, first_row + len(frame))
+        return frame.reset_index(drop=True)
+
+    @staticmethod
+    def _read_csv(data):
+        try:
+            return pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False,
+                               encoding='utf-8-sig', sep=None, engine='python')
+        except (ValueError, UnicodeDecodeError, pd.errors.ParserError, csv.Error) as e:
+            raise UploadError(f"CSV non valido: {e}")
+
+    @staticmethod
+    def _read_geojson(data):
+        try:
+            features = json.loads(data.decode('utf-8-sig'))['features']
+        except (ValueError, UnicodeDecodeError, KeyError, TypeError):
+            raise UploadError("GeoJSON non valido: serve una FeatureCollection")
+
+        rows = []
+        for feature in features:
+            row = dict(feature.get('properties') or {})
+            coordinates = (feature.get('geometry') or {}).get('coordinates') or []
+            if (feature.get('geometry') or {}).get('type') == 'Point' and len(coordinates) >= 2:
+                row['lon'], row['lat'] = coordinates[0], coordinates[1]
+            else:
+                row['lon'] = row['lat'] = ''
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    # -------------- VALIDAZIONE --------------
+
+    def validate(self, frame, existing_names, uploader_id, uploader_name):
+        """Ritorna (marker validi, DataFrame degli errori con colonne riga, nome, ID, errori).
+
+        `existing_names` è l'insieme delle chiavi (ID, nome normalizzato) già
+        presenti nello store, unite con NAME_KEY_SEPARATOR (vedi MarkerStore.name_keys)."""
+        frame = frame.copy()
+        for column in TEXT_COLUMNS:
+            frame[column] = frame[column].str.strip('"\'').str.replace(UNSAFE_CHARS, '', regex=True).str.strip()
+        # I marker importati da un admin sono inseriti dal bot: la colonna 'source' del file
+        # non viene accettata (i layer delle fonti esterne sono riservati alla sincronizzazione)
+        frame['source'] = ''
+
+        # Righe senza proprietario: marker dell'admin che importa
+        no_owner = frame['ID'] == ''
+        frame.loc[no_owner, 'ID'] = str(uploader_id)
+        frame.loc[no_owner & (frame['user'] == ''), 'user'] = uploader_name or "anonimo"
+        frame.loc[frame['user'] == '', 'user'] = "anonimo"
+        frame.loc[frame['node_type'] == '', 'node_type'] = self.default_node_type
+
+        lat = pd.to_numeric(frame['lat'], errors='coerce')
+        lon = pd.to_numeric(frame['lon'], errors='coerce')
+        frequency = frame['frequency'].str.lower().str.replace(' ', '', regex=False).map(self._frequency_aliases)
+        timestamp = pd.to_numeric(frame['timestamp'], errors='coerce')
+        timestamp = timestamp.where(timestamp.between(0, 2 ** 32))  # Fuori intervallo: ora dell'importazione
+        key = frame['ID'] + NAME_KEY_SEPARATOR + frame['name'].str.casefold()
+        has_link = frame['link'] != ''
+
+        checks = [
+            (~lat.between(-90, 90), "latitudine non valida"),
+            (~lon.between(-180, 180), "longitudine non valida"),
+            (frame['name'] == '', "nome mancante"),
+            (frame['name'].str.len() > self.max_name, f"nome oltre {self.max_name} caratteri"),
+            (frame['desc'].str.len() > self.max_desc, f"descrizione oltre {self.max_desc} caratteri"),
+            (frequency.isna(), f"frequenza non valida (usa {', '.join(self.frequencies)})"),
+            (has_link & (frame['link'].str.len() > self.max_link), f"link oltre {self.max_link} caratteri"),
+            (has_link & ~frame['link'].str.match(self.url_pattern), "link non valido"),
+            (~frame['ID'].str.fullmatch(r'-?\d+'), "ID utente non valido"),
+            (key.isin(existing_names), "nome già usato dall'utente"),
+            (key.duplicated(keep='first'), "nome ripetuto nel file per lo stesso utente"),
+        ]
+
+        errors = pd.Series('', index=frame.index)
+        for mask, message in checks:
+            mask = mask.fillna(True)
+            errors = errors.mask(mask, errors + message + '; ')
+        invalid = errors != ''
+
+        frame['lat'] = lat.astype(str)
+        frame['lon'] = lon.astype(str)
+        frame['frequency'] = frequency
+        frame['timestamp'] = timestamp.fillna(int(time.time())).astype('int64').astype(str)
+
+        valid = frame.loc[~invalid, FIELDNAMES]
+        # Più veloce di to_dict('records') su decine di migliaia di righe
+        markers = [dict(zip(FIELDNAMES, values)) for values in zip(*(valid[f].tolist() for f in FIELDNAMES))]
+        report = pd.DataFrame({
+            'riga': frame.loc[invalid, 'row'],
+            'nome': frame.loc[invalid, 'name'],
+            'ID': frame.loc[invalid, 'ID'],
+            'errori': errors[invalid].str.removesuffix('; '),
+        })
+        return markers, report
+
+    def prepare(self, data, filename, existing_names, uploader_id, uploader_name):
+        return self.validate(self.read(data, filename), existing_names, uploader_id, uploader_name)
+
+
+def report_csv(report):
+    """Report degli errori come CSV (con BOM, per Excel)."""
+    return report.to_csv(index=False).encode('utf-8-sig')
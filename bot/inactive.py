@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import json
+import threading
+import time
+
+from store import write_bytes_atomic, read_json
+from feedrows import to_int
+
+
+class InactivityTracker:
+    """Scadenze di conferma dei nodi ("il nodo è ancora attivo?").
+
+    Ogni marker ha l'istante dell'ultima conferma (i marker che non sono
+    nello stato salvato partono dal momento in cui vengono registrati, così
+    un primo avvio o uno stato perso non fanno scadere tutti i nodi vecchi).
+    Dopo `interval` secondi il proprietario riceve una richiesta di conferma;
+    se non risponde entro `grace` secondi il nodo va rimosso. Se la richiesta
+    non viene consegnata il nodo non va in scadenza: la richiesta viene
+    ripetuta dopo `grace` secondi.
+    Le scadenze stanno in un heap: `due()` estrae solo quelle superate, senza
+    scorrere tutti i marker (le voci non più valide vengono scartate
+    all'estrazione). I nodi importati da altre fonti (campo 'source') non
+    hanno un proprietario a cui chiedere e sono esclusi. Va registrato come
+    listener dello store e inizializzato con `rebuild`; lo stato delle
+    conferme è salvato in un file JSON."""
+
+    def __init__(self, path, interval, grace):
+        self.path = path
+        self.interval = interval
+        self.grace = grace
+        self.version = 0  # Ultima mutazione inclusa
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._entries = {}   # {id: {'ID', 'name', 'confirmed', 'prompted', 'deferred'}}
+        self._by_marker = {}  # {(ID, nome): id}
+        self._heap = []      # [(scadenza, id)]
+        self._next_id = 1
+
+    # -------------- SCADENZE --------------
+
+    def _deadline(self, entry):
+        if entry['prompted']:
+            return entry['prompted'] + self.grace
+        return max(entry['confirmed'] + self.interval, entry.get('deferred') or 0)
+
+    def _schedule(self, entry_id):
+        heapq.heappush(self._heap, (self._deadline(self._entries[entry_id]), entry_id))
+
+    def _track(self, uid, name, confirmed, prompted=None, entry_id=None, deferred=None):
+        if entry_id is None:
+            entry_id = self._next_id
+        self._next_id = max(self._next_id, entry_id + 1)
+        self._entries[entry_id] = {'ID': uid, 'name': name, 'confirmed': confirmed, 'prompted': prompted,
+                                   'deferred': deferred}
+        self._by_marker[(uid, name)] = entry_id
+        self._schedule(entry_id)
+        self.dirty = True
+
+    def _untrack(self, uid, name):
+        entry_id = self._by_marker.pop((uid, name), None)
+        if entry_id is not None:
+            del self._entries[entry_id]
+            self.dirty = True
+
+    # -------------- AGGIORNAMENTO --------------
+
+    def rebuild(self, markers, version=0):
+        """Allinea lo stato salvato ai marker presenti (quelli non salvati partono da adesso)."""
+        saved = read_json(self.path, {})
+        saved_entries = {(e['ID'], e['name']): (int(i), e) for i, e in saved.get('entries', {}).items()}
+        now = int(time.time())
+        with self._lock:
+            self._entries, self._by_marker, self._heap = {}, {}, []
+            self._next_id = saved.get('next_id', 1)
+            for marker in markers:
+                key = (marker['ID'], marker['name'])
+                if key in self._by_marker or marker.get('source'):
+                    continue
+                if key in saved_entries:
+                    entry_id, entry = saved_entries[key]
+                    self._track(key[0], key[1], entry['confirmed'], entry['prompted'], entry_id, entry.get('deferred'))
+                else:
+                    self._track(key[0], key[1], now)
+            self.version = version
+
+    def apply(self, mutations):
+        """Listener dello store: applica le mutazioni confermate."""
+        with self._lock:
+            for mutation in mutations:
+                if mutation.get('seq', 0) <= self.version:
+                    continue  # Già inclusa nell'ultima ricostruzione
+                self.version = mutation['seq']
+                op = mutation['op']
+                if op == 'add':
+                    marker = mutation['marker']
+                    if (marker['ID'], marker['name']) not in self._by_marker and not marker.get('source'):
+                        self._track(marker['ID'], marker['name'], to_int(marker.get('timestamp')))
+                elif op == 'rename':
+                    entry_id = self._by_marker.pop((mutation['ID'], mutation['name']), None)
+                    if entry_id is not None:
+                        self._entries[entry_id]['name'] = mutation['new_name']
+                        self._by_marker[(mutation['ID'], mutation['new_name'])] = entry_id
+                        self.dirty = True
+                elif op == 'delete':
+                    self._untrack(mutation['ID'], mutation['name'])
+                elif op == 'replace':
+                    # I nodi ancora presenti mantengono le scadenze, i nuovi partono da adesso
+                    previous = {key: (entry_id, self._entries[entry_id]) for key, entry_id in self._by_marker.items()}
+                    self._entries, self._by_marker, self._heap = {}, {}, []
+                    now = int(time.time())
+                    for marker in mutation['markers']:
+                        key = (marker['ID'], marker['name'])
+                        if key in self._by_marker or marker.get('source'):
+                            continue
+                        if key in previous:
+                            entry_id, entry = previous[key]
+                            self._track(key[0], key[1], entry['confirmed'], entry['prompted'], entry_id, entry.get('deferred'))
+                        else:
+                            self._track(key[0], key[1], now)
+                    self.dirty = True
+
+    def due(self, now, max_prompts=None):
+        """Scadenze superate: (richieste da inviare {ID: [(id, nome)]}, nodi da rimuovere [(id, ID, nome)]).
+
+        I nodi che ricevono la richiesta passano al periodo di grazia. Con
+        `max_prompts` le richieste oltre il limite restano per il giro dopo."""
+        prompts, expired = {}, []
+        sent = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, entry_id = self._heap[0]
+                entry = self._entries.get(entry_id)
+                if entry is None or self._deadline(entry) != deadline:
+                    heapq.heappop(self._heap)  # Voce superata da una conferma o dalla rimozione
+                    continue
+                if entry['prompted']:
+                    heapq.heappop(self._heap)
+                    expired.append((entry_id, entry['ID'], entry['name']))
+                    continue
+                if max_prompts is not None and sent >= max_prompts:
+                    break
+                heapq.heappop(self._heap)
+                entry['prompted'] = int(now)
+                self._schedule(entry_id)
+                prompts.setdefault(entry['ID'], []).append((entry_id, entry['name']))
+                sent += 1
+                self.dirty = True
+        return prompts, expired
+
+    def confirm(self, entry_id, uid, now):
+        """Conferma del proprietario: rinnova la scadenza. Ritorna il nome del nodo o None."""
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None or entry['ID'] != str(uid):
+                return None
+            entry['confirmed'] = int(now)
+            entry['prompted'] = None
+            entry['deferred'] = None
+            self._schedule(entry_id)
+            self.dirty = True
+            return entry['name']
+
+    def undelivered(self, entry_ids, now):
+        """Richieste non consegnate: i nodi escono dal periodo di grazia (non vanno
+        rimossi) e la richiesta viene ripetuta dopo `grace` secondi."""
+        with self._lock:
+            for entry_id in entry_ids:
+                entry = self._entries.get(entry_id)
+                if entry is None or not entry['prompted']:
+                    continue
+                entry['prompted'] = None
+                entry['deferred'] = int(now) + self.grace
+                self._schedule(entry_id)
+                self.dirty = True
+
+    def retry(self, entry_id):
+        """Rimette in coda un nodo scaduto la cui rimozione non è andata a buon fine
+        (es. rinominato nel frattempo): sarà ritentata al prossimo giro."""
+        with self._lock:
+            if entry_id in self._entries:
+                self._schedule(entry_id)
+
+    def get(self, entry_id):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            return dict(entry) if entry is not None else None
+
+    # -------------- PERSISTENZA --------------
+
+    def dump(self):
+        """Contenuto del file, da passare a save() (anche da un altro thread)."""
+        with self._lock:
+            self.dirty = False
+            data = {'next_id': self._next_id, 'entries': self._entries}
+            return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def save(self, data=None):
+        write_bytes_atomic(self.path, data if data is not None else self.dump())
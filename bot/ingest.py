@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import urllib.error
+import urllib.request
+
+from store import write_bytes_atomic, read_json
+from feedrows import to_float, to_int
+from textutils import clean_text
+
+SOURCE = 'meshcore'
+ID_PREFIX = 'mc:'       # ID dei nodi importati: "mc:" + chiave pubblica
+USER = 'MeshCore'       # Mostrato al posto dell'utente Telegram
+MAX_NAME = 32
+
+# Tipi di nodo degli advert MeshCore
+NODE_TYPES = {1: 'Companion', 2: 'Repeater', 3: 'Room Server', 4: 'Sensor'}
+
+# Campi confrontati per capire se un nodo è cambiato: il timestamp dell'ultimo
+# advert cambia a ogni annuncio e da solo non giustifica una scrittura
+HASHED_FIELDS = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link']
+
+# Distanza massima dalla banda più vicina (es. 869.525 -> "868 MHz", 915 scartato)
+FREQUENCY_TOLERANCE_MHZ = 30
+
+
+def node_hash(marker):
+    """Hash dei campi di HASHED_FIELDS di un marker."""
+    values = [marker.get(field, '') for field in HASHED_FIELDS]
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def first(node, *keys):
+    """Primo valore presente tra le chiavi indicate (le sorgenti usano nomi diversi)."""
+    for key in keys:
+        value = node.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def parse_time(value):
+    """Timestamp Unix da un numero o da una data ISO 8601 (0 se non valido)."""
+    if isinstance(value, str) and not re.fullmatch(r'-?[\d.]+', value.strip()):
+        try:
+            return int(datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00')).timestamp())
+        except ValueError:
+            return 0
+    ts = to_int(value)
+    return ts // 1000 if ts > 10 ** 11 else ts  # Millisecondi
+
+
+def node_list(data):
+    """Lista dei nodi da una risposta JSON: lista o oggetto con 'nodes', 'data' o 'contacts'."""
+    if isinstance(data, dict):
+        data = next((data[k] for k in ('nodes', 'data', 'contacts') if isinstance(data.get(k), list)), None)
+    if not isinstance(data, list):
+        raise ValueError("Lista dei nodi MeshCore non valida")
+    return [node for node in data if isinstance(node, dict)]
+
+
+class MeshCoreIngester:
+    """Sincronizzazione incrementale dei nodi MeshCore (API JSON o file esportato).
+
+    I nodi sono identificati dalla chiave pubblica (ID "mc:<chiave>") e
+    marcati con source = "meshcore", così la pagina li disegna in un layer a
+    parte. Per ogni nodo importato viene tenuto l'hash dei campi mostrati
+    sulla mappa, aggiornato come listener dello store: `plan` confronta la
+    lista scaricata con gli hash e ritorna solo le mutazioni dei nodi nuovi,
+    cambiati o spariti. Il cursore della sorgente (ETag/Last-Modified per
+    l'API, mtime e dimensione per il file, hash del contenuto per entrambi) è
+    salvato su file: una lista non cambiata non viene nemmeno analizzata."""
+
+    def __init__(self, state_path, frequencies, url=None, path=None, bounds=None,
+                 remove_missing=True, timeout=30):
+        self.state_path = state_path
+        self.url = url
+        self.path = path
+        self.bounds = bounds  # (sud, ovest, nord, est) o None
+        self.remove_missing = remove_missing
+        self.timeout = timeout
+        self.cursor = read_json(state_path, {}).get('cursor', {})
+        self.version = 0  # Ultima mutazione inclusa
+        self._lock = threading.Lock()
+        self._nodes = {}  # {ID: (nome, hash)}
+        self._bands = []  # [(MHz, frequenza)]
+        for frequency in frequencies:
+            match = re.match(r'\d+(\.\d+)?', frequency)
+            if match:
+                self._bands.append((float(match.group()), frequency))
+
+    @property
+    def enabled(self):
+        return bool(self.url or self.path)
+
+    # -------------- CONVERSIONE --------------
+
+    def band(self, mhz):
+        """Frequenza del bot più vicina a quella del nodo (in MHz, kHz o Hz), o None."""
+        if not mhz or mhz <= 0 or not self._bands:
+            return None
+        while mhz > 10000:
+            mhz /= 1000
+        distance, frequency = min((abs(mhz - center), frequency) for center, frequency in self._bands)
+        return frequency if distance <= FREQUENCY_TOLERANCE_MHZ else None
+
+    def to_marker(self, node):
+        """Marker di un nodo della lista, o None se manca la posizione, è fuori
+        dall'area o usa una frequenza non gestita dal bot."""
+        key = first(node, 'public_key', 'pubkey', 'publicKey')
+        lat = to_float(first(node, 'adv_lat', 'lat', 'latitude'))
+        lon = to_float(first(node, 'adv_lon', 'lon', 'longitude'))
+        if not key or lat is None or lon is None or (lat == 0 and lon == 0):
+            return None  # Posizione non condivisa
+        if self.bounds and not (self.bounds[0] <= lat <= self.bounds[2] and self.bounds[1] <= lon <= self.bounds[3]):
+            return None
+
+        params = node.get('params') if isinstance(node.get('params'), dict) else {}
+        frequency = self.band(to_float(first(params, 'freq', 'frequency')) or to_float(first(node, 'freq', 'frequency')))
+        if frequency is None:
+            return None
+
+        # I testi arrivano da advert di terzi: stessa pulizia dell'inserimento dal bot (niente HTML)
+        kind = first(node, 'type', 'adv_type', 'node_type')
+        node_type = NODE_TYPES.get(to_int(kind)) or (clean_text(str(kind)).strip().title()[:MAX_NAME] if kind is not None else '')
+        key = re.sub(r'[^0-9a-z]', '', str(key).lower())
+        if not key:
+            return None
+        name = clean_text(str(first(node, 'adv_name', 'name') or '')).strip()[:MAX_NAME] or key[:8]
+        return {
+            'lat': str(round(lat, 6)), 'lon': str(round(lon, 6)),
+            'name': name, 'desc': '', 'node_type': node_type or 'MeshCore',
+            'frequency': frequency, 'link': '',
+            'ID': ID_PREFIX + key, 'user': USER,
+            'timestamp': str(parse_time(first(node, 'last_advert', 'updated_at', 'timestamp'))),
+            'source': SOURCE,
+        }
+
+    # -------------- INDICE DEI NODI IMPORTATI --------------
+
+    def rebuild(self, markers, version=0):
+        with self._lock:
+            self._nodes = {m['ID']: (m['name'], node_hash(m)) for m in markers if m.get('source') == SOURCE}
+            self.version = version
+
+    def apply(self, mutations):
+        """Listener dello store: applica le mutazioni confermate."""
+        with self._lock:
+            for mutation in mutations:
+                if mutation.get('seq', 0) <= self.version:
+                    continue  # Già inclusa nell'ultima ricostruzione
+                self.version = mutation['seq']
+                op = mutation['op']
+                if op == 'add':
+                    marker = mutation['marker']
+                    if marker.get('source') == SOURCE:
+                        self._nodes[marker['ID']] = (marker['name'], node_hash(marker))
+                elif op == 'rename':
+                    entry = self._nodes.get(mutation['ID'])
+                    if entry and entry[0] == mutation['name']:
+                        self._nodes[mutation['ID']] = (mutation['new_name'], None)  # Sarà riscritto al prossimo sync
+                elif op == 'delete':
+                    entry = self._nodes.get(mutation['ID'])
+                    if entry and entry[0] == mutation['name']:
+                        del self._nodes[mutation['ID']]
+                elif op == 'replace':
+                    self._nodes = {m['ID']: (m['name'], node_hash(m))
+                                   for m in mutation['markers'] if m.get('source') == SOURCE}
+
+    def count(self):
+        with self._lock:
+            return len(self._nodes)
+
+    # -------------- SINCRONIZZAZIONE --------------
+
+    def fetch(self, force=False):
+        """Legge la lista dalla sorgente. Ritorna (nodi, cursore) o None se non è cambiata
+        dall'ultimo sync confermato con commit() (con force=True la rilegge comunque)."""
+        if self.url:
+            result = self._fetch_url(force)
+        elif self.path:
+            result = self._fetch_file(force)
+        else:
+            return None
+        if result is None:
+            return None
+
+        body, cursor = result
+        cursor['hash'] = hashlib.sha1(body).hexdigest()
+        if not force and cursor['hash'] == self.cursor.get('hash'):
+            return None  # Stesso contenuto (sorgente senza ETag, file riscritto uguale)
+        return node_list(json.loads(body.decode('utf-8-sig'))), cursor
+
+    def _fetch_url(self, force):
+        request = urllib.request.Request(self.url, headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip'})
+        if not force and self.cursor.get('etag'):
+            request.add_header('If-None-Match', self.cursor['etag'])
+        if not force and self.cursor.get('modified'):
+            request.add_header('If-Modified-Since', self.cursor['modified'])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                return body, {'etag': response.headers.get('ETag'), 'modified': response.headers.get('Last-Modified')}
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None  # Non modificata
+            raise
+
+    def _fetch_file(self, force):
+        stat = os.stat(self.path)
+        cursor = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        if not force and all(self.cursor.get(k) == v for k, v in cursor.items()):
+            return None
+        with open(self.path, 'rb') as f:
+            return f.read(), cursor
+
+    def plan(self, nodes):
+        """Mutazioni per allineare lo store alla lista: ritorna (mutazioni, conteggi).
+
+        I nodi cambiati diventano una cancellazione seguita da un'aggiunta;
+        quelli uguali non producono nulla. Con remove_missing i nodi importati
+        non più presenti nella lista (o usciti dall'area) vengono rimossi."""
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'skipped': 0}
+        wanted = {}
+        for node in nodes:
+            marker = self.to_marker(node)
+            if marker is None:
+                counts['skipped'] += 1
+            else:
+                wanted[marker['ID']] = marker  # A parità di chiave vale l'ultimo
+
+        with self._lock:
+            current = dict(self._nodes)
+
+        mutations = []
+        for uid, marker in wanted.items():
+            old = current.get(uid)
+            if old is None:
+                counts['added'] += 1
+            elif old[1] == node_hash(marker):
+                counts['unchanged'] += 1
+                continue
+            else:
+                counts['updated'] += 1
+                mutations.append({'op': 'delete', 'ID': uid, 'name': old[0]})
+            mutations.append({'op': 'add', 'marker': marker})
+
+        # Lista vuota: probabilmente un errore della sorgente, non si rimuove nulla
+        if self.remove_missing and wanted:
+            for uid, (name, _) in current.items():
+                if uid not in wanted:
+                    counts['removed'] += 1
+                    mutations.append({'op': 'delete', 'ID': uid, 'name': name})
+        return mutations, counts
+
+    def commit(self, cursor):
+        """Salva il cursore dopo che le mutazioni del sync sono state scritte."""
+        self.cursor = cursor
+        write_bytes_atomic(self.state_path, json.dumps({'cursor': cursor}).encode('utf-8'))
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+import contextlib
+import functools
+import logging
+import threading
+import time
+
+from aiohttp import web
+from telegram.request import HTTPXRequest
+
+from store import write_bytes_atomic
+
+# Limiti dei bucket (secondi): dai comandi in memoria ai commit su disco lenti
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class LoopLagMonitor:
+    """Misura il ritardo dell'event loop.
+
+    Un task dorme per `interval` secondi e confronta il risveglio effettivo
+    con quello atteso: la differenza è il tempo in cui il loop era bloccato."""
+
+    def __init__(self, interval=0.5, warn_threshold=0.2):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.last = 0.0
+        self.max = 0.0
+        self.avg = 0.0  # Media mobile esponenziale
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.avg = lag if not self.avg else self.avg * 0.9 + lag * 0.1
+            if lag > self.warn_threshold:
+                logging.warning(f"Event loop bloccato per {lag * 1000:.0f} ms")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{n}="{escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Metrica con etichette, nel formato testuale di Prometheus."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # {valori delle etichette: valore}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """Righe (nome, etichette, valore) da esporre."""
+        with self._lock:
+            return [(self.name, format_labels(self.labels, key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Valore istantaneo. Con `func` il valore viene letto al momento
+    dell'esposizione: un numero, o {valore dell'etichetta: numero} se la
+    metrica ha un'etichetta."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), func=None):
+        super().__init__(name, documentation, labels)
+        self.func = func
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.func is None:
+            return super().samples()
+        try:
+            value = self.func()
+        except Exception as e:
+            logging.error(f"Errore nella lettura della metrica {self.name}: {e}")
+            return []
+        if isinstance(value, dict):
+            return [(self.name, format_labels(self.labels, (key,)), v) for key, v in value.items()]
+        return [(self.name, '', value)]
+
+
+class Histogram(Metric):
+    """Distribuzione delle durate (secondi) in bucket cumulativi."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # [conteggi, somma, totale]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="' + format_value(bound) + '"'
+                samples.append((self.name + '_bucket', format_labels(self.labels, key, le), cumulative))
+            labels = format_labels(self.labels, key)
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Insieme delle metriche del bot, esposte in formato Prometheus su
+    /metrics (server HTTP locale) e/o scritte periodicamente su file (per il
+    textfile collector di node_exporter)."""
+
+    def __init__(self, prefix='meshmap_'):
+        self.prefix = prefix
+        self._metrics = []
+        self._runner = None
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self.prefix + name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), func=None):
+        return self._register(Gauge(self.prefix + name, documentation, labels, func))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, labels, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+    def save(self, path):
+        write_bytes_atomic(path, self.render().encode('utf-8'), sync=False)
+
+    # -------------- SERVER HTTP --------------
+
+    async def handle(self, request):
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8',
+                            headers={'Cache-Control': 'no-cache'})
+
+    async def start(self, host='127.0.0.1', port=9108):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Metriche su http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def timed(histogram, **labels):
+    """Decoratore per funzioni asincrone: registra la durata di ogni chiamata."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedBackend:
+    """Backend dello store che misura la durata di letture (load, replay),
+    commit e compattazioni. Gli altri attributi vengono delegati al backend."""
+
+    def __init__(self, backend, histogram):
+        self.backend = backend
+        self.histogram = histogram
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def load(self):
+        with self.histogram.time(operation='load'):
+            return self.backend.load()
+
+    def replay(self):
+        with self.histogram.time(operation='replay'):
+            return self.backend.replay()
+
+    def commit(self, mutations, snapshot):
+        with self.histogram.time(operation='commit'):
+            return self.backend.commit(mutations, snapshot)
+
+    def compact(self, markers):
+        with self.histogram.time(operation='compact'):
+            return self.backend.compact(markers)
+
+
+class TimedRequest(HTTPXRequest):
+    """Richieste HTTP verso Telegram con la durata per metodo dell'API
+    (sendMessage, getFile, ...) ed errori di rete."""
+
+    def __init__(self, histogram, errors=None, **kwargs):
+        super().__init__(**kwargs)
+        self.histogram = histogram
+        self.errors = errors
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, read_timeout, write_timeout,
+                                            connect_timeout, pool_timeout)
+        except Exception:
+            if self.errors is not None:
+                self.errors.inc(method=endpoint)
+            raise
+        finally:
+            self.histogram.observe(time.perf_counter() - start, method=endpoint)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import logging
+import time
+
+from store import write_csv_file
+
+
+class ProjectionWorker:
+    """Rigenera in background i file derivati dallo store (CSV per il web, ...).
+
+    Le modifiche ravvicinate vengono accorpate: dopo una notifica il worker
+    attende `delay` secondi e poi esegue tutte le proiezioni una sola volta.
+    Ogni proiezione è una funzione (markers, mutations, version); mutations è
+    None quando serve una ricostruzione completa (avvio) e version è la
+    versione dello store a cui corrisponde la lista dei marker. Con
+    `histogram` la durata di ogni proiezione viene registrata per nome."""
+
+    def __init__(self, store, delay=1.0, histogram=None):
+        self.store = store
+        self.delay = delay
+        self.histogram = histogram
+        self._projections = []
+        self._pending = []
+        self._full = True
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = None
+        store.add_listener(self.notify)
+
+    def register(self, name, func):
+        self._projections.append((name, func))
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def notify(self, mutations):
+        with self._cond:
+            self._pending.extend(mutations)
+            self._cond.notify()
+
+    def run_once(self):
+        """Esegue subito tutte le proiezioni con le modifiche in sospeso."""
+        with self._cond:
+            mutations = None if self._full else self._pending
+            self._pending = []
+            self._full = False
+
+        version, markers = self.store.snapshot()
+        for name, func in self._projections:
+            start = time.perf_counter()
+            try:
+                func(markers, mutations, version)
+            except Exception as e:
+                logging.error(f"Errore nella proiezione {name}: {e}", exc_info=True)
+            else:
+                logging.debug(f"Proiezione {name} aggiornata in {time.perf_counter() - start:.3f}s")
+            finally:
+                if self.histogram is not None:
+                    self.histogram.observe(time.perf_counter() - start, projection=name)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._full and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._pending:
+                    return
+            time.sleep(self.delay)  # Accorpa le modifiche ravvicinate
+            self.run_once()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="projections", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Ferma il worker dopo aver scritto le modifiche in sospeso."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def csv_projection(path):
+    """Proiezione che riscrive il CSV letto dalla pagina web."""
+    def project(markers, mutations, version):
+        write_csv_file(path, markers)
+    return project
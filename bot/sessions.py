@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import threading
+import time
+
+from store import write_bytes_atomic, read_json
+
+
+class SessionManager:
+    """Operazione in corso per ogni utente (add, rename, near, ...), con scadenza.
+
+    Le chiavi sono sempre l'ID utente come stringa. Ogni sessione scade dopo
+    `ttl` secondi dall'ultima attività (come il conversation_timeout delle
+    conversazioni): le sessioni scadute vengono scartate alla lettura e da
+    `sweep()`, chiamato periodicamente. Le sessioni sono ordinate per ultima
+    attività, quindi la pulizia esamina solo quelle scadute; oltre
+    `max_sessions` vengono eliminate le meno recenti. Con `path` lo stato
+    può essere salvato e ricaricato dopo un riavvio."""
+
+    def __init__(self, ttl, max_sessions=10000, path=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.path = path
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()  # {ID: (operazione, ultima attività)}, dalla meno recente
+
+    def _expired(self, last, now):
+        return now - last >= self.ttl
+
+    def _get(self, uid, now):
+        session = self._sessions.get(uid)
+        if session is not None and self._expired(session[1], now):
+            del self._sessions[uid]
+            self.evicted += 1
+            return None
+        return session
+
+    # -------------- SESSIONI --------------
+
+    def start(self, uid, operation):
+        """Registra l'operazione in corso dell'utente (sostituisce la precedente)."""
+        now = time.time()
+        with self._lock:
+            self._sessions[str(uid)] = (operation, now)
+            self._sessions.move_to_end(str(uid))
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def touch(self, uid):
+        """Rinnova la scadenza della sessione (a ogni passo della conversazione)."""
+        now = time.time()
+        with self._lock:
+            session = self._get(str(uid), now)
+            if session is not None:
+                self._sessions[str(uid)] = (session[0], now)
+                self._sessions.move_to_end(str(uid))
+
+    def end(self, uid, operation=None):
+        """Chiude la sessione; con `operation` solo se è quella l'operazione in corso."""
+        with self._lock:
+            session = self._sessions.get(str(uid))
+            if session is not None and (operation is None or session[0] == operation):
+                del self._sessions[str(uid)]
+                return True
+            return False
+
+    def get(self, uid):
+        """Operazione in corso dell'utente o None."""
+        with self._lock:
+            session = self._get(str(uid), time.time())
+            return session[0] if session is not None else None
+
+    def active(self, uid):
+        return self.get(uid) is not None
+
+    def busy(self, uid, operation=None):
+        """True se l'utente ha in corso un'operazione diversa da `operation`."""
+        current = self.get(uid)
+        return current is not None and current != operation
+
+    def sweep(self):
+        """Elimina le sessioni scadute. Ritorna quante ne ha eliminate."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                uid, (_, last) = next(iter(self._sessions.items()))
+                if not self._expired(last, now):
+                    break  # Le successive sono più recenti
+                del self._sessions[uid]
+                removed += 1
+            self.evicted += removed
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    # -------------- PERSISTENZA --------------
+
+    def load(self):
+        """Ricarica le sessioni salvate non ancora scadute."""
+        if not self.path:
+            return
+        now = time.time()
+        saved = read_json(self.path, {})
+        with self._lock:
+            self._sessions.clear()
+            for uid, (operation, last) in sorted(saved.items(), key=lambda item: item[1][1]):
+                if not self._expired(last, now):
+                    self._sessions[uid] = (operation, last)
+
+    def dump(self):
+        """Contenuto del file, da passare a save() (anche da un altro thread)."""
+        with self._lock:
+            return json.dumps(self._sessions).encode('utf-8')
+
+    def save(self, data=None):
+        if self.path:
+            write_bytes_atomic(self.path, data if data is not None else self.dump())
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+COMPASS = ["N", "NE", "E", "SE", "S", "SO", "O", "NO"]
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distanza in km da (lat, lon) a tutti i punti degli array (in gradi).
+    Anche (lat, lon) possono essere array: distanze elemento per elemento."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bearing_deg(lat, lon, lats, lons):
+    """Direzione iniziale (0-360°, 0 = nord) da (lat, lon) verso i punti degli array."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    dlon = lons - lon
+    y = np.sin(dlon) * np.cos(lats)
+    x = math.cos(lat) * np.sin(lats) - math.sin(lat) * np.cos(lats) * np.cos(dlon)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
+
+def compass_point(bearing):
+    return COMPASS[int((bearing + 22.5) // 45) % 8]
+
+
+class GridIndex:
+    """Indice spaziale a griglia regolare (celle di `cell_deg` gradi) sui marker.
+
+    Le coordinate stanno in array numpy (slot riusati dopo le eliminazioni),
+    le celle contengono gli slot dei propri nodi. La ricerca dei più vicini
+    esamina anelli di celle crescenti attorno al punto finché i k risultati
+    trovati sono certamente più vicini di qualsiasi cella non ancora vista;
+    le distanze dei candidati sono calcolate in blocco con numpy. Le celle
+    non si richiudono sull'antimeridiano (la mappa copre l'Italia).
+
+    Va registrato come listener dello store (`index.apply`), che lo tiene
+    aggiornato a ogni commit."""
+
+    def __init__(self, cell_deg=0.1, capacity=1024):
+        self.cell_deg = cell_deg
+        self.version = 0  # Ultima mutazione inclusa
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._reset()
+
+    def _reset(self):
+        self._lat = np.zeros(self._capacity)
+        self._lon = np.zeros(self._capacity)
+        self._freq = np.zeros(self._capacity, dtype=np.int32)
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._markers = [None] * self._capacity  # Marker per slot (None = libero)
+        self._free = []
+        self._next = 0
+        self._cells = {}       # {(riga, colonna): [slot, ...]}
+        self._by_marker = {}   # {(ID, nome): [slot, ...]}
+        self._freq_codes = {}  # {frequenza: codice}
+        self.count = 0
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _grow(self):
+        size = self._capacity * 2
+        self._lat = np.resize(self._lat, size)
+        self._lon = np.resize(self._lon, size)
+        self._freq = np.resize(self._freq, size)
+        self._alive = np.concatenate([self._alive, np.zeros(size - self._capacity, dtype=bool)])
+        self._markers.extend([None] * (size - self._capacity))
+        self._capacity = size
+
+    # -------------- AGGIORNAMENTO --------------
+
+    def _add(self, marker):
+        try:
+            lat, lon = float(marker['lat']), float(marker['lon'])
+        except (KeyError, TypeError, ValueError):
+            return
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._next == self._capacity:
+                self._grow()
+            slot = self._next
+            self._next += 1
+
+        self._lat[slot] = lat
+        self._lon[slot] = lon
+        self._freq[slot] = self._freq_codes.setdefault(marker.get('frequency', ''), len(self._freq_codes))
+        self._alive[slot] = True
+        self._markers[slot] = dict(marker)
+        self._cells.setdefault(self._cell(lat, lon), []).append(slot)
+        self._by_marker.setdefault((marker['ID'], marker['name']), []).append(slot)
+        self.count += 1
+
+    def _remove_slot(self, slot):
+        cell = self._cell(self._lat[slot], self._lon[slot])
+        members = self._cells[cell]
+        members.remove(slot)
+        if not members:
+            del self._cells[cell]
+        self._alive[slot] = False
+        self._markers[slot] = None
+        self._free.append(slot)
+        self.count -= 1
+
+    def _delete(self, uid, name):
+        for slot in self._by_marker.pop((uid, name), []):
+            self._remove_slot(slot)
+
+    def _rename(self, uid, name, new_name):
+        slots = self._by_marker.get((uid, name))
+        if not slots:
+            return
+        slot = slots.pop(0)
+        if not slots:
+            del self._by_marker[(uid, name)]
+        self._markers[slot]['name'] = new_name
+        self._by_marker.setdefault((uid, new_name), []).append(slot)
+
+    def rebuild(self, markers, version=0):
+        with self._lock:
+            self._reset()
+            for marker in markers:
+                self._add(marker)
+            self.version = version
+
+    def apply(self, mutations):
+        """Listener dello store: applica le mutazioni confermate."""
+        with self._lock:
+            for mutation in mutations:
+                if mutation.get('seq', 0) <= self.version:
+                    continue  # Già inclusa nell'ultima ricostruzione
+                self.version = mutation['seq']
+                op = mutation['op']
+                if op == 'add':
+                    self._add(mutation['marker'])
+                elif op == 'rename':
+                    self._rename(mutation['ID'], mutation['name'], mutation['new_name'])
+                elif op == 'delete':
+                    self._delete(mutation['ID'], mutation['name'])
+                elif op == 'replace':
+                    self._reset()
+                    for marker in mutation['markers']:
+                        self._add(marker)
+
+    # -------------- RICERCA --------------
+
+    def _ring(self, row, col, r):
+        """Celle occupate sul bordo dell'anello di raggio r (in celle)."""
+        if r == 0:
+            cell = self._cells.get((row, col))
+            return [cell] if cell else []
+        found = []
+        for dc in range(-r, r + 1):
+            for dr in (-r, r):
+                cell = self._cells.get((row + dr, col + dc))
+                if cell:
+                    found.append(cell)
+        for dr in range(-r + 1, r):
+            for dc in (-r, r):
+                cell = self._cells.get((row + dr, col + dc))
+                if cell:
+                    found.append(cell)
+        return found
+
+    def _covered_km(self, lat, r):
+        """Distanza minima dal punto a qualsiasi cella fuori dall'anello r."""
+        edge_lat = min(abs(lat) + (r + 1) * self.cell_deg, 90.0)
+        lon_km = self.cell_deg * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+        return r * min(self.cell_deg * KM_PER_DEGREE, lon_km)
+
+    def nearest(self, lat, lon, k=5, frequency=None, max_km=None):
+        """I k nodi più vicini a (lat, lon), opzionalmente di una sola frequenza.
+        Ritorna una lista di (marker, distanza_km, direzione_gradi)."""
+        with self._lock:
+            if frequency is not None and frequency not in self._freq_codes:
+                return []
+            code = self._freq_codes.get(frequency)
+            row, col = self._cell(lat, lon)
+            occupied = len(self._cells)
+
+            slots = []
+            seen_cells = 0
+            r = 0
+            while True:
+                ring = self._ring(row, col, r)
+                seen_cells += len(ring)
+                for cell in ring:
+                    slots.extend(cell)
+                covered = self._covered_km(lat, r)
+
+                if seen_cells >= occupied or (max_km is not None and covered >= max_km):
+                    break
+                # Basta quando i k candidati più vicini sono entro la zona già esplorata
+                if len(slots) >= k:
+                    candidates = np.fromiter(slots, dtype=np.intp, count=len(slots))
+                    if code is not None:
+                        candidates = candidates[self._freq[candidates] == code]
+                    if len(candidates) >= k:
+                        dist = haversine_km(lat, lon, self._lat[candidates], self._lon[candidates])
+                        if np.partition(dist, k - 1)[k - 1] <= covered:
+                            break
+                if (2 * r + 1) ** 2 > occupied:
+                    # Punto lontano dai nodi: conviene calcolare tutte le distanze in blocco
+                    slots = None
+                    break
+                r += 1
+
+            if slots is None:
+                candidates = np.flatnonzero(self._alive)
+            else:
+                candidates = np.fromiter(slots, dtype=np.intp, count=len(slots))
+            if code is not None:
+                candidates = candidates[self._freq[candidates] == code]
+            if not len(candidates):
+                return []
+            dist = haversine_km(lat, lon, self._lat[candidates], self._lon[candidates])
+            if max_km is not None:
+                inside = dist <= max_km
+                candidates, dist = candidates[inside], dist[inside]
+
+            if len(candidates) > k:
+                top = np.argpartition(dist, k - 1)[:k]
+                candidates, dist = candidates[top], dist[top]
+            order = np.argsort(dist)
+            candidates, dist = candidates[order], dist[order]
+            bearings = bearing_deg(lat, lon, self._lat[candidates], self._lon[candidates])
+
+            return [(dict(self._markers[s]), float(d), float(b))
+                    for s, d, b in zip(candidates, dist, bearings)]
+
+    def query(self, bbox=None, center=None, radius_km=None, frequency=None):
+        """Nodi nel riquadro `bbox` (sud, ovest, nord, est) e/o entro `radius_km` da
+        `center` (lat, lon), opzionalmente di una sola frequenza.
+        Ritorna (versione, [(marker, distanza_km o None)]) letti in modo coerente."""
+        with self._lock:
+            if frequency is not None and frequency not in self._freq_codes:
+                return self.version, []
+
+            box = bbox
+            if center is not None:
+                # Riquadro che contiene il cerchio, intersecato con bbox
+                dlat = radius_km / KM_PER_DEGREE
+                dlon = dlat / max(math.cos(math.radians(min(abs(center[0]) + dlat, 89.0))), 1e-6)
+                circle = (center[0] - dlat, center[1] - dlon, center[0] + dlat, center[1] + dlon)
+                box = circle if box is None else (max(box[0], circle[0]), max(box[1], circle[1]),
+                                                  min(box[2], circle[2]), min(box[3], circle[3]))
+                if box[0] > box[2] or box[1] > box[3]:
+                    return self.version, []
+
+            if box is None:
+                candidates = np.flatnonzero(self._alive)
+            else:
+                row0, col0 = self._cell(box[0], box[1])
+                row1, col1 = self._cell(box[2], box[3])
+                if (row1 - row0 + 1) * (col1 - col0 + 1) <= len(self._cells):
+                    slots = [s for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)
+                             for s in self._cells.get((row, col), ())]
+                else:
+                    # Riquadro più grande della zona occupata: si scorrono solo le celle presenti
+                    slots = [s for (row, col), cell in self._cells.items()
+                             if row0 <= row <= row1 and col0 <= col <= col1 for s in cell]
+                candidates = np.fromiter(slots, dtype=np.intp, count=len(slots))
+                lats, lons = self._lat[candidates], self._lon[candidates]
+                candidates = candidates[(lats >= box[0]) & (lats <= box[2]) & (lons >= box[1]) & (lons <= box[3])]
+
+            if frequency is not None:
+                candidates = candidates[self._freq[candidates] == self._freq_codes[frequency]]
+            if center is None:
+                return self.version, [(dict(self._markers[s]), None) for s in candidates.tolist()]
+
+            dist = haversine_km(center[0], center[1], self._lat[candidates], self._lon[candidates])
+            inside = dist <= radius_km
+            return self.version, [(dict(self._markers[s]), d)
+                                  for s, d in zip(candidates[inside].tolist(), dist[inside].tolist())]
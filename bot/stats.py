@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import heapq
+import threading
+
+from feedrows import to_int
+
+
+def marker_day(marker):
+    """Giorno di inserimento del marker (YYYY-MM-DD, ora locale) o "" se sconosciuto."""
+    ts = to_int(marker.get('timestamp'))
+    if ts <= 0:
+        return ""
+    return datetime.date.fromtimestamp(ts).isoformat()
+
+
+class StatsAggregator:
+    """Statistiche dei marker aggiornate a ogni commit dello store.
+
+    Conteggi per utente (con heap per la classifica), per frequenza, per tipo
+    di nodo, per origine, marker con link e aggiunte per giorno. I nodi
+    importati da altre fonti (campo 'source') non contano tra gli utenti né
+    tra le aggiunte. Va registrato come listener dello store (`stats.apply`)
+    e inizializzato con `rebuild`; le letture non scorrono mai l'elenco dei
+    marker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0  # Ultima mutazione inclusa
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.with_link = 0
+        self.by_user = collections.Counter()
+        self.usernames = {}
+        self.by_frequency = collections.Counter()
+        self.by_node_type = collections.Counter()
+        self.by_source = collections.Counter()
+        self.by_day = collections.Counter()
+        self._heap = []        # [(-conteggio, ID)], voci non aggiornate scartate in lettura
+        self._by_marker = {}   # {(ID, nome): [(frequenza, tipo, link, giorno, origine), ...]}
+
+    # -------------- AGGIORNAMENTO --------------
+
+    def _set_user_count(self, uid, delta):
+        self.by_user[uid] += delta
+        if self.by_user[uid] <= 0:
+            del self.by_user[uid]
+            self.usernames.pop(uid, None)
+        else:
+            heapq.heappush(self._heap, (-self.by_user[uid], uid))
+        if len(self._heap) > 4 * len(self.by_user) + 64:
+            # Troppe voci vecchie: ricostruisce l'heap
+            self._heap = [(-count, u) for u, count in self.by_user.items()]
+            heapq.heapify(self._heap)
+
+    def _add(self, marker):
+        uid = marker['ID']
+        source = marker.get('source', '')
+        info = (marker.get('frequency', ''), marker.get('node_type', ''), bool(marker.get('link')),
+                '' if source else marker_day(marker), source)
+        self._by_marker.setdefault((uid, marker['name']), []).append(info)
+        self.total += 1
+        self.with_link += info[2]
+        self.by_frequency[info[0]] += 1
+        self.by_node_type[info[1]] += 1
+        if info[3]:
+            self.by_day[info[3]] += 1
+        self.by_source[info[4]] += 1
+        if info[4]:
+            return  # Nodo importato: nessun utente del bot
+        if marker.get('user'):
+            self.usernames[uid] = marker['user']
+        self._set_user_count(uid, +1)
+
+    def _delete(self, uid, name):
+        for frequency, node_type, link, day, source in self._by_marker.pop((uid, name), []):
+            self.total -= 1
+            self.with_link -= link
+            self._decrement(self.by_frequency, frequency)
+            self._decrement(self.by_node_type, node_type)
+            if day:
+                self._decrement(self.by_day, day)
+            self._decrement(self.by_source, source)
+            if not source:
+                self._set_user_count(uid, -1)
+
+    @staticmethod
+    def _decrement(counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _rename(self, uid, name, new_name):
+        infos = self._by_marker.get((uid, name))
+        if not infos:
+            return
+        info = infos.pop(0)
+        if not infos:
+            del self._by_marker[(uid, name)]
+        self._by_marker.setdefault((uid, new_name), []).append(info)
+
+    def rebuild(self, markers, version=0):
+        with self._lock:
+            self._reset()
+            for marker in markers:
+                self._add(marker)
+            self.version = version
+
+    def apply(self, mutations):
+        """Listener dello store: applica le mutazioni confermate."""
+        with self._lock:
+            for mutation in mutations:
+                if mutation.get('seq', 0) <= self.version:
+                    continue  # Già inclusa nell'ultima ricostruzione
+                self.version = mutation['seq']
+                op = mutation['op']
+                if op == 'add':
+                    self._add(mutation['marker'])
+                elif op == 'rename':
+                    self._rename(mutation['ID'], mutation['name'], mutation['new_name'])
+                elif op == 'delete':
+                    self._delete(mutation['ID'], mutation['name'])
+                elif op == 'replace':
+                    self._reset()
+                    for marker in mutation['markers']:
+                        self._add(marker)
+
+    # -------------- LETTURA --------------
+
+    def top_users(self, n=5):
+        """I primi n utenti per numero di marker: lista di (ID, username, conteggio)."""
+        with self._lock:
+            found, popped = [], []
+            while self._heap and len(found) < n:
+                entry = heapq.heappop(self._heap)
+                count, uid = -entry[0], entry[1]
+                if self.by_user.get(uid) == count and all(uid != f[0] for f in found):
+                    found.append((uid, self.usernames.get(uid, ""), count))
+                    popped.append(entry)
+            for entry in popped:
+                heapq.heappush(self._heap, entry)
+            return found
+
+    def added_since(self, days):
+        """Marker aggiunti negli ultimi `days` giorni (oggi compreso)."""
+        today = datetime.date.today()
+        with self._lock:
+            return sum(self.by_day.get((today - datetime.timedelta(days=i)).isoformat(), 0) for i in range(days))
+
+    def summary(self):
+        with self._lock:
+            return {
+                'total': self.total,
+                'users': len(self.by_user),
+                'with_link': self.with_link,
+                'by_frequency': self.by_frequency.most_common(),
+                'by_node_type': self.by_node_type.most_common(5),
+                'by_source': self.by_source.most_common(),
+            }
@@ -0,0 +1,649 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import sqlite3
+import threading
+import logging
+import time
+
+# 'source' è vuoto per i nodi inseriti dal bot, altrimenti indica da dove sono stati importati
+FIELDNAMES = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp', 'source']
+
+
+def normalize(marker):
+    """Riduce un marker ai soli campi del CSV, tutti come stringhe."""
+    clean = {}
+    for field in FIELDNAMES:
+        value = marker.get(field, '')
+        clean[field] = '' if value is None else str(value)
+    return clean
+
+
+# Separatore di ID e nome nelle chiavi di name_keys(): non può comparire in un ID
+NAME_KEY_SEPARATOR = '\x1f'
+
+
+def name_key(name):
+    """Chiave di confronto dei nomi (case-insensitive)."""
+    return (name or '').strip().casefold()
+
+
+def read_csv_file(path, encoding='utf-8'):
+    """Legge tutti i marker da un file CSV."""
+    if not os.path.exists(path):
+        return []
+
+    with open(path, newline='', encoding=encoding) as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames and reader.fieldnames[0].startswith('\ufeff'):
+            reader.fieldnames[0] = reader.fieldnames[0].replace('\ufeff', '')
+
+        markers = []
+        for row in reader:
+            if not row.get('lat') or not row.get('lon') or not row.get('ID'):
+                continue
+
+            marker = {field: row.get(field) or '' for field in FIELDNAMES}
+            if not marker['user']:
+                marker['user'] = 'anonimo'
+
+            markers.append(marker)
+
+        return markers
+
+
+def file_hash(path):
+    """Hash del contenuto di un file (None se non esiste)."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_bytes_atomic(path, data, sync=True):
+    """Scrive un file in modo atomico (file temporaneo nella stessa cartella + rename).
+    Con sync=False salta l'fsync (file rigenerabili, scritti in gran numero)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def read_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logging.error(f"Errore lettura {path}: {e}")
+        return default
+
+
+def write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    write_bytes_atomic(path, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def write_csv_file(path, markers):
+    """Scrive i marker su file in modo atomico.
+
+    Il file temporaneo è creato nella stessa cartella (stesso filesystem del
+    volume condiviso), sincronizzato su disco e poi rinominato sul file finale."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.dati-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            for marker in markers:
+                writer.writerow(normalize(marker))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)  # mkstemp crea il file leggibile solo dal proprietario
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+############################################
+#                                          #
+#                 BACKEND                  #
+#                                          #
+############################################
+
+# Ogni backend espone:
+#   signature()                 -> valore che cambia se i dati vengono modificati da fuori
+#   load()                      -> lista completa dei marker
+#   replay()                    -> mutazioni da riapplicare dopo load() (journal)
+#   commit(mutations, snapshot) -> rende persistenti le mutazioni già applicate in memoria;
+#                                  snapshot() ritorna la lista completa aggiornata
+#   compact(markers)            -> consolida l'archivio (solo journal)
+#   version                     -> numero di sequenza dell'ultima mutazione salvata
+#
+# Le mutazioni sono dizionari:
+#   {'op': 'add', 'marker': {...}}
+#   {'op': 'rename', 'ID': uid, 'name': vecchio_nome, 'new_name': nuovo_nome}
+#   {'op': 'delete', 'ID': uid, 'name': nome}
+#   {'op': 'replace', 'markers': [...]}
+#
+# Al commit lo store assegna a ogni mutazione un numero di sequenza crescente ('seq').
+
+class CsvBackend:
+    """Backend su file CSV: ogni modifica riscrive l'intero file."""
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.version = 0  # Non persistente: riparte da 0 a ogni avvio
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        return read_csv_file(self.path, self.encoding)
+
+    def replay(self):
+        return []
+
+    def commit(self, mutations, snapshot):
+        write_csv_file(self.path, snapshot())
+        self.version = mutations[-1]['seq']
+
+    def compact(self, markers):
+        pass
+
+    def close(self):
+        pass
+
+
+class JournaledCsvBackend(CsvBackend):
+    """Backend CSV con journal append-only.
+
+    Ogni commit aggiunge un record JSON per mutazione al journal (con fsync),
+    senza riscrivere il CSV. La compattazione riscrive il CSV e svuota il journal;
+    all'avvio lo stato è CSV + replay del journal. La prima riga del journal
+    contiene l'hash del CSV su cui si basa: se non corrisponde (crash durante
+    la compattazione) il journal è già incluso nel CSV e viene ignorato.
+    I record compattati vengono conservati nel file di storico.
+
+    Una compattazione fallita dopo un commit non annulla il commit (il journal
+    è già scritto): l'errore viene registrato e la compattazione ritentata al
+    commit successivo o alla chiusura."""
+
+    def __init__(self, path, journal_path, history_path=None, max_bytes=1024 * 1024, encoding='utf-8'):
+        super().__init__(path, encoding)
+        self.journal_path = journal_path
+        self.history_path = history_path
+        self.max_bytes = max_bytes
+        self.dirty = False  # True se il journal contiene modifiche non compattate
+        self._stale_journal = False  # True se il CSV è stato riscritto ma il journal non ancora ricreato
+
+    def signature(self):
+        try:
+            st = os.stat(self.journal_path)
+            journal = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            journal = None
+        return (super().signature(), journal)
+
+    def _read_journal(self):
+        """Ritorna (intestazione, record) del journal."""
+        header, records = None, []
+        if not os.path.exists(self.journal_path):
+            return header, records
+
+        with open(self.journal_path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Record troncato da un crash durante la scrittura
+                    logging.warning(f"Journal {self.journal_path}: record non valido alla riga {line_no}, ignorato")
+                    break
+                if header is None and 'base' in record:
+                    header = record
+                else:
+                    records.append(record)
+        return header, records
+
+    def replay(self):
+        header, records = self._read_journal()
+        if header is None:
+            return []
+
+        if header['base'] != file_hash(self.path):
+            logging.warning(f"Journal {self.journal_path} non corrisponde al CSV, già compattato: ignorato")
+            self.version = max(self.version, header.get('seq', 0))
+            return []
+
+        self.version = max([header.get('seq', 0)] + [r['seq'] for r in records])
+        self.dirty = bool(records)
+        return [r['mutation'] for r in records]
+
+    def _write_header(self):
+        """Crea un journal vuoto basato sul CSV attuale (scrittura atomica)."""
+        header = {'base': file_hash(self.path), 'seq': self.version}
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.journal_path)
+
+    def commit(self, mutations, snapshot):
+        if any(m['op'] == 'replace' for m in mutations):
+            # La sostituzione viene resa persistente dalla scrittura del CSV
+            previous = self.version
+            self.version = mutations[-1]['seq']
+            try:
+                self.compact(snapshot())
+            except Exception as e:
+                if not self._stale_journal:
+                    self.version = previous  # CSV non scritto: nulla è cambiato
+                    raise
+                logging.error(f"Journal non ricreato dopo la sostituzione, nuovo tentativo al prossimo commit: {e}")
+            return
+
+        if self._stale_journal or not os.path.exists(self.journal_path):
+            self._write_header()
+            self._stale_journal = False
+
+        lines = []
+        now = int(time.time())
+        for mutation in mutations:
+            record = {k: v for k, v in mutation.items() if k != 'seq'}
+            lines.append(json.dumps({'seq': mutation['seq'], 'ts': now, 'mutation': record}, ensure_ascii=False))
+
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.dirty = True
+        self.version = mutations[-1]['seq']
+
+        if os.path.getsize(self.journal_path) > self.max_bytes:
+            try:
+                self.compact(snapshot())
+            except Exception as e:
+                # Le mutazioni sono già nel journal: il commit è riuscito comunque
+                logging.error(f"Compattazione del journal fallita, nuovo tentativo al prossimo commit: {e}")
+
+    def compact(self, markers):
+        """Scrive un nuovo CSV e riparte con un journal vuoto."""
+        header, records = self._read_journal()
+        write_csv_file(self.path, markers)
+        # Da qui il CSV contiene tutto: il vecchio journal non va più aggiunto
+        self._stale_journal = True
+        self._write_header()
+        self._stale_journal = False
+        self.dirty = False
+
+        if self.history_path and records:
+            with open(self.history_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        if records:
+            logging.info(f"Journal compattato: {len(records)} modifiche incluse in {self.path}")
+
+
+class SQLiteBackend:
+    """Backend SQLite in modalità WAL: ogni modifica tocca solo le righe interessate."""
+
+    def __init__(self, path, import_csv=None, encoding='utf-8'):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS markers (
+                lat TEXT NOT NULL,
+                lon TEXT NOT NULL,
+                name TEXT NOT NULL,
+                "desc" TEXT NOT NULL DEFAULT '',
+                node_type TEXT NOT NULL DEFAULT '',
+                frequency TEXT NOT NULL DEFAULT '',
+                link TEXT NOT NULL DEFAULT '',
+                ID TEXT NOT NULL,
+                user TEXT NOT NULL DEFAULT '',
+                timestamp INTEGER,
+                source TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS idx_markers_id ON markers (ID);
+            CREATE INDEX IF NOT EXISTS idx_markers_id_name ON markers (ID, name);
+            CREATE INDEX IF NOT EXISTS idx_markers_timestamp ON markers (timestamp);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+            """
+        )
+        # Database creati prima della colonna 'source'
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(markers)")}
+        if 'source' not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE markers ADD COLUMN source TEXT NOT NULL DEFAULT ''")
+
+        self.version = self._read_version()
+
+        # Primo avvio: importa il CSV esistente
+        empty = self.conn.execute("SELECT 1 FROM markers LIMIT 1").fetchone() is None
+        if empty and import_csv and os.path.exists(import_csv):
+            markers = read_csv_file(import_csv, encoding)
+            with self.conn:
+                self._insert_many(markers)
+            logging.info(f"Importati {len(markers)} marker da {import_csv} in {path}")
+
+    def _insert_many(self, markers):
+        self.conn.executemany(
+            'INSERT INTO markers (lat, lon, name, "desc", node_type, frequency, link, ID, user, timestamp, source) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ([m[field] for field in FIELDNAMES] for m in map(normalize, markers))
+        )
+
+    def _read_version(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def signature(self):
+        # Cambia solo se il database viene modificato da un'altra connessione
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def replay(self):
+        return []
+
+    def compact(self, markers):
+        pass
+
+    def load(self):
+        # La versione può essere avanzata da un'altra connessione
+        self.version = self._read_version()
+        rows = self.conn.execute(
+            'SELECT lat, lon, name, "desc", node_type, frequency, link, ID, user, timestamp, source '
+            'FROM markers ORDER BY rowid'
+        )
+        markers = []
+        for row in rows:
+            marker = {field: '' if value is None else str(value) for field, value in zip(FIELDNAMES, row)}
+            if not marker['user']:
+                marker['user'] = 'anonimo'
+            markers.append(marker)
+        return markers
+
+    def commit(self, mutations, snapshot):
+        with self.conn:
+            for mutation in mutations:
+                op = mutation['op']
+                if op == 'add':
+                    self._insert_many([mutation['marker']])
+                elif op == 'rename':
+                    self.conn.execute(
+                        "UPDATE markers SET name = ? WHERE rowid = "
+                        "(SELECT rowid FROM markers WHERE ID = ? AND name = ? ORDER BY rowid LIMIT 1)",
+                        (mutation['new_name'], mutation['ID'], mutation['name'])
+                    )
+                elif op == 'delete':
+                    self.conn.execute(
+                        "DELETE FROM markers WHERE ID = ? AND name = ?",
+                        (mutation['ID'], mutation['name'])
+                    )
+                elif op == 'replace':
+                    self.conn.execute("DELETE FROM markers")
+                    self._insert_many(mutation['markers'])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                (mutations[-1]['seq'],)
+            )
+        self.version = mutations[-1]['seq']
+
+    def close(self):
+        self.conn.close()
+
+
+############################################
+#                                          #
+#                  STORE                   #
+#                                          #
+############################################
+
+class MarkerStore:
+    """Cache in memoria dei marker con indici per utente e per (utente, nome).
+
+    I dati vengono riletti dal backend solo quando cambiano da fuori
+    (mtime/dimensione del CSV, data_version di SQLite), quindi i controlli
+    per singolo utente non rileggono l'intero dataset."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._signature = None
+        self._loaded = False
+        self._next_key = 0
+        self._markers = {}       # {chiave: marker} nell'ordine di inserimento
+        self._by_user = {}       # {ID: [chiave, ...]} nell'ordine di inserimento
+        self._by_user_name = {}  # {ID: {nome_normalizzato: chiave}}
+        self._listeners = []
+        self.version = 0         # Sequenza dell'ultima mutazione applicata
+
+    def add_listener(self, callback):
+        """Registra una funzione chiamata con la lista di mutazioni dopo ogni commit."""
+        self._listeners.append(callback)
+
+    # -------------- CARICAMENTO --------------
+
+    def _rebuild_indexes(self, markers):
+        self._markers = {}
+        self._by_user = {}
+        self._by_user_name = {}
+        for marker in markers:
+            self._insert(normalize(marker))
+
+    def _insert(self, marker):
+        key = self._next_key
+        self._next_key += 1
+        self._markers[key] = marker
+        self._by_user.setdefault(marker['ID'], []).append(key)
+        self._by_user_name.setdefault(marker['ID'], {}).setdefault(name_key(marker['name']), key)
+        return key
+
+    def _index_user_names(self, uid):
+        """Ricalcola le voci (utente, nome) di un solo utente."""
+        names = {}
+        for k in self._by_user.get(uid, []):
+            names.setdefault(name_key(self._markers[k]['name']), k)
+        if names:
+            self._by_user_name[uid] = names
+        else:
+            self._by_user_name.pop(uid, None)
+
+    def refresh(self):
+        """Ricarica i dati solo se sono cambiati dall'ultima lettura."""
+        with self._lock:
+            signature = self.backend.signature()
+            if not self._loaded or signature != self._signature:
+                self._rebuild_indexes(self.backend.load())
+                for mutation in self.backend.replay():
+                    self._apply(mutation)
+                self.version = self.backend.version
+                self._signature = signature
+                self._loaded = True
+
+    # -------------- LETTURA --------------
+
+    def snapshot(self):
+        """Ritorna (versione, copia di tutti i marker) letti in modo coerente."""
+        with self._lock:
+            self.refresh()
+            return self.version, [dict(m) for m in self._markers.values()]
+
+    def iter_markers(self):
+        """Ritorna (versione, iteratore sui marker) senza copiare l'intero dataset.
+        L'iteratore percorre i marker com'erano al momento della chiamata."""
+        with self._lock:
+            self.refresh()
+            markers = list(self._markers.values())  # Solo riferimenti: i marker non vengono modificati sul posto
+            return self.version, (dict(m) for m in markers)
+
+    def all(self):
+        """Copia della lista di tutti i marker."""
+        with self._lock:
+            self.refresh()
+            return [dict(m) for m in self._markers.values()]
+
+    def count(self):
+        with self._lock:
+            self.refresh()
+            return len(self._markers)
+
+    def user_markers(self, uid):
+        """Marker dell'utente, nell'ordine di inserimento."""
+        with self._lock:
+            self.refresh()
+            return [dict(self._markers[k]) for k in self._by_user.get(str(uid), [])]
+
+    def user_count(self, uid):
+        with self._lock:
+            self.refresh()
+            return len(self._by_user.get(str(uid), []))
+
+    def has_name(self, uid, name):
+        """True se l'utente ha già un marker con questo nome (case-insensitive)."""
+        with self._lock:
+            self.refresh()
+            return name_key(name) in self._by_user_name.get(str(uid), {})
+
+    def name_keys(self):
+        """Chiavi ID + NAME_KEY_SEPARATOR + nome normalizzato di tutti i marker (controlli in blocco)."""
+        with self._lock:
+            self.refresh()
+            return {uid + NAME_KEY_SEPARATOR + key for uid, names in self._by_user_name.items() for key in names}
+
+    # -------------- SCRITTURA --------------
+
+    def _apply(self, mutation):
+        """Applica una mutazione agli indici in memoria. Ritorna il risultato per il chiamante."""
+        op = mutation['op']
+
+        if op == 'add':
+            mutation['marker'] = normalize(mutation['marker'])
+            marker = mutation['marker']
+            if name_key(marker['name']) in self._by_user_name.get(marker['ID'], {}):
+                return False  # Nome già usato dall'utente
+            self._insert(dict(marker))
+            return True
+
+        if op == 'replace':
+            mutation['markers'] = [normalize(m) for m in mutation['markers']]
+            self._rebuild_indexes(mutation['markers'])
+            return len(mutation['markers'])
+
+        uid = mutation['ID']
+        keys = self._by_user.get(uid, [])
+
+        if op == 'rename':
+            taken = self._by_user_name.get(uid, {}).get(name_key(mutation['new_name']))
+            for k in keys:
+                if self._markers[k]['name'] == mutation['name']:
+                    if taken is not None and taken != k:
+                        return None  # Nuovo nome già usato da un altro marker dell'utente
+                    # Nuovo dizionario invece di modificarlo: le liste già lette restano coerenti
+                    self._markers[k] = dict(self._markers[k], name=mutation['new_name'])
+                    self._index_user_names(uid)
+                    return mutation['name']
+            return None
+
+        if op == 'delete':
+            removed = {k for k in keys if self._markers[k]['name'] == mutation['name']}
+            for k in removed:
+                del self._markers[k]
+            if removed:
+                self._by_user[uid] = [k for k in keys if k not in removed]
+                if not self._by_user[uid]:
+                    del self._by_user[uid]
+                self._index_user_names(uid)
+            return len(removed)
+
+        raise ValueError(f"Mutazione sconosciuta: {op}")
+
+    def commit(self, mutations):
+        """Applica le mutazioni in memoria e le rende persistenti. Ritorna i risultati.
+
+        Le mutazioni senza effetto (nome duplicato, marker non trovato) hanno
+        un risultato falso e non vengono scritte."""
+        with self._lock:
+            self.refresh()
+            results = [self._apply(m) for m in mutations]
+            mutations = [m for m, r in zip(mutations, results) if r or m['op'] == 'replace']
+            if not mutations:
+                return results
+            for mutation in mutations:
+                self.version += 1
+                mutation['seq'] = self.version
+            try:
+                self.backend.commit(mutations, lambda: list(self._markers.values()))
+                self._signature = self.backend.signature()
+            except Exception:
+                # Ripristina lo stato dal backend, che non è stato modificato
+                self._loaded = False
+                self.refresh()
+                raise
+
+        for listener in self._listeners:
+            try:
+                listener(mutations)
+            except Exception as e:
+                logging.error(f"Errore nel listener dello store: {e}")
+        return results
+
+    def compact(self):
+        """Consolida l'archivio del backend (journal -> CSV)."""
+        with self._lock:
+            self.refresh()
+            self.backend.compact(list(self._markers.values()))
+            self._signature = self.backend.signature()
+
+    def replace_all(self, markers):
+        """Sostituisce l'intero contenuto dello store."""
+        return self.commit([{'op': 'replace', 'markers': list(markers)}])[0]
+
+    def add(self, marker):
+        """Aggiunge un marker."""
+        return self.commit([{'op': 'add', 'marker': marker}])[0]
+
+    def rename(self, uid, index, new_name):
+        """Rinomina l'index-esimo marker dell'utente. Ritorna il vecchio nome (o None)."""
+        with self._lock:
+            self.refresh()
+            keys = self._by_user.get(str(uid), [])
+            if index < 0 or index >= len(keys):
+                return None
+            old_name = self._markers[keys[index]]['name']
+            return self.commit([{'op': 'rename', 'ID': str(uid), 'name': old_name, 'new_name': new_name}])[0]
+
+    def remove(self, uid, name):
+        """Elimina i marker dell'utente con il nome indicato. Ritorna quanti ne ha rimossi."""
+        return self.commit([{'op': 'delete', 'ID': str(uid), 'name': name}])[0]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import math
+import os
+import time
+
+from store import write_bytes_atomic
+from spatial import KM_PER_DEGREE, haversine_km
+
+
+class SubscriptionIndex:
+    """Iscrizioni alle notifiche "nuovo nodo nella tua zona" (cerchi centro + raggio).
+
+    Ogni iscrizione è registrata in tutte le celle della griglia (`cell_deg`
+    gradi) toccate dal suo riquadro, così per un nuovo nodo si esaminano solo
+    le iscrizioni della sua cella e non tutti gli iscritti. Le iscrizioni sono
+    salvate in un file JSON."""
+
+    def __init__(self, path, cell_deg=0.25):
+        self.path = path
+        self.cell_deg = cell_deg
+        self._subs = {}     # {id: iscrizione}
+        self._by_chat = {}  # {chat_id: [id, ...]}
+        self._cells = {}    # {(riga, colonna): set(id)}
+        self._next_id = 1
+        self.load()
+
+    # -------------- GRIGLIA --------------
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _covered_cells(self, sub):
+        """Celle toccate dal riquadro che contiene il cerchio dell'iscrizione."""
+        dlat = sub['radius_km'] / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(abs(sub['lat']) + dlat, 89.0))), 1e-6)
+        dlon = min(sub['radius_km'] / (KM_PER_DEGREE * cos_lat), 180.0)
+        row0, col0 = self._cell(sub['lat'] - dlat, sub['lon'] - dlon)
+        row1, col1 = self._cell(sub['lat'] + dlat, sub['lon'] + dlon)
+        return [(r, c) for r in range(row0, row1 + 1) for c in range(col0, col1 + 1)]
+
+    def _index(self, sub):
+        self._subs[sub['id']] = sub
+        self._by_chat.setdefault(sub['chat_id'], []).append(sub['id'])
+        for cell in self._covered_cells(sub):
+            self._cells.setdefault(cell, set()).add(sub['id'])
+
+    def _unindex(self, sub_id):
+        sub = self._subs.pop(sub_id)
+        ids = self._by_chat[sub['chat_id']]
+        ids.remove(sub_id)
+        if not ids:
+            del self._by_chat[sub['chat_id']]
+        for cell in self._covered_cells(sub):
+            members = self._cells.get(cell)
+            if members is not None:
+                members.discard(sub_id)
+                if not members:
+                    del self._cells[cell]
+        return sub
+
+    # -------------- ISCRIZIONI --------------
+
+    def add(self, chat_id, lat, lon, radius_km, frequency=None):
+        sub = {
+            'id': self._next_id,
+            'chat_id': str(chat_id),
+            'lat': lat,
+            'lon': lon,
+            'radius_km': radius_km,
+            'frequency': frequency,
+            'created': int(time.time()),
+        }
+        self._next_id += 1
+        self._index(sub)
+        return sub
+
+    def remove(self, sub_id):
+        return self._unindex(sub_id) if sub_id in self._subs else None
+
+    def remove_chat(self, chat_id):
+        """Elimina tutte le iscrizioni di una chat. Ritorna quante erano."""
+        ids = list(self._by_chat.get(str(chat_id), []))
+        for sub_id in ids:
+            self._unindex(sub_id)
+        return len(ids)
+
+    def for_chat(self, chat_id):
+        return [dict(self._subs[i]) for i in self._by_chat.get(str(chat_id), [])]
+
+    def count(self, chat_id=None):
+        if chat_id is None:
+            return len(self._subs)
+        return len(self._by_chat.get(str(chat_id), []))
+
+    def match(self, marker):
+        """Iscrizioni interessate a un nuovo marker: lista di (iscrizione, distanza_km)."""
+        try:
+            lat, lon = float(marker['lat']), float(marker['lon'])
+        except (KeyError, TypeError, ValueError):
+            return []
+
+        candidates = [self._subs[i] for i in self._cells.get(self._cell(lat, lon), ())]
+        candidates = [s for s in candidates
+                      if not s['frequency'] or s['frequency'] == marker.get('frequency')]
+        if not candidates:
+            return []
+
+        distances = haversine_km(lat, lon, [s['lat'] for s in candidates], [s['lon'] for s in candidates])
+        return [(dict(s), float(d)) for s, d in zip(candidates, distances) if d <= s['radius_km']]
+
+    # -------------- PERSISTENZA --------------
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Errore lettura iscrizioni {self.path}: {e}")
+            return
+
+        for sub in data.get('subscriptions', []):
+            self._index(sub)
+        self._next_id = max(data.get('next_id', 1), max(self._subs, default=0) + 1)
+
+    def dump(self):
+        """Contenuto del file, da passare a save() (anche da un altro thread)."""
+        data = {'next_id': self._next_id, 'subscriptions': list(self._subs.values())}
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def save(self, data=None):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_bytes_atomic(self.path, data if data is not None else self.dump())
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# I moduli del bot si importano per nome (come in bot.py), dalla cartella bot/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
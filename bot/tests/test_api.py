@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from api import MarkerAPI, QueryError, decode_cursor
+from spatial import GridIndex
+from bench.dataset import generate
+
+
+@pytest.fixture
+def api():
+    index = GridIndex()
+    index.rebuild(generate(700, seed=21), version=1)
+    return MarkerAPI(index, ["433 MHz", "868 MHz"])
+
+
+def fetch(api, filters, cursor, limit):
+    version, (body, _) = api.page(filters, cursor, limit)
+    page = json.loads(body)
+    assert page['version'] == version
+    return page
+
+
+def fetch_all(api, filters=(), limit=100):
+    nodes, cursor = [], None
+    while True:
+        page = fetch(api, filters, cursor, limit)
+        nodes.extend(page['nodes'])
+        cursor = page['next']
+        if cursor is None:
+            return nodes
+
+
+def key(node):
+    return (node['ID'], node['name'])
+
+
+def test_pages_cover_all_nodes_once(api):
+    nodes = fetch_all(api, limit=64)
+    assert len(nodes) == api.index.count
+    assert len({key(n) for n in nodes}) == len(nodes)
+    assert [key(n) for n in nodes] == sorted(key(n) for n in nodes)
+
+
+def test_filters_apply_to_every_page(api):
+    filters = api.parse_filters({'freq': '433', 'bbox': '40,8,46,14'})
+    nodes = fetch_all(api, filters, limit=10)
+    assert nodes
+    assert all(n['frequency'] == '433 MHz' and 40 <= n['lat'] <= 46 and 8 <= n['lon'] <= 14 for n in nodes)
+    assert fetch(api, filters, None, 10)['total'] == len(nodes)
+
+
+def test_cursor_survives_new_versions(api):
+    first = fetch(api, (), None, 100)
+    seen = [key(n) for n in first['nodes']]
+    last = decode_cursor(first['next'])
+
+    # Tra una pagina e l'altra: un nodo già letto e uno non ancora letto vengono
+    # eliminati, due nodi vengono aggiunti prima e dopo il cursore
+    before, after = seen[10], max(key(m) for m, _ in api.index.query()[1])
+    template = first['nodes'][0]
+    api.index.apply([
+        {'op': 'delete', 'ID': before[0], 'name': before[1], 'seq': 2},
+        {'op': 'delete', 'ID': after[0], 'name': after[1], 'seq': 3},
+        {'op': 'add', 'marker': dict(template, ID='0', name='Prima'), 'seq': 4},
+        {'op': 'add', 'marker': dict(template, ID='9' * 12, name='Dopo'), 'seq': 5},
+    ])
+
+    rest, cursor = [], first['next']
+    while cursor is not None:
+        page = fetch(api, (), cursor, 100)
+        assert page['version'] == 5
+        rest.extend(key(n) for n in page['nodes'])
+        cursor = page['next']
+
+    assert all(k > tuple(last.split('\x1f')) for k in rest)
+    assert after not in rest and ('9' * 12, 'Dopo') in rest
+    assert ('0', 'Prima') not in rest
+    assert not set(seen) & set(rest)
+    # Nessun nodo presente in entrambe le versioni viene saltato
+    _, current = api.index.query()
+    unchanged = {key(m) for m, _ in current} - {('0', 'Prima')}
+    assert unchanged <= set(seen) | set(rest)
+
+
+def test_pages_are_cached_per_version(api):
+    version, pages = api.page((), None, 50)
+    assert api.page((), None, 50) == (version, pages)
+    api.index.apply([{'op': 'delete', 'ID': 'x', 'name': 'y', 'seq': 2}])
+    assert api.page((), None, 50)[0] == 2
+
+
+def test_invalid_parameters(api):
+    with pytest.raises(QueryError):
+        api.parse_filters({'freq': '2400'})
+    with pytest.raises(QueryError):
+        api.parse_filters({'lat': '45', 'lon': '9'})
+    with pytest.raises(QueryError):
+        decode_cursor('\xff')
+    for bbox in ('nan,nan,nan,nan', 'inf,8,46,14', '40,-inf,46,14', '40,8'):
+        with pytest.raises(QueryError):
+            api.parse_filters({'bbox': bbox})
+
+
+def test_bbox_is_clamped(api):
+    filters = api.parse_filters({'bbox': '-1000,-1000,1000,1000'})
+    assert dict(filters)['bbox'] == (-90.0, -180.0, 90.0, 180.0)
+    assert fetch(api, filters, None, 10)['total'] == api.index.count
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+from types import SimpleNamespace
+
+from broadcast import BroadcastJob, UserRegistry
+
+
+async def run_io(function, *args):
+    return function(*args)
+
+
+class FakeDispatcher:
+    def __init__(self, blocked=(), stop_after=None):
+        self.delivered = []
+        self.blocked = set(blocked)
+        self.stop_after = stop_after
+        self.reached = asyncio.Event()
+
+    async def deliver(self, chat_id, text):
+        await asyncio.sleep(0)
+        self.delivered.append(chat_id)
+        if self.stop_after is not None and len(self.delivered) >= self.stop_after:
+            self.reached.set()
+            await asyncio.sleep(3600)  # Il bot si ferma durante questo invio
+        return "blocked" if chat_id in self.blocked else "sent"
+
+
+def test_broadcast_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / 'annuncio.json')
+    recipients = [str(i) for i in range(1, 96)]
+
+    async def interrupted():
+        dispatcher = FakeDispatcher(blocked={3}, stop_after=25)
+        job = BroadcastJob.create("Ciao", 1, recipients, path=path, dispatcher=dispatcher,
+                                  run_io=run_io, window=10)
+        task = job.start()
+        await dispatcher.reached.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return dispatcher.delivered
+
+    async def resumed():
+        dispatcher = FakeDispatcher(blocked={3})
+        job = BroadcastJob.resume(path, dispatcher=dispatcher, run_io=run_io, window=10)
+        assert job.state['position'] == 20 and job.state['blocked'] == 1
+        await job.start()
+        return job, dispatcher.delivered
+
+    first = asyncio.run(interrupted())
+    job, second = asyncio.run(resumed())
+
+    # Ripartendo dal checkpoint si reinvia al più il blocco interrotto
+    assert second == list(range(21, 96))
+    assert sorted(set(first) | set(second)) == list(range(1, 96))
+    assert job.state['sent'] + job.state['blocked'] == 95  # Contatori ripresi dal checkpoint
+    assert job.state['blocked'] == 1
+    assert not os.path.exists(path) and not os.path.exists(path + '.recipients')
+    assert BroadcastJob.resume(path, dispatcher=None, run_io=run_io) is None
+
+
+def test_stop_removes_checkpoint(tmp_path):
+    path = str(tmp_path / 'annuncio.json')
+    reports = []
+
+    async def main():
+        job = BroadcastJob.create("Ciao", 1, [str(i) for i in range(30)], path=path,
+                                  dispatcher=FakeDispatcher(), run_io=run_io, window=10,
+                                  progress_interval=0)
+
+        async def on_progress(job, done):
+            reports.append((job.state['position'], done))
+            job.stop()
+
+        job.on_progress = on_progress
+        await job.start()
+
+    asyncio.run(main())
+    assert reports == [(10, False), (10, True)]
+    assert not os.path.exists(path) and not os.path.exists(path + '.recipients')
+
+
+def test_registry_recipients_and_blocked(tmp_path):
+    path = str(tmp_path / 'utenti.json')
+    registry = UserRegistry(path)
+    for uid in (30, 4, 100):
+        registry.touch(SimpleNamespace(id=uid, username=f"u{uid}"))
+    registry.mark_blocked(4)
+    assert registry.dirty
+    registry.save()
+
+    reloaded = UserRegistry(path)
+    assert reloaded.recipients() == ['30', '100'] and reloaded.blocked_count() == 1
+    reloaded.touch(SimpleNamespace(id=4, username="u4"))  # Torna a scrivere: di nuovo raggiungibile
+    assert reloaded.recipients() == ['4', '30', '100'] and reloaded.dirty
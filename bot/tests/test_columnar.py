@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from columnar import ColumnarSnapshot, build_snapshot
+from store import FIELDNAMES, normalize
+from bench.dataset import generate
+
+
+def write_snapshot(tmp_path, markers):
+    data, count = build_snapshot(markers)
+    path = tmp_path / 'nodi.bin'
+    path.write_bytes(data)
+    return str(path), count
+
+
+def test_round_trip(tmp_path):
+    markers = generate(500, seed=11)
+    markers[0].update(name='Nodo è già 📡', desc='', link='')
+    markers[1].update(source='meshcore', user='', node_type='Repeater')
+    path, count = write_snapshot(tmp_path, markers)
+
+    with ColumnarSnapshot(path) as snapshot:
+        assert count == len(snapshot) == len(markers)
+        for original, row in zip(markers, snapshot):
+            original = normalize(original)
+            assert set(row) == set(FIELDNAMES)
+            # Coordinate in Float32: precisione di qualche metro
+            assert abs(float(row['lat']) - float(original['lat'])) < 1e-5
+            assert abs(float(row['lon']) - float(original['lon'])) < 1e-5
+            for field in FIELDNAMES:
+                if field not in ('lat', 'lon'):
+                    assert row[field] == original[field]
+
+
+def test_skips_invalid_coordinates(tmp_path):
+    markers = generate(3, seed=12)
+    markers[1]['lat'] = 'non valida'
+    path, count = write_snapshot(tmp_path, markers)
+
+    with ColumnarSnapshot(path) as snapshot:
+        assert count == 2
+        assert [row['name'] for row in snapshot] == [markers[0]['name'], markers[2]['name']]
+
+
+def test_empty_snapshot(tmp_path):
+    path, count = write_snapshot(tmp_path, [])
+    with ColumnarSnapshot(path) as snapshot:
+        assert count == len(snapshot) == 0
+        assert list(snapshot) == []
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'altro.bin'
+    path.write_bytes(b'{"fields": []}' + b'\0' * 64)
+    with pytest.raises(ValueError):
+        ColumnarSnapshot(str(path))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from coverage import CoverageLayer
+from bench.dataset import generate
+
+MODELS = {
+    "433 MHz": {"frequency_mhz": 433, "sensitivity_dbm": -120, "max_km": 20},
+    "868 MHz": {"frequency_mhz": 868, "sensitivity_dbm": -120, "max_km": 20},
+}
+BOUNDS = (44.0, 7.0, 46.5, 12.5)  # Nord Italia: area piccola, test veloci
+
+
+def layer(directory, **kwargs):
+    return CoverageLayer(str(directory), MODELS, bounds=BOUNDS, cell_deg=0.02, tile_px=64, **kwargs)
+
+
+@pytest.fixture(scope='module')
+def markers():
+    return [m for m in generate(1500, seed=31)
+            if BOUNDS[0] <= float(m['lat']) <= BOUNDS[2] and BOUNDS[1] <= float(m['lon']) <= BOUNDS[3]]
+
+
+def assert_same_rasters(a, b):
+    for frequency in MODELS:
+        assert np.array_equal(a._rasters[frequency], b._rasters[frequency])
+
+
+def test_incremental_matches_rebuild(tmp_path, markers):
+    incremental = layer(tmp_path / 'a')
+    incremental.rebuild(markers[:200])
+    removed = markers[:200:3]
+    incremental.apply([{'op': 'delete', 'ID': m['ID'], 'name': m['name'], 'seq': i + 1}
+                       for i, m in enumerate(removed)])
+    incremental.apply([{'op': 'add', 'marker': m, 'seq': 1000 + i} for i, m in enumerate(markers[200:260])])
+
+    expected = layer(tmp_path / 'b')
+    expected.rebuild([m for m in markers[:260] if m not in removed])
+    assert_same_rasters(incremental, expected)
+
+
+def test_remove_only_recomputes_overlapping_nodes(tmp_path, markers):
+    cover = layer(tmp_path, cache_mb=0)  # Senza cache ogni contributo viene ricalcolato
+    cover.rebuild(markers)
+    target = markers[0]
+    window = cover._window(cover._key(target))
+
+    computed = []
+    original = cover._contribution
+    cover._contribution = lambda key: computed.append(key) or original(key)
+    cover.remove(target['ID'], target['name'])
+
+    assert computed
+    for key in computed:
+        r0, r1, c0, c1 = cover._window(key)
+        assert r0 < window[1] and window[0] < r1 and c0 < window[3] and window[2] < c1
+
+
+def test_full_rebuild_keeps_files_and_removes_stale(tmp_path, markers):
+    cover = layer(tmp_path)
+    project = cover.projection()
+    project(markers, None, 1)
+    index = json.loads((tmp_path / 'index.json').read_bytes())
+    assert index['sets']['all']
+
+    # File di una banda non più configurata e un tile fuori dalla griglia
+    os.makedirs(tmp_path / '2400mhz')
+    (tmp_path / '2400mhz' / '0_0.png').write_bytes(b'x')
+    (tmp_path / 'all' / '99_99.png').write_bytes(b'x')
+
+    project(markers[:10], [{'op': 'replace', 'markers': markers[:10], 'seq': 2}], 2)
+    assert not (tmp_path / '2400mhz').exists()
+    assert not (tmp_path / 'all' / '99_99.png').exists()
+    index = json.loads((tmp_path / 'index.json').read_bytes())
+    assert index['version'] == 2
+    assert all((tmp_path / 'all' / f'{ty}_{tx}.png').exists() for ty, tx in index['sets']['all'])
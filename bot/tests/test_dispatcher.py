@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from telegram.error import Forbidden, NetworkError
+
+from dispatcher import MessageDispatcher, split_text
+
+
+class FakeBot:
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}  # {chat_id: eccezione da sollevare}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.001 * (len(self.sent) % 3))  # Invii concorrenti di durata diversa
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append((chat_id, text))
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_split_text_prefers_line_breaks():
+    text = "\n".join(["riga"] * 30)
+    parts = split_text(text, limit=22)
+    assert all(len(p) <= 22 and set(p.split("\n")) == {"riga"} for p in parts)
+    assert "\n".join(parts) == text
+    assert split_text("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_messages_keep_per_chat_order():
+    bot = FakeBot()
+
+    async def main():
+        dispatcher = MessageDispatcher(rate=1000, chat_interval=0)
+        dispatcher.start(bot)
+        for i in range(20):
+            for chat in (1, 2, 3):
+                dispatcher.send(chat, f"{chat}-{i}")
+        await dispatcher.stop()
+        return dispatcher
+
+    dispatcher = run(main())
+    assert dispatcher.sent == 60 and dispatcher.pending == 0
+    for chat in (1, 2, 3):
+        assert [t for c, t in bot.sent if c == chat] == [f"{chat}-{i}" for i in range(20)]
+
+
+def test_deliver_outcomes_and_blocked_chat():
+    bot = FakeBot({2: Forbidden("bot bloccato"), 3: NetworkError("rete")})
+    blocked = []
+
+    async def on_forbidden(chat_id):
+        blocked.append(chat_id)
+
+    async def main():
+        dispatcher = MessageDispatcher(rate=1000, chat_interval=0, max_retries=1, on_forbidden=on_forbidden)
+        dispatcher.start(bot)
+        results = await asyncio.gather(dispatcher.deliver(1, "ok"), dispatcher.deliver(2, "primo"),
+                                       dispatcher.deliver(2, "secondo"), dispatcher.deliver(3, "rete"))
+        await dispatcher.stop()
+        return dispatcher, results
+
+    dispatcher, results = run(main())
+    assert results == ["sent", "blocked", "blocked", "failed"]
+    assert blocked == [2]
+    assert bot.sent == [(1, "ok")]
+    assert dispatcher.failed == 3
+
+
+def test_digest_collects_logs():
+    bot = FakeBot()
+
+    async def main():
+        dispatcher = MessageDispatcher(rate=1000, chat_interval=0)
+        dispatcher.start(bot)
+        dispatcher.digest = True
+        dispatcher.log(9, "uno")
+        dispatcher.log(9, "due")
+        assert dispatcher.pending == 0
+        await dispatcher.stop()  # Invia il riepilogo prima di fermarsi
+
+    run(main())
+    assert len(bot.sent) == 1
+    chat, text = bot.sent[0]
+    assert chat == 9 and "2 eventi" in text and text.endswith("uno\n\ndue")
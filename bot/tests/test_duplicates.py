@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from duplicates import candidate_pairs, find_duplicates, similar_nearby, simplify_name, name_similarity
+from spatial import GridIndex, haversine_km
+from bench.dataset import generate
+
+
+def test_candidate_pairs_equal_brute_force():
+    rng = np.random.default_rng(4)
+    lats = rng.uniform(45.0, 45.2, 600)
+    lons = rng.uniform(9.0, 9.3, 600)
+    a, b = candidate_pairs(lats, lons, 1.0)
+
+    close = haversine_km(lats[:, None], lons[:, None], lats[None, :], lons[None, :]) <= 1.0
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(close, 1)))}
+    found = {(min(i, j), max(i, j)) for i, j in zip(a.tolist(), b.tolist())}
+    assert len(found) == len(a)  # Nessuna coppia ripetuta
+    assert found == expected
+
+
+def test_names_are_compared_loosely():
+    assert simplify_name("RPT-Brescia 1") == "rptbrescia1"
+    assert name_similarity("brescia", "rptbrescia") == 0.9
+    assert name_similarity("brescia", "bergamo") < 0.8
+    assert name_similarity("", "brescia") == 0.0
+
+
+def test_find_duplicates_groups_close_similar_names():
+    markers = generate(300, seed=12)
+    base = {'lat': '45.5000', 'lon': '9.2000', 'ID': '1'}
+    markers += [
+        dict(base, name='Ripetitore Duomo'),
+        dict(base, lat='45.5005', name='ripetitore-duomo', ID='2'),
+        dict(base, lon='9.2010', name='Ripetitore Duomo 2', ID='3'),
+        dict(base, lat='45.5003', name='Stazione Centrale', ID='4'),  # Vicino, nome diverso
+        dict(base, lat='45.6000', name='Ripetitore Duomo', ID='5'),   # Stesso nome, troppo lontano
+        dict(base, lat='non valida', name='Ripetitore Duomo', ID='6'),
+    ]
+    first = len(markers) - 6
+    groups = find_duplicates(markers)
+    assert [first, first + 1, first + 2] in groups
+    assert not any(first + 3 in g or first + 4 in g or first + 5 in g for g in groups)
+
+    index = GridIndex(cell_deg=0.1)
+    index.rebuild(markers)
+    found = similar_nearby(index, 45.5001, 9.2001, "RIPETITORE duomo")
+    assert sorted(m['ID'] for m, _ in found) == ['1', '2', '3']
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import gzip
+import io
+import json
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from export import Exporter, ExportError, parse_export_args
+from store import MarkerStore, CsvBackend, write_csv_file
+from bench.dataset import generate
+
+FREQUENCIES = ["433 MHz", "868 MHz"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / 'dati.csv')
+    write_csv_file(path, generate(300, seed=41))
+    return MarkerStore(CsvBackend(path))
+
+
+def read(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_filters_and_formats(store, tmp_path):
+    exporter = Exporter(store, str(tmp_path / 'exports'))
+    params = parse_export_args(['geojson', 'regione=lombardia', 'freq=433'], FREQUENCIES)
+    path, count, cached = exporter.export(params)
+
+    south, west, north, east = params['bbox']
+    expected = [m for m in store.all() if m['frequency'] == '433 MHz'
+                and south <= float(m['lat']) <= north and west <= float(m['lon']) <= east]
+    features = json.loads(read(path))['features']
+    assert count == len(expected) == len(features) and not cached
+    assert sorted(f['properties']['name'] for f in features) == sorted(m['name'] for m in expected)
+
+    path, count, _ = exporter.export(parse_export_args(['csv'], FREQUENCIES))
+    rows = list(csv.DictReader(io.StringIO(read(path))))
+    assert count == len(rows) == 300
+
+    for fmt in ('kml', 'gpx'):
+        path, count, _ = exporter.export(parse_export_args([fmt], FREQUENCIES))
+        assert count == 300
+        ElementTree.fromstring(read(path))  # XML ben formato
+
+
+def test_cache_is_reused_until_data_changes(store, tmp_path):
+    exporter = Exporter(store, str(tmp_path / 'exports'))
+    params = parse_export_args(['csv', 'freq=868'], FREQUENCIES)
+    first = exporter.export(params)
+    assert exporter.export(params) == first[:2] + (True,)
+
+    marker = dict(store.all()[0], name='Nuovo', frequency='868 MHz')
+    store.add(marker)
+    path, count, cached = exporter.export(params)
+    assert not cached and path != first[0] and count == first[1] + 1
+
+
+def test_clear_removes_only_cache_files(store, tmp_path):
+    directory = tmp_path / 'exports'
+    directory.mkdir()
+    (directory / 'note.txt').write_text('da non toccare')
+    exporter = Exporter(store, str(directory))
+    assert (directory / 'note.txt').exists()  # Il costruttore non tocca il filesystem
+
+    path, _, _ = exporter.export(parse_export_args([], FREQUENCIES))
+    exporter.clear()
+    assert sorted(p.name for p in directory.iterdir()) == ['note.txt']
+
+
+def test_invalid_arguments():
+    for args in (['xlsx'], ['regione=atlantide'], ['freq=2400'], ['dal=ieri'], ['colore=rosso']):
+        with pytest.raises(ExportError):
+            parse_export_args(args, FREQUENCIES)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from importer import BulkImporter, UploadError, report_csv
+from store import NAME_KEY_SEPARATOR
+
+
+@pytest.fixture
+def importer():
+    return BulkImporter(["433 MHz", "868 MHz"], max_name=18, max_desc=130, max_link=70,
+                        url_pattern=r'^https?://[^\s]+$')
+
+
+def prepare(importer, text, filename='nodi.csv', existing=()):
+    return importer.prepare(text.encode('utf-8'), filename, set(existing), 99, 'admin')
+
+
+def test_valid_and_invalid_rows(importer):
+    markers, report = prepare(importer, (
+        "lat;lon;name;frequency;ID;link\n"
+        "45.1;9.2;Nodo 1;868;123;https://example.org\n"
+        "95;9.2;Fuori;868 MHz;123;\n"
+        "45.2;9.3;Senza banda;2400;;\n"
+        "45.3;9.4;Nodo 1;868mhz;123;\n"
+        "45.4;9.5;Vecchio;433;456;ftp://x\n"
+    ), existing={'789' + NAME_KEY_SEPARATOR + 'gia'})
+
+    assert [(m['name'], m['frequency'], m['ID']) for m in markers] == [('Nodo 1', '868 MHz', '123')]
+    assert report['riga'].tolist() == [3, 4, 5, 6]
+    errors = dict(zip(report['riga'], report['errori']))
+    assert 'latitudine non valida' in errors[3]
+    assert 'frequenza non valida' in errors[4]
+    assert 'nome ripetuto' in errors[5]
+    assert 'link non valido' in errors[6]
+    assert report_csv(report).startswith('\ufeff'.encode('utf-8'))
+
+
+def test_rows_without_owner_belong_to_uploader(importer):
+    markers, report = prepare(importer, "lat,lon,name,frequency\n45,9,Mio,433\n")
+    assert report.empty
+    assert markers[0]['ID'] == '99' and markers[0]['user'] == 'admin'
+
+
+def test_existing_names_are_rejected_case_insensitively(importer):
+    _, report = prepare(importer, "lat,lon,name,frequency,ID\n45,9,Gia,433,789\n",
+                        existing={'789' + NAME_KEY_SEPARATOR + 'gia'})
+    assert "nome già usato" in report['errori'].iloc[0]
+
+
+def test_text_is_cleaned_and_source_ignored(importer):
+    markers, _ = prepare(importer, 'lat,lon,name,desc,frequency,source\n'
+                                   '45,9,"<b>Nodo</b>","<img src=x onerror=alert(1)>",433,meshcore\n')
+    assert '<' not in markers[0]['name'] and '<' not in markers[0]['desc']
+    assert markers[0]['source'] == ''
+
+
+def test_geojson(importer):
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [9.1, 45.2]},
+         'properties': {'name': 'Geo', 'frequency': '868'}},
+        {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[9, 45], [9, 46]]},
+         'properties': {'name': 'Linea', 'frequency': '868'}},
+    ]}
+    markers, report = prepare(importer, json.dumps(collection), filename='nodi.geojson')
+    assert [(m['lat'], m['lon'], m['name']) for m in markers] == [('45.2', '9.1', 'Geo')]
+    assert report['nome'].tolist() == ['Linea']
+
+
+@pytest.mark.parametrize('text, filename', [
+    ('', 'vuoto.csv'),
+    ('solo una colonna\n', 'una.csv'),
+    ('lat,lon\n45,9\n', 'senza_nome.csv'),
+    ('{"type": "Feature"}', 'nodi.geojson'),
+    ('lat,lon,name\n', 'nodi.txt'),
+])
+def test_unreadable_uploads(importer, text, filename):
+    with pytest.raises(UploadError):
+        prepare(importer, text, filename)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from inactive import InactivityTracker
+
+DAY = 86400
+
+
+def marker(uid, name, **extra):
+    return dict({'ID': uid, 'name': name, 'timestamp': '1000'}, **extra)
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = InactivityTracker(str(tmp_path / 'conferme.json'), interval=10 * DAY, grace=2 * DAY)
+    tracker.rebuild([marker('1', 'A'), marker('1', 'B'), marker('2', 'C'),
+                     marker('3', 'Importato', source='meshcore')], version=3)
+    return tracker
+
+
+def test_untracked_markers_start_now(tracker):
+    # Timestamp vecchissimi: senza stato salvato non scade comunque nulla subito
+    assert tracker.due(time.time() + DAY) == ({}, [])
+
+
+def test_prompt_then_expire(tracker):
+    now = time.time() + 10 * DAY + 1
+    prompts, expired = tracker.due(now)
+    assert {uid: sorted(name for _, name in nodes) for uid, nodes in prompts.items()} == {'1': ['A', 'B'], '2': ['C']}
+    assert expired == []
+    assert tracker.due(now + DAY) == ({}, [])  # Nel periodo di grazia
+
+    _, expired = tracker.due(now + 2 * DAY)
+    assert sorted(name for _, _, name in expired) == ['A', 'B', 'C']
+
+
+def test_confirm_renews_deadline(tracker):
+    now = time.time() + 10 * DAY + 1
+    prompts, _ = tracker.due(now)
+    entry_id, name = prompts['2'][0]
+
+    assert tracker.confirm(entry_id, '1', now) is None  # Non è il proprietario
+    assert tracker.confirm(entry_id, 2, now) == name
+    _, expired = tracker.due(now + 2 * DAY)
+    assert sorted(n for _, _, n in expired) == ['A', 'B']
+
+    prompts, expired = tracker.due(now + 10 * DAY + 1)
+    assert list(prompts) == ['2'] and expired == []
+
+
+def test_max_prompts_defers_the_rest(tracker):
+    now = time.time() + 10 * DAY + 1
+    prompts, _ = tracker.due(now, max_prompts=2)
+    assert sum(len(nodes) for nodes in prompts.values()) == 2
+    prompts, _ = tracker.due(now, max_prompts=2)
+    assert sum(len(nodes) for nodes in prompts.values()) == 1
+
+
+def test_undelivered_prompts_are_not_expired(tracker):
+    now = time.time() + 10 * DAY + 1
+    prompts, _ = tracker.due(now)
+    tracker.undelivered([entry_id for entry_id, _ in prompts['1']], now)
+
+    prompts, expired = tracker.due(now + 2 * DAY)
+    assert [n for _, _, n in expired] == ['C']
+    assert sorted(name for _, name in prompts['1']) == ['A', 'B']  # Nuova richiesta, non rimozione
+
+
+def test_saved_state_survives_restart(tracker, tmp_path):
+    now = time.time() + 10 * DAY + 1
+    prompts, _ = tracker.due(now)
+    tracker.confirm(prompts['2'][0][0], '2', now)
+    tracker.save()
+
+    restarted = InactivityTracker(tracker.path, interval=10 * DAY, grace=2 * DAY)
+    restarted.rebuild([marker('1', 'A'), marker('2', 'C'), marker('4', 'Nuovo')])
+    prompts, expired = restarted.due(now + 2 * DAY)
+    assert [n for _, _, n in expired] == ['A']
+    # Il nodo senza stato salvato parte dal riavvio: la sua richiesta arriva dopo `interval`
+    assert [name for _, name in prompts['4']] == ['Nuovo']
+    assert restarted.due(now + 2 * DAY) == ({}, [])
+
+
+def test_mutations(tracker):
+    tracker.apply([
+        {'op': 'rename', 'ID': '1', 'name': 'A', 'new_name': 'A2', 'seq': 4},
+        {'op': 'delete', 'ID': '1', 'name': 'B', 'seq': 5},
+        {'op': 'add', 'marker': marker('5', 'D', source='meshcore'), 'seq': 6},
+        {'op': 'delete', 'ID': '2', 'name': 'C', 'seq': 2},  # Già inclusa nella ricostruzione
+    ])
+    prompts, _ = tracker.due(time.time() + 10 * DAY + 1)
+    assert {uid: [name for _, name in nodes] for uid, nodes in prompts.items()} == {'1': ['A2'], '2': ['C']}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from ingest import MeshCoreIngester
+from store import MarkerStore, CsvBackend, write_csv_file
+from bench.dataset import generate
+
+FREQUENCIES = ["868 MHz", "433 MHz"]
+
+
+def node(key, lat=45.1, lon=9.2, name="Nodo", freq=869.525, **extra):
+    return dict({'public_key': key, 'adv_lat': lat, 'adv_lon': lon, 'adv_name': name,
+                 'type': 2, 'params': {'freq': freq}, 'last_advert': 1700000000}, **extra)
+
+
+def setup(tmp_path, **kwargs):
+    csv_path = str(tmp_path / 'dati.csv')
+    write_csv_file(csv_path, generate(20, seed=8))
+    store = MarkerStore(CsvBackend(csv_path))
+    ingester = MeshCoreIngester(str(tmp_path / 'meshcore.json'), FREQUENCIES, **kwargs)
+    version, markers = store.snapshot()
+    ingester.rebuild(markers, version)
+    store.add_listener(ingester.apply)
+    return store, ingester
+
+
+def test_to_marker_filters_nodes(tmp_path):
+    ingester = MeshCoreIngester(str(tmp_path / 'stato.json'), FREQUENCIES, bounds=(35, 6, 48, 19))
+    marker = ingester.to_marker(node('AB:CD', name='<b>Rip</b>'))
+    assert marker['ID'] == 'mc:abcd' and marker['frequency'] == '868 MHz' and marker['node_type'] == 'Repeater'
+    assert '<' not in marker['name'] and marker['source'] == 'meshcore'
+    assert ingester.to_marker(node('ab', freq=433175000))['frequency'] == '433 MHz'  # Hz
+    assert ingester.to_marker(node('ab', freq=915.0)) is None
+    assert ingester.to_marker(node('ab', lat=0, lon=0)) is None
+    assert ingester.to_marker(node('ab', lat=52.5)) is None  # Fuori dall'area
+    assert ingester.to_marker(node('')) is None
+
+
+def test_plan_only_touches_changed_nodes(tmp_path):
+    store, ingester = setup(tmp_path)
+    nodes = [node(f'{i:04x}', lat=45 + i / 100, name=f'N{i}') for i in range(30)]
+
+    mutations, counts = ingester.plan(nodes)
+    assert counts['added'] == 30 and len(mutations) == 30
+    store.commit(mutations)
+    assert ingester.count() == 30
+
+    # Stessa lista: nessuna scrittura
+    assert ingester.plan(nodes) == ([], {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 30, 'skipped': 0})
+
+    nodes[3] = dict(nodes[3], adv_name='Cambiato')
+    nodes[4] = dict(nodes[4], last_advert=1800000000)  # Solo il timestamp: non conta
+    del nodes[5]
+    nodes.append(node('ffff', lat=0, lon=0))
+    mutations, counts = ingester.plan(nodes)
+    assert counts == {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 28, 'skipped': 1}
+    assert [(m['op'], m.get('ID') or m['marker']['ID']) for m in mutations] == \
+        [('delete', 'mc:0003'), ('add', 'mc:0003'), ('delete', 'mc:0005')]
+    store.commit(mutations)
+
+    names = {m['name'] for m in store.all() if m['source'] == 'meshcore'}
+    assert 'Cambiato' in names and 'N5' not in names and len(names) == 29
+    assert store.count() == 20 + 29  # I marker degli utenti non vengono toccati
+    assert ingester.plan([])[0] == []  # Lista vuota: non si rimuove nulla
+
+
+def test_file_cursor_skips_unchanged_list(tmp_path):
+    path = tmp_path / 'nodi.json'
+    path.write_text(json.dumps({'nodes': [node('aa')]}), encoding='utf-8')
+    _, ingester = setup(tmp_path, path=str(path))
+
+    nodes, cursor = ingester.fetch()
+    assert len(nodes) == 1
+    ingester.commit(cursor)
+    assert ingester.fetch() is None
+    assert ingester.fetch(force=True) is not None
+
+    # Riscritto con lo stesso contenuto: cambia mtime ma non l'hash
+    path.write_text(json.dumps({'nodes': [node('aa')]}), encoding='utf-8')
+    reloaded = MeshCoreIngester(str(tmp_path / 'meshcore.json'), FREQUENCIES, path=str(path))
+    assert reloaded.fetch() is None
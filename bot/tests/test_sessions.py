@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import sessions as sessions_module
+from sessions import SessionManager
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions_module.time, 'time', lambda: now[0])
+    return now
+
+
+def test_sessions_expire_after_inactivity(clock):
+    manager = SessionManager(ttl=60)
+    manager.start(1, 'add')
+    manager.start('2', 'rename')
+    assert manager.get('1') == 'add' and manager.busy(2, 'add') and not manager.busy(2, 'rename')
+
+    clock[0] += 50
+    manager.touch(1)  # Rinnova solo la sessione di 1
+    clock[0] += 20
+    assert manager.get(2) is None
+    assert manager.get(1) == 'add'
+
+    clock[0] += 60
+    assert manager.sweep() == 1
+    assert len(manager) == 0 and manager.evicted == 2
+
+
+def test_end_and_max_sessions(clock):
+    manager = SessionManager(ttl=60, max_sessions=3)
+    for uid in range(5):
+        manager.start(uid, 'near')
+        clock[0] += 1
+    assert len(manager) == 3 and manager.get(0) is None and manager.get(4) == 'near'
+
+    assert not manager.end(4, 'add')  # Un'altra operazione in corso: resta aperta
+    assert manager.end(4, 'near') and not manager.active(4)
+    assert manager.end(3) and not manager.end(3)
+
+
+def test_sweep_stops_at_first_active_session(clock):
+    manager = SessionManager(ttl=60)
+    manager.start(1, 'add')
+    manager.start(2, 'add')
+    clock[0] += 30
+    manager.start(1, 'rename')  # Ora la più recente: la pulizia si ferma prima
+    clock[0] += 40
+    assert manager.sweep() == 1
+    assert manager.get(1) == 'rename'
+
+
+def test_saved_sessions_survive_restart(tmp_path, clock):
+    path = str(tmp_path / 'sessioni.json')
+    manager = SessionManager(ttl=60, path=path)
+    manager.start(1, 'add')
+    clock[0] += 30
+    manager.start(2, 'rename')
+    manager.save()
+
+    clock[0] += 40  # La sessione di 1 scade mentre il bot è fermo
+    restarted = SessionManager(ttl=60, path=path)
+    restarted.load()
+    assert restarted.get(1) is None
+    assert restarted.get(2) == 'rename' and len(restarted) == 1
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import numpy as np
+import pytest
+
+from spatial import GridIndex, haversine_km
+from bench.dataset import generate
+
+
+def distances(markers, lat, lon):
+    return haversine_km(lat, lon, np.array([float(m['lat']) for m in markers]),
+                        np.array([float(m['lon']) for m in markers]))
+
+
+def keys(markers):
+    return sorted((m['ID'], m['name']) for m in markers)
+
+
+@pytest.fixture(scope='module')
+def markers():
+    return generate(3000, seed=7)
+
+
+@pytest.fixture
+def index(markers):
+    index = GridIndex(cell_deg=0.1)
+    index.rebuild(markers, version=1)
+    return index
+
+
+def points(count, seed=3):
+    rng = random.Random(seed)
+    # Anche punti lontani dai nodi (mare, fuori dall'Italia)
+    return [(rng.uniform(35.0, 48.0), rng.uniform(5.0, 20.0)) for _ in range(count)]
+
+
+@pytest.mark.parametrize('k', [1, 5, 20])
+@pytest.mark.parametrize('frequency', [None, '433 MHz'])
+def test_nearest_matches_brute_force(index, markers, k, frequency):
+    candidates = [m for m in markers if frequency is None or m['frequency'] == frequency]
+    for lat, lon in points(40):
+        found = index.nearest(lat, lon, k=k, frequency=frequency)
+        expected = np.sort(distances(candidates, lat, lon))[:k]
+        assert [round(km, 6) for _, km, _ in found] == [round(km, 6) for km in expected]
+        assert all(frequency is None or m['frequency'] == frequency for m, _, _ in found)
+
+
+def test_nearest_max_km(index, markers):
+    for lat, lon in points(20):
+        found = index.nearest(lat, lon, k=10, max_km=25)
+        inside = distances(markers, lat, lon) <= 25
+        assert len(found) == min(10, int(inside.sum()))
+        assert all(km <= 25 for _, km, _ in found)
+
+
+def test_query_bbox_matches_brute_force(index, markers):
+    rng = random.Random(5)
+    for _ in range(30):
+        lat, lon = rng.uniform(37.0, 46.0), rng.uniform(7.0, 18.0)
+        bbox = (lat, lon, lat + rng.uniform(0.05, 3.0), lon + rng.uniform(0.05, 3.0))
+        version, found = index.query(bbox=bbox)
+        expected = [m for m in markers
+                    if bbox[0] <= float(m['lat']) <= bbox[2] and bbox[1] <= float(m['lon']) <= bbox[3]]
+        assert version == 1
+        assert keys(m for m, _ in found) == keys(expected)
+
+
+def test_query_radius_matches_brute_force(index, markers):
+    for lat, lon in points(30):
+        _, found = index.query(center=(lat, lon), radius_km=40, frequency='868 MHz')
+        dist = distances(markers, lat, lon)
+        expected = [m for m, km in zip(markers, dist) if km <= 40 and m['frequency'] == '868 MHz']
+        assert keys(m for m, _ in found) == keys(expected)
+        assert all(km <= 40 for _, km in found)
+
+
+def test_apply_keeps_results_consistent(index, markers):
+    removed = markers[::3]
+    index.apply([{'op': 'delete', 'ID': m['ID'], 'name': m['name'], 'seq': 2 + i} for i, m in enumerate(removed)])
+    added = dict(markers[1], name='Aggiunto', lat='41.9', lon='12.5')
+    index.apply([{'op': 'add', 'marker': added, 'seq': 10000}])
+    remaining = [m for m in markers if m not in removed] + [added]
+
+    assert index.count == len(remaining)
+    assert index.version == 10000
+    for lat, lon in points(20, seed=9):
+        found = index.nearest(lat, lon, k=5)
+        expected = np.sort(distances(remaining, lat, lon))[:5]
+        assert [round(km, 6) for _, km, _ in found] == [round(km, 6) for km in expected]
+    _, everything = index.query()
+    assert keys(m for m, _ in everything) == keys(remaining)
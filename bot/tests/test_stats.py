@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import random
+import time
+
+from stats import StatsAggregator
+from bench.dataset import generate
+
+
+def state(stats):
+    summary = stats.summary()
+    summary['by_frequency'] = sorted(summary['by_frequency'])
+    summary['by_node_type'] = sorted(stats.by_node_type.items())
+    return summary, dict(stats.by_user), dict(stats.by_day)
+
+
+def test_incremental_matches_rebuild():
+    rng = random.Random(2)
+    markers = generate(1000, seed=21)
+    for m in markers[::7]:
+        m['source'] = 'import'
+    current = markers[:600]
+    stats = StatsAggregator()
+    stats.rebuild(current, version=10)
+
+    seq = 10
+    mutations = [{'op': 'add', 'marker': markers[0], 'seq': 5}]  # Già inclusa nella ricostruzione
+    for marker in markers[600:]:
+        seq += 1
+        mutations.append({'op': 'add', 'marker': marker, 'seq': seq})
+        current.append(marker)
+    for marker in rng.sample(current, 150):
+        seq += 1
+        mutations.append({'op': 'delete', 'ID': marker['ID'], 'name': marker['name'], 'seq': seq})
+        current = [m for m in current if (m['ID'], m['name']) != (marker['ID'], marker['name'])]
+    for marker in rng.sample(current, 50):
+        seq += 1
+        mutations.append({'op': 'rename', 'ID': marker['ID'], 'name': marker['name'], 'new_name': 'Nuovo', 'seq': seq})
+        marker['name'] = 'Nuovo'  # Il primo marker con quel nome, come nello store
+    stats.apply(mutations)
+
+    expected = StatsAggregator()
+    expected.rebuild(current)
+    assert state(stats) == state(expected)
+    assert stats.by_source['import'] == sum(1 for m in current if m['source'])
+
+
+def test_top_users_and_recent_additions():
+    now = int(time.time())
+    markers = generate(500, seed=22)
+    for i, m in enumerate(markers):
+        m['timestamp'] = str(now - (i % 10) * 86400)
+    stats = StatsAggregator()
+    stats.rebuild(markers)
+
+    counts = collections.Counter(m['ID'] for m in markers)
+    top = stats.top_users(5)
+    assert [c for _, _, c in top] == [c for _, c in counts.most_common(5)]
+    assert all(counts[uid] == c for uid, _, c in top)
+    assert stats.top_users(5) == top  # La lettura non consuma l'heap
+
+    assert stats.added_since(1) == 50
+    assert stats.added_since(3) == 150
+
+    uid = top[0][0]
+    stats.apply([{'op': 'delete', 'ID': uid, 'name': m['name'], 'seq': i + 1}
+                 for i, m in enumerate(m for m in markers if m['ID'] == uid)])
+    assert uid not in [u for u, _, _ in stats.top_users(5)]
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+
+from store import MarkerStore, JournaledCsvBackend, SQLiteBackend, read_csv_file, write_csv_file, normalize
+from bench.dataset import generate
+
+
+@pytest.fixture
+def paths(tmp_path):
+    csv_path = str(tmp_path / 'dati.csv')
+    write_csv_file(csv_path, generate(50, seed=1))
+    return csv_path, str(tmp_path / 'dati.journal'), str(tmp_path / 'dati.history')
+
+
+def open_store(paths, max_bytes=1024 * 1024):
+    csv_path, journal_path, history_path = paths
+    return MarkerStore(JournaledCsvBackend(csv_path, journal_path, history_path, max_bytes=max_bytes))
+
+
+def mutate(store):
+    """Una modifica per tipo; ritorna il marker aggiunto."""
+    first = store.all()[0]
+    marker = dict(generate(1, seed=2)[0], ID='42', name='Nuovo')
+    assert store.add(marker)
+    assert store.rename(first['ID'], 0, 'Rinominato') == first['name']
+    assert store.remove('42', 'Nuovo') == 1
+    assert store.add(dict(marker, name='Ultimo'))
+    return marker
+
+
+def test_journal_replay_restores_state(paths):
+    store = open_store(paths)
+    mutate(store)
+    version, markers = store.snapshot()
+
+    # Il CSV non viene riscritto: lo stato si ricostruisce dal journal
+    assert len(read_csv_file(paths[0])) == 50
+    reopened = open_store(paths)
+    assert reopened.snapshot() == (version, markers)
+    assert reopened.has_name('42', 'ULTIMO')
+    assert not reopened.has_name('42', 'Nuovo')
+
+
+def test_journal_ignores_truncated_record(paths):
+    store = open_store(paths)
+    mutate(store)
+    expected = store.snapshot()
+    with open(paths[1], 'a', encoding='utf-8') as f:
+        f.write('{"seq": 99, "mutation": {"op": "del')  # Crash durante la scrittura
+
+    assert open_store(paths).snapshot() == expected
+
+
+def test_compaction_writes_csv_and_history(paths):
+    store = open_store(paths)
+    mutate(store)
+    version, markers = store.snapshot()
+    store.compact()
+
+    assert read_csv_file(paths[0]) == [normalize(m) for m in markers]
+    with open(paths[1], encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    assert len(lines) == 1 and lines[0]['seq'] == version  # Solo l'intestazione
+    with open(paths[2], encoding='utf-8') as f:
+        assert [json.loads(line)['seq'] for line in f] == [1, 2, 3, 4]
+
+    reopened = open_store(paths)
+    assert reopened.snapshot() == (version, markers)
+    reopened.add(dict(markers[0], name='Dopo compattazione'))
+    assert open_store(paths).snapshot()[0] == version + 1
+
+
+def test_compaction_on_size_limit(paths):
+    store = open_store(paths, max_bytes=1)
+    mutate(store)
+    assert os.path.getsize(paths[1]) < 200
+    assert open_store(paths).snapshot() == store.snapshot()
+
+
+def test_stale_journal_is_ignored(paths):
+    """Crash dopo la scrittura del CSV ma prima del nuovo journal: il journal è già nel CSV."""
+    store = open_store(paths)
+    mutate(store)
+    with open(paths[1], encoding='utf-8') as f:
+        journal = f.read()
+    store.compact()
+    with open(paths[1], 'w', encoding='utf-8') as f:
+        f.write(journal)
+
+    assert open_store(paths).all() == store.all()
+
+
+def failing_write(path, markers):
+    raise OSError(28, 'No space left on device')
+
+
+def test_failed_compaction_keeps_commit(paths, monkeypatch):
+    import store as store_module
+    store = open_store(paths, max_bytes=1)
+    seen = []
+    store.add_listener(seen.extend)
+    marker = dict(generate(1, seed=3)[0], ID='7', name='Durante il guasto')
+
+    monkeypatch.setattr(store_module, 'write_csv_file', failing_write)
+    assert store.add(marker)  # Nessuna eccezione: il journal è già scritto
+    assert [m['seq'] for m in seen] == [store.version]
+    assert store.backend.dirty
+    assert open_store(paths).has_name('7', 'Durante il guasto')
+
+    # Al commit successivo la compattazione viene ritentata
+    monkeypatch.undo()
+    assert store.add(dict(marker, name='Dopo il guasto'))
+    assert not store.backend.dirty
+    assert {'Durante il guasto', 'Dopo il guasto'} <= {m['name'] for m in read_csv_file(paths[0])}
+    assert open_store(paths).snapshot() == store.snapshot()
+
+
+def test_failed_replace_changes_nothing(paths, monkeypatch):
+    import store as store_module
+    store = open_store(paths)
+    mutate(store)
+    before = store.snapshot()
+
+    monkeypatch.setattr(store_module, 'write_csv_file', failing_write)
+    with pytest.raises(OSError):
+        store.replace_all(generate(5, seed=4))
+    assert store.snapshot() == before
+    assert store.backend.version == before[0]
+
+    monkeypatch.undo()
+    assert store.add(dict(generate(1, seed=5)[0], ID='8', name='Dopo'))
+    assert open_store(paths).snapshot() == store.snapshot() and store.version == before[0] + 1
+
+
+def test_sqlite_imports_csv_once_and_persists(paths, tmp_path):
+    db_path = str(tmp_path / 'dati.db')
+    store = MarkerStore(SQLiteBackend(db_path, import_csv=paths[0]))
+    assert store.count() == 50
+    mutate(store)
+    version, markers = store.snapshot()
+    store.backend.close()
+
+    # Alla riapertura il CSV non viene reimportato: vale il contenuto del database
+    write_csv_file(paths[0], generate(10, seed=6))
+    reopened = MarkerStore(SQLiteBackend(db_path, import_csv=paths[0]))
+    assert reopened.snapshot() == (version, markers)
+    assert reopened.has_name('42', 'ultimo')
+    reopened.backend.close()
+
+
+def test_sqlite_replace_and_external_changes(tmp_path):
+    db_path = str(tmp_path / 'dati.db')
+    store = MarkerStore(SQLiteBackend(db_path))
+    assert store.add(dict(generate(1, seed=7)[0], ID='1', name='Primo'))
+    store.replace_all(generate(20, seed=8))
+    assert store.count() == 20 and not store.has_name('1', 'Primo')
+
+    # Una modifica da un'altra connessione viene vista al refresh successivo
+    other = MarkerStore(SQLiteBackend(db_path))
+    assert other.add(dict(generate(1, seed=9)[0], ID='2', name='Esterno'))
+    assert store.has_name('2', 'Esterno')
+    assert store.snapshot() == other.snapshot()
+    other.backend.close()
+    store.backend.close()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from subscriptions import SubscriptionIndex
+from spatial import haversine_km
+
+
+def test_match_equals_brute_force(tmp_path):
+    rng = random.Random(5)
+    index = SubscriptionIndex(str(tmp_path / 'iscrizioni.json'), cell_deg=0.25)
+    subs = [index.add(rng.randrange(50), rng.uniform(36, 47), rng.uniform(6, 19), rng.choice([5, 20, 80]),
+                      rng.choice([None, '868 MHz', '433 MHz']))
+            for _ in range(400)]
+
+    for _ in range(200):
+        marker = {'lat': str(rng.uniform(36, 47)), 'lon': str(rng.uniform(6, 19)),
+                  'frequency': rng.choice(['868 MHz', '433 MHz'])}
+        expected = sorted(
+            s['id'] for s in subs
+            if (not s['frequency'] or s['frequency'] == marker['frequency'])
+            and float(haversine_km(float(marker['lat']), float(marker['lon']), [s['lat']], [s['lon']])[0]) <= s['radius_km']
+        )
+        assert sorted(s['id'] for s, _ in index.match(marker)) == expected
+
+
+def test_remove_and_persistence(tmp_path):
+    path = str(tmp_path / 'iscrizioni.json')
+    index = SubscriptionIndex(path)
+    first = index.add(1, 45.0, 9.0, 10)
+    index.add(1, 41.9, 12.5, 10)
+    other = index.add(2, 45.01, 9.01, 10, '868 MHz')
+    marker = {'lat': '45.0', 'lon': '9.0', 'frequency': '868 MHz'}
+
+    assert index.remove(first['id'])['id'] == first['id']
+    assert index.remove(first['id']) is None
+    assert [s['id'] for s, _ in index.match(marker)] == [other['id']]
+    index.save()
+
+    reloaded = SubscriptionIndex(path)
+    assert reloaded.count() == 2 and reloaded.count(1) == 1
+    assert reloaded.add(3, 0, 0, 1)['id'] > other['id']  # Gli id non vengono riusati
+    assert reloaded.remove_chat(2) == 1
+    assert reloaded.match(marker) == []
+    assert reloaded.match({'lat': 'x', 'lon': '9'}) == []
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+
+from tiles import ClusterPyramid
+from bench.dataset import generate
+
+
+@pytest.fixture(scope='module')
+def markers():
+    return generate(800, seed=11)
+
+
+def tile_files(directory):
+    found = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, directory)
+            if rel.count(os.sep) == 3:  # insieme/z/x/y.json
+                with open(path, encoding='utf-8') as f:
+                    found[rel] = json.load(f)
+    return found
+
+
+def test_incremental_matches_rebuild(tmp_path, markers):
+    incremental = ClusterPyramid(str(tmp_path / 'a'), max_zoom=6)
+    project = incremental.projection()
+    project(markers[:500], None, 0)
+    removed = markers[:500:4]
+    mutations = [{'op': 'delete', 'ID': m['ID'], 'name': m['name'], 'seq': i + 1} for i, m in enumerate(removed)]
+    mutations += [{'op': 'add', 'marker': m, 'seq': 1000 + i} for i, m in enumerate(markers[500:])]
+    project(None, mutations, 1000 + len(markers[500:]))
+
+    expected = ClusterPyramid(str(tmp_path / 'b'), max_zoom=6)
+    expected.projection()([m for m in markers if m not in removed], None, 1)
+    assert tile_files(tmp_path / 'a') == tile_files(tmp_path / 'b')
+
+
+def test_clusters_count_every_node(tmp_path, markers):
+    pyramid = ClusterPyramid(str(tmp_path), max_zoom=4)
+    pyramid.projection()(markers, None, 1)
+    with open(tmp_path / 'index.json', encoding='utf-8') as f:
+        index = json.load(f)
+    assert index['version'] == 1 and 'all' in index['sets']
+
+    for z in range(index['max_zoom'] + 1):
+        total = 0
+        for rel, tile in tile_files(tmp_path).items():
+            name, tz = rel.split(os.sep)[:2]
+            if name == 'all' and int(tz) == z:
+                total += sum(c[2] for c in tile['clusters']) + len(tile['nodes'])
+        assert total == index['count']
+
+
+def counting(pyramid):
+    """Registra quanti tile scrive ogni chiamata di write_dirty."""
+    written = []
+    original = pyramid.write_dirty
+    pyramid.write_dirty = lambda: written.append(original()) or written[-1]
+    return written
+
+
+def test_restart_rewrites_only_changed_tiles(tmp_path, markers):
+    ClusterPyramid(str(tmp_path), max_zoom=6).projection()(markers, None, 5)
+    before = set(tile_files(tmp_path))
+
+    # Stessa versione: nessun tile riscritto
+    restarted = ClusterPyramid(str(tmp_path), max_zoom=6)
+    written = counting(restarted)
+    restarted.projection()(markers, None, 5)
+    assert written == [0]
+
+    # Un nodo in meno: si riscrive solo il suo percorso (due insiemi, sette zoom)
+    restarted = ClusterPyramid(str(tmp_path), max_zoom=6)
+    written = counting(restarted)
+    restarted.projection()(markers[1:], None, 6)
+    assert 0 < written[0] <= 2 * 7
+    after = tile_files(tmp_path)
+    assert set(after) <= before
+
+    expected = ClusterPyramid(str(tmp_path / 'atteso'), max_zoom=6)
+    expected.projection()(markers[1:], None, 6)
+    assert after == tile_files(tmp_path / 'atteso')
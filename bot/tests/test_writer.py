@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from writer import StoreWriter
+
+
+class FakeStore:
+    def __init__(self, fail=False):
+        self.commits = []
+        self.fail = fail
+
+    def commit(self, mutations):
+        if self.fail:
+            raise OSError('disco pieno')
+        self.commits.append(list(mutations))
+        return [m['n'] * 10 for m in mutations]
+
+
+def test_concurrent_submits_share_one_commit():
+    store = FakeStore()
+
+    async def main():
+        writer = StoreWriter(store, window=0.2)
+        writer.start()
+        results = await asyncio.gather(*(writer.submit([{'n': i}, {'n': i + 100}]) for i in range(5)))
+        await writer.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert len(store.commits) == 1
+    assert [m['n'] for m in store.commits[0]] == [0, 100, 1, 101, 2, 102, 3, 103, 4, 104]
+    assert results == [[i * 10, (i + 100) * 10] for i in range(5)]
+
+
+def test_max_batch_splits_commits():
+    store = FakeStore()
+
+    async def main():
+        writer = StoreWriter(store, window=0.2, max_batch=3)
+        writer.start()
+        await asyncio.gather(*(writer.submit([{'n': i}]) for i in range(7)))
+        await writer.stop()
+
+    asyncio.run(main())
+    assert [len(c) for c in store.commits] == [3, 3, 1]
+
+
+def test_commit_error_reaches_every_caller():
+    async def main():
+        writer = StoreWriter(FakeStore(fail=True), window=0.1)
+        writer.start()
+        results = await asyncio.gather(writer.submit([{'n': 1}]), writer.submit([{'n': 2}]),
+                                       return_exceptions=True)
+        await writer.stop()
+        return results
+
+    assert all(isinstance(r, OSError) for r in asyncio.run(main()))
+
+
+def test_stop_flushes_queue_and_direct_commit_without_task():
+    store = FakeStore()
+
+    async def main():
+        writer = StoreWriter(store, window=10)
+        writer.start()
+        pending = asyncio.ensure_future(writer.submit([{'n': 1}]))
+        await asyncio.sleep(0)
+        await writer.stop()  # Non aspetta la finestra da 10 secondi
+        assert await pending == [10]
+        assert await writer.submit([{'n': 2}]) == [20]  # Writer fermo: commit diretto
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+    assert store.commits == [[{'n': 1}], [{'n': 2}]]
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+# Caratteri ammessi nei testi mostrati sulla mappa: tutto il resto (in particolare < > " ')
+# viene rimosso, così nomi e descrizioni non possono contenere HTML
+UNSAFE_CHARS = r'[^\w\s\-.,!?@#&%â‚¬:/\U0001F300-\U0001FAFF]'
+
+
+def clean_text(text):
+    """Pulisce il testo rimuovendo caratteri speciali SENZA limitare la lunghezza"""
+    text = text.strip('"\'')  # Rimuove apici all'inizio/fine
+    text = re.sub(UNSAFE_CHARS, '', text, flags=re.UNICODE)
+    return text
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+
+from store import write_bytes_atomic, read_json
+from feedrows import feed_row, FEED_FIELDS
+
+TILE_SIZE = 256
+MAX_LAT = 85.05112878
+
+
+def world_position(lat, lon):
+    """Coordinate Web Mercator normalizzate in [0, 1)."""
+    lat = max(min(lat, MAX_LAT), -MAX_LAT)
+    x = (lon + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+
+def frequency_slug(frequency):
+    """Nome della cartella dei tile per una frequenza ("868 MHz" -> "868mhz")."""
+    return re.sub(r'[^0-9a-z]+', '', frequency.lower()) or 'altro'
+
+
+class ClusterPyramid:
+    """Piramide di cluster precalcolata, scritta come tile JSON statici z/x/y.
+
+    Ogni tile da 256 px è diviso in celle da `cell_px` px; a ogni zoom i nodi
+    della stessa cella formano un cluster (posizione media + numero di nodi).
+    Le celle di uno zoom sono l'unione esatta di 4 celle dello zoom successivo,
+    quindi gli aggregati si aggiornano in O(zoom) per ogni modifica e vengono
+    riscritti solo i tile toccati. Si salvano solo gli zoom bassi (fino a
+    `max_zoom`): oltre, la pagina disegna i singoli nodi dal feed che ha già.
+
+    Esiste un insieme di tile per tutti i nodi ("all") e uno per frequenza,
+    così il filtro frequenza della pagina corrisponde a un insieme di tile.
+
+    In `state.json` restano la versione dei tile scritti e l'hash di ogni
+    tile: all'avvio, se la versione è la stessa, non si riscrive nulla,
+    altrimenti (e dopo un replace) si riscrivono solo i tile cambiati e si
+    cancellano quelli spariti, senza rigenerare tutto l'albero."""
+
+    def __init__(self, directory, max_zoom=12, cell_px=64):
+        self.directory = directory
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self.cells_per_tile = TILE_SIZE // cell_px
+        self.version = 0  # Ultima mutazione inclusa negli aggregati
+        self.state_path = os.path.join(directory, 'state.json')
+        self._hashes = None   # {"insieme/z/x/y": hash} dei tile su disco, caricato da state.json
+        self._state_changed = False
+        self._reset()
+
+    def _reset(self):
+        self._next_id = 0
+        self._points = {}     # {id: (wx, wy, lat, lon, insiemi, riga del feed)}
+        self._by_marker = {}  # {(ID, nome): [id, ...]}
+        self._cells = {}      # {insieme: [{(cx, cy): [conteggio, somma_lat, somma_lon]} per zoom]}
+        self._leaves = {}     # {insieme: {(cx, cy): set(id)}} all'ultimo zoom
+        self._sets = {'all'}
+        self._dirty = set()   # {(insieme, z, x, y)}
+
+    # -------------- AGGREGATI --------------
+
+    def _cell(self, wx, wy, z):
+        scale = (1 << z) * self.cells_per_tile
+        return int(wx * scale), int(wy * scale)
+
+    def _update(self, point_id, sign):
+        wx, wy, lat, lon, sets, _ = self._points[point_id]
+        for name in sets:
+            levels = self._cells.setdefault(name, [{} for _ in range(self.max_zoom + 1)])
+            for z in range(self.max_zoom + 1):
+                cell = self._cell(wx, wy, z)
+                agg = levels[z].get(cell)
+                if agg is None:
+                    agg = levels[z][cell] = [0, 0.0, 0.0]
+                agg[0] += sign
+                agg[1] += sign * lat
+                agg[2] += sign * lon
+                if agg[0] <= 0:
+                    del levels[z][cell]
+                self._dirty.add((name, z, cell[0] // self.cells_per_tile, cell[1] // self.cells_per_tile))
+
+            leaf = self._cell(wx, wy, self.max_zoom)
+            members = self._leaves.setdefault(name, {}).setdefault(leaf, set())
+            if sign > 0:
+                members.add(point_id)
+            else:
+                members.discard(point_id)
+                if not members:
+                    del self._leaves[name][leaf]
+
+    def _mark_dirty(self, point_id):
+        wx, wy, _, _, sets, _ = self._points[point_id]
+        for name in sets:
+            for z in range(self.max_zoom + 1):
+                cell = self._cell(wx, wy, z)
+                self._dirty.add((name, z, cell[0] // self.cells_per_tile, cell[1] // self.cells_per_tile))
+
+    def add(self, marker):
+        row = feed_row(marker)
+        if row is None:
+            return
+        lat, lon = row[0], row[1]
+        wx, wy = world_position(lat, lon)
+        sets = ('all', frequency_slug(marker['frequency'])) if marker.get('frequency') else ('all',)
+        self._sets.update(sets)
+
+        point_id = self._next_id
+        self._next_id += 1
+        self._points[point_id] = (wx, wy, lat, lon, sets, row)
+        self._by_marker.setdefault((marker['ID'], marker['name']), []).append(point_id)
+        self._update(point_id, +1)
+
+    def remove(self, uid, name):
+        for point_id in self._by_marker.pop((uid, name), []):
+            self._update(point_id, -1)
+            del self._points[point_id]
+
+    def rename(self, uid, name, new_name):
+        ids = self._by_marker.get((uid, name))
+        if not ids:
+            return
+        point_id = ids.pop(0)
+        if not ids:
+            del self._by_marker[(uid, name)]
+        self._points[point_id][5][FEED_FIELDS.index('name')] = new_name
+        self._by_marker.setdefault((uid, new_name), []).append(point_id)
+        self._mark_dirty(point_id)
+
+    def rebuild(self, markers):
+        self._reset()
+        for marker in markers:
+            self.add(marker)
+
+    def apply(self, mutations):
+        for mutation in mutations:
+            if mutation.get('seq', 0) <= self.version:
+                continue  # Già inclusa nell'ultima ricostruzione
+            self.version = mutation['seq']
+            op = mutation['op']
+            if op == 'add':
+                self.add(mutation['marker'])
+            elif op == 'rename':
+                self.rename(mutation['ID'], mutation['name'], mutation['new_name'])
+            elif op == 'delete':
+                self.remove(mutation['ID'], mutation['name'])
+
+    # -------------- TILE --------------
+
+    def _single_point(self, name, z, cell):
+        """Id del nodo in una cella che ne contiene uno solo (scende fino all'ultimo zoom)."""
+        levels = self._cells[name]
+        cx, cy = cell
+        while z < self.max_zoom:
+            z += 1
+            for dx in (0, 1):
+                for dy in (0, 1):
+                    child = (cx * 2 + dx, cy * 2 + dy)
+                    if child in levels[z]:
+                        cx, cy = child
+                        break
+                else:
+                    continue
+                break
+        return next(iter(self._leaves[name][(cx, cy)]))
+
+    def tile(self, name, z, x, y):
+        """Contenuto di un tile: cluster [lat, lon, n] e nodi singoli (righe del feed)."""
+        clusters, nodes = [], []
+        levels = self._cells.get(name)
+        if levels is None:
+            return clusters, nodes
+
+        n = self.cells_per_tile
+        for cx in range(x * n, (x + 1) * n):
+            for cy in range(y * n, (y + 1) * n):
+                agg = levels[z].get((cx, cy))
+                if agg is None:
+                    continue
+                if agg[0] == 1:
+                    nodes.append(self._points[self._single_point(name, z, (cx, cy))][5])
+                else:
+                    clusters.append([round(agg[1] / agg[0], 6), round(agg[2] / agg[0], 6), agg[0]])
+        return clusters, nodes
+
+    def _tile_path(self, name, z, x, y):
+        return os.path.join(self.directory, name, str(z), str(x), f"{y}.json")
+
+    # -------------- STATO SU DISCO --------------
+
+    def _load_state(self):
+        """Versione dei tile su disco (None se mancano o hanno un'altra geometria).
+
+        I tile scritti senza stato (o con zoom e celle diversi) non si possono
+        confrontare: vengono cancellati una volta sola e poi riscritti."""
+        state = read_json(self.state_path, None)
+        if state and state.get('max_zoom') == self.max_zoom and state.get('cell_px') == self.cell_px:
+            self._hashes = state.get('tiles', {})
+            return state.get('version')
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        self._hashes = {}
+        return None
+
+    def _save_state(self, version):
+        state = {'version': version, 'max_zoom': self.max_zoom, 'cell_px': self.cell_px, 'tiles': self._hashes}
+        write_bytes_atomic(self.state_path, json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+    def _stale(self):
+        """Tile su disco che non corrispondono più a nessuna cella occupata."""
+        for key in self._hashes:
+            name, z, x, y = key.split('/')
+            self._dirty.add((name, int(z), int(x), int(y)))
+
+    def write_dirty(self):
+        """Riscrive i tile modificati il cui contenuto è cambiato (e cancella quelli rimasti vuoti)."""
+        written = 0
+        for name, z, x, y in self._dirty:
+            key = f"{name}/{z}/{x}/{y}"
+            path = self._tile_path(name, z, x, y)
+            clusters, nodes = self.tile(name, z, x, y)
+            if not clusters and not nodes:
+                if self._hashes.pop(key, None) is not None:
+                    self._state_changed = True
+                    if os.path.exists(path):
+                        os.unlink(path)
+                continue
+            data = json.dumps({'clusters': clusters, 'nodes': nodes}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            digest = hashlib.sha1(data).hexdigest()[:16]
+            if self._hashes.get(key) == digest:
+                continue  # Contenuto identico a quello già su disco
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_bytes_atomic(path, data, sync=False)
+            self._hashes[key] = digest
+            self._state_changed = True
+            written += 1
+        self._dirty.clear()
+        return written
+
+    def write_index(self, version):
+        index = {
+            'version': version,
+            'max_zoom': self.max_zoom,
+            'cell_px': self.cell_px,
+            'count': len(self._points),
+            'fields': FEED_FIELDS,
+            'sets': sorted(self._sets),
+        }
+        write_bytes_atomic(os.path.join(self.directory, 'index.json'), json.dumps(index).encode('utf-8'))
+
+    def projection(self):
+        """Funzione da registrare nel ProjectionWorker."""
+        def project(markers, mutations, version):
+            os.makedirs(self.directory, exist_ok=True)
+            first = self._hashes is None
+            saved = self._load_state() if first else None
+            if mutations is None or any(m['op'] == 'replace' for m in mutations):
+                # Ricostruzione degli aggregati in memoria; su disco si confronta con gli hash salvati
+                self.rebuild(markers)
+                self.version = version
+                if saved == version:
+                    self._dirty.clear()  # I tile su disco sono già di questa versione
+                else:
+                    self._stale()
+            else:
+                self.apply(mutations)
+            written = self.write_dirty()
+            if self._state_changed or first:
+                self._save_state(version)
+                self._state_changed = False
+            self.write_index(version)
+            logging.debug(f"Tile cluster aggiornati: {written}")
+        return project
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+
+
+class StoreWriter:
+    """Unico task di scrittura dello store (group commit).
+
+    Gli handler accodano le mutazioni e attendono il proprio risultato;
+    tutte le richieste arrivate entro `window` secondi vengono scritte con
+    un solo commit del backend, in ordine di arrivo. Se viene passato un
+    executor il commit gira su un thread, senza bloccare l'event loop."""
+
+    def __init__(self, store, executor=None, window=0.05, max_batch=500):
+        self.store = store
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+
+    @property
+    def pending(self):
+        """Richieste in attesa del commit."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, mutations):
+        """Accoda le mutazioni e ritorna i risultati dopo il commit."""
+        if self._task is None:
+            # Writer non avviato (es. script esterni): commit diretto
+            return self.store.commit(mutations)
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((mutations, future))
+        return await future
+
+    async def _collect(self):
+        """Attende la prima richiesta e raccoglie quelle arrivate entro la finestra.
+        Ritorna (batch, stop) dove stop indica la richiesta di arresto."""
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = asyncio.get_running_loop().time() + self.window
+        size = len(batch[0][0])
+
+        while size < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += len(item[0])
+        return batch, False
+
+    async def _commit(self, batch):
+        mutations = [m for item, _ in batch for m in item]
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, self.store.commit, mutations)
+        except Exception as e:
+            logging.error(f"Errore nel commit di {len(mutations)} modifiche: {e}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Restituisce a ogni chiamante i propri risultati
+        offset = 0
+        for item, future in batch:
+            if not future.done():
+                future.set_result(results[offset:offset + len(item)])
+            offset += len(item)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._commit(batch)
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Scrive le richieste ancora in coda e ferma il task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
@@ -39,23 +39,53 @@ L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
 }).addTo(map);
 
 // Cluster per gestire meglio molti marker
-const markersCluster = L.markerClusterGroup({
-  maxClusterRadius: 60,
-  spiderfyOnMaxZoom: true,
-  showCoverageOnHover: false,
-  zoomToBoundsOnClick: true,
-  iconCreateFunction: function(cluster) {
-    const count = cluster.getChildCount();
-    return L.divIcon({
-      html: `<div><span>${count}</span></div>`,
-      className: 'cluster-icon',
-      iconSize: L.point(40, 40)
-    });
-  }
-});
+function createCluster(className) {
+  return L.markerClusterGroup({
+    maxClusterRadius: 60,
+    spiderfyOnMaxZoom: true,
+    showCoverageOnHover: false,
+    zoomToBoundsOnClick: true,
+    iconCreateFunction: function(cluster) {
+      const count = cluster.getChildCount();
+      return L.divIcon({
+        html: `<div><span>${count}</span></div>`,
+        className,
+        iconSize: L.point(40, 40)
+      });
+    }
+  });
+}
+const markersCluster = createCluster('cluster-icon');
 map.addLayer(markersCluster);
 
+// Nodi importati dal bot da altre fonti (campo source, es. API MeshCore): layer separato
+const sourceCluster = createCluster('cluster-icon cluster-icon-source');
+map.addLayer(sourceCluster);
+let sourceVisible = true;
+
+function clusterFor(row) {
+  return row.source ? sourceCluster : markersCluster;
+}
+
+// Mostra i marker indicati, ognuno nel proprio layer
+function showMarkers(markers) {
+  markersCluster.clearLayers();
+  sourceCluster.clearLayers();
+  markersCluster.addLayers(markers.filter(marker => !marker.options.data.source));
+  sourceCluster.addLayers(markers.filter(marker => marker.options.data.source));
+}
+
 let currentMarkers = [];
+const markersByKey = new Map(); // Marker Leaflet per chiave (ID utente + nome)
+let feedState = { epoch: null, version: null }; // Versione del feed già caricata (dal manifest)
+
+// Modalità tile: con molti nodi la mappa usa i cluster precalcolati dal bot
+const TILE_MODE_MIN_NODES = 3000; // Sotto questa soglia il clustering nel browser è abbastanza veloce
+const tileLayer = L.layerGroup();
+const tileCache = new Map(); // URL del tile -> Promise con il contenuto
+let tileIndex = null;
+let tileMode = false;
+let tileRequestId = 0;
 let activeFilters = {
   frequency: null
 };
@@ -68,6 +98,22 @@ function capitalizeFirstLetter(string) {
   return string.charAt(0).toUpperCase() + string.slice(1);
 }
 
+// I dati arrivano anche da fonti esterne (nodi MeshCore, importazioni): vanno sempre
+// escapati prima di finire nell'HTML dei popup
+function escapeHtml(value) {
+  return String(value)
+    .replace(/&/g, '&amp;')
+    .replace(/</g, '&lt;')
+    .replace(/>/g, '&gt;')
+    .replace(/"/g, '&quot;')
+    .replace(/'/g, '&#39;');
+}
+
+// Solo link http/https (niente javascript: e simili)
+function isSafeUrl(url) {
+  return /^https?:\/\//i.test(url);
+}
+
 // Funzione per aggiornare la barra di stato
 function updateStatus(type, message) {
   statusBar.style.display = 'flex';
@@ -102,25 +148,28 @@ function updateStatus(type, message) {
 // Funzione per formattare il contenuto del popup
 function formatPopupContent(row) {
   let content = `<div class="map-popup">
-    <b>${row.name || 'Nodo LoRa'}</b>`;
+    <b>${escapeHtml(row.name || 'Nodo LoRa')}</b>`;
   
-  if (row.frequency) content += `<p><i class="fas fa-wave-square"></i> Freq: ${row.frequency}</p>`;
-  if (row.desc) content += `<p><i class="fas fa-info-circle"></i> ${row.desc}</p>`;
+  if (row.frequency) content += `<p><i class="fas fa-wave-square"></i> Freq: ${escapeHtml(row.frequency)}</p>`;
+  if (row.desc) content += `<p><i class="fas fa-info-circle"></i> ${escapeHtml(row.desc)}</p>`;
   
-  if (row.link) {
-    content += `<p><i class="fas fa-external-link-alt"></i> <a href="${row.link}" target="_blank">Maggiori informazioni</a></p>`;
+  if (row.link && isSafeUrl(row.link)) {
+    content += `<p><i class="fas fa-external-link-alt"></i> <a href="${escapeHtml(row.link)}" target="_blank" rel="noopener noreferrer">Maggiori informazioni</a></p>`;
   }
   
-  if (row.user) {
+  if (row.source) {
+    content += `<p><i class="fas fa-satellite-dish"></i> Fonte: ${escapeHtml(capitalizeFirstLetter(row.source))}</p>`;
+  } else if (row.user) {
     const username = row.user.startsWith('@') ? row.user : `@${row.user}`;
-    content += `<p><i class="fas fa-user"></i> Utente: <a href="https://t.me/${username.replace('@', '')}" target="_blank">${username}</a></p>`;
+    content += `<p><i class="fas fa-user"></i> Utente: <a href="https://t.me/${encodeURIComponent(username.replace('@', ''))}" target="_blank" rel="noopener noreferrer">${escapeHtml(username)}</a></p>`;
   }
   
   if (row.timestamp) {
     const date = new Date(parseInt(row.timestamp) * 1000);
     const formattedDate = date.toLocaleDateString('it-IT');
     const formattedTime = date.toLocaleTimeString('it-IT');
-    content += `<p class="timestamp-info"><i class="far fa-calendar-alt"></i> Inserito il ${formattedDate} alle ${formattedTime}</p>`;
+    const label = row.source ? 'Ultimo annuncio il' : 'Inserito il';
+    content += `<p class="timestamp-info"><i class="far fa-calendar-alt"></i> ${label} ${formattedDate} alle ${formattedTime}</p>`;
   }
   
   content += `</div>`;
@@ -186,65 +235,504 @@ function parseCSV(csvText) {
   return results;
 }
 
-async function loadMarkers() {
-  updateStatus('loading', 'Caricamento dati in corso...');
-  
+// Converte una riga del feed precompilato (array) in un oggetto come quelli del CSV
+function rowFromValues(fields, values) {
+  const row = {};
+  fields.forEach((field, index) => {
+    row[field] = values[index];
+  });
+  return row;
+}
+
+function parseFeed(feed) {
+  return feed.nodes.map(values => rowFromValues(feed.fields, values));
+}
+
+// Decodifica lo snapshot binario a colonne scritto dal bot (formato in bot/columnar.py).
+// Le colonne sono viste sul buffer scaricato: nessun parsing, solo le stringhe vengono decodificate.
+function decodeSnapshot(buffer) {
+  const view = new DataView(buffer);
+  const ascii = new TextDecoder('ascii');
+  if (ascii.decode(new Uint8Array(buffer, 0, 4)) !== 'MCNB' || view.getUint16(4, true) !== 1) {
+    throw new Error('Snapshot non valido');
+  }
+  const count = view.getUint32(8, true);
+  const sectionCount = view.getUint32(12, true);
+
+  const types = { f4: Float32Array, u1: Uint8Array, u2: Uint16Array, u4: Uint32Array };
+  const sections = {};
+  for (let i = 0; i < sectionCount; i++) {
+    const base = 16 + i * 20; // Header da 16 byte, 20 byte per sezione
+    const name = ascii.decode(new Uint8Array(buffer, base, 8)).replace(/\0+$/, '');
+    const kind = ascii.decode(new Uint8Array(buffer, base + 8, 2));
+    sections[name] = new types[kind](buffer, view.getUint32(base + 12, true), view.getUint32(base + 16, true));
+  }
+
+  // Tabella di stringhe condivisa, decodificata una sola volta per stringa
+  const utf8 = new TextDecoder();
+  const offsets = sections['str.off'];
+  const data = sections['str.data'];
+  const strings = new Array(offsets.length - 1);
+  const string = index => {
+    if (strings[index] === undefined) {
+      strings[index] = utf8.decode(data.subarray(offsets[index], offsets[index + 1]));
+    }
+    return strings[index];
+  };
+  const frequencies = Array.from(sections['freque.d'], string);
+  const nodeTypes = Array.from(sections['node_t.d'], string);
+  const sources = sections['source.d'] ? Array.from(sections['source.d'], string) : null; // Assente negli snapshot vecchi
+
+  const { lat, lon, ts, frequenc, node_typ, name, desc, link, ID, user, source } = sections;
+  const rows = new Array(count);
+  for (let i = 0; i < count; i++) {
+    rows[i] = {
+      lat: Math.round(lat[i] * 1e6) / 1e6, // Float32: arrotonda alla precisione del CSV
+      lon: Math.round(lon[i] * 1e6) / 1e6,
+      name: string(name[i]),
+      desc: string(desc[i]),
+      node_type: nodeTypes[node_typ[i]],
+      frequency: frequencies[frequenc[i]],
+      link: string(link[i]),
+      ID: string(ID[i]),
+      user: string(user[i]),
+      timestamp: ts[i],
+      source: sources ? sources[source[i]] : ''
+    };
+  }
+  return rows;
+}
+
+// Chiave di un nodo nel registro modifiche: ID utente + nome
+function markerKey(id, name) {
+  return `${id}\u0000${name}`;
+}
+
+// Scarica i dati aggiornati. Ritorna:
+//   { type: 'none' }                 se nulla è cambiato
+//   { type: 'delta', changes, fields } se bastano le ultime modifiche
+//   { type: 'full', data }           con tutti i nodi (feed completo o CSV)
+async function fetchMarkerUpdate() {
   try {
-    const response = await fetch('/shared/dati.csv?t=' + Date.now());
-    if (!response.ok) throw new Error(`Errore HTTP: ${response.status}`);
-    
-    const csv = await response.text();
-    const data = parseCSV(csv);
-    allMarkersData = data; // Salva tutti i dati per la ricerca
-    
-    // Calcola le statistiche
-    const uniqueUsers = new Set(data.map(row => row.user || row.ID));
-    appStats.totalNodes = data.length;
-    appStats.uniqueUsers = uniqueUsers.size;
-    appStats.lastUpdate = new Date();
-    
-    // Aggiorna l'header
-    updateHeaderStats();
-    
-    // Memorizza la vista corrente prima di aggiornare i marker
-    const currentZoom = map.getZoom();
-    const currentCenter = map.getCenter();
+    const manifestResponse = await fetch('/shared/nodes.manifest.json?t=' + Date.now());
+    if (manifestResponse.ok) {
+      const manifest = await manifestResponse.json();
+      const sameEpoch = manifest.epoch === feedState.epoch && feedState.version !== null;
+
+      if (sameEpoch && manifest.version === feedState.version) return { type: 'none' };
+
+      // Rimasti indietro di poco: scarica solo il registro delle modifiche
+      if (sameEpoch && manifest.changes) {
+        const changesResponse = await fetch(`/shared/${manifest.changes}?v=${manifest.version}`);
+        if (changesResponse.ok) {
+          const log = await changesResponse.json();
+          if (log.epoch === feedState.epoch && log.from <= feedState.version) {
+            const changes = log.changes.filter(change => change.v > feedState.version);
+            feedState.version = Math.max(feedState.version, log.version);
+            return { type: 'delta', changes, fields: log.fields };
+          }
+        }
+      }
+
+      // L'hash nell'URL permette al browser di usare la cache
+      if (manifest.snapshot) {
+        try {
+          const snapshotResponse = await fetch(`/shared/${manifest.snapshot}?h=${manifest.hash}`);
+          if (snapshotResponse.ok) {
+            const data = decodeSnapshot(await snapshotResponse.arrayBuffer());
+            feedState = { epoch: manifest.epoch, version: manifest.version };
+            return { type: 'full', data };
+          }
+        } catch (error) {
+          console.warn("Snapshot binario non leggibile, uso il feed JSON:", error);
+        }
+      }
+
+      const feedResponse = await fetch(`/shared/${manifest.feed}?h=${manifest.hash}`);
+      if (feedResponse.ok) {
+        const data = parseFeed(await feedResponse.json());
+        feedState = { epoch: manifest.epoch, version: manifest.version };
+        return { type: 'full', data };
+      }
+    }
+  } catch (error) {
+    console.warn("Feed non disponibile, uso il CSV:", error);
+  }
+
+  const response = await fetch('/shared/dati.csv?t=' + Date.now());
+  if (!response.ok) throw new Error(`Errore HTTP: ${response.status}`);
+  feedState = { epoch: null, version: null };
+  return { type: 'full', data: parseCSV(await response.text()) };
+}
+
+function matchesFilters(row) {
+  return !activeFilters.frequency || row.frequency === activeFilters.frequency;
+}
+
+// Aggiorna le statistiche dell'header a partire da allMarkersData
+function updateStatsFromData() {
+  const uniqueUsers = new Set(allMarkersData.filter(row => !row.source).map(row => row.user || row.ID)); // I nodi importati non hanno un utente
+  appStats.totalNodes = allMarkersData.length;
+  appStats.uniqueUsers = uniqueUsers.size;
+  appStats.lastUpdate = new Date();
+  updateHeaderStats();
+}
+
+// Crea il marker Leaflet di un nodo e lo registra per chiave (null se le coordinate non sono valide)
+function createMarker(row) {
+  const lat = parseFloat(row.lat);
+  const lon = parseFloat(row.lon);
+  if (isNaN(lat) || isNaN(lon)) return null;
+
+  const marker = L.marker([lat, lon], {
+    title: row.name || 'Nodo LoRa',
+    riseOnHover: true,
+    data: row
+  }).bindPopup(formatPopupContent(row));
+
+  const key = markerKey(row.ID, row.name);
+  if (!markersByKey.has(key)) markersByKey.set(key, []);
+  markersByKey.get(key).push(marker);
+  return marker;
+}
+
+// Ricostruisce tutti i marker da zero
+function renderAllMarkers(data) {
+  allMarkersData = data; // Salva tutti i dati per la ricerca
+  updateStatsFromData();
 
-    // Rimuovi i vecchi marker
-    markersCluster.clearLayers();
+  // Memorizza la vista corrente prima di aggiornare i marker
+  const currentZoom = map.getZoom();
+  const currentCenter = map.getCenter();
+
+  // Rimuovi i vecchi marker
+  markersCluster.clearLayers();
+  sourceCluster.clearLayers();
+  markersByKey.clear();
+
+  if (tileMode) {
+    // I marker vengono disegnati dai tile, qui servono solo i dati per la ricerca
     currentMarkers = [];
+    drawTiles();
+    updateStatus('success', `Caricati ${data.length} nodi`);
+    return;
+  }
+
+  currentMarkers = data.map(createMarker).filter(marker => marker !== null);
+
+  if (currentMarkers.length === 0) {
+    updateStatus('error', 'Nessun dato valido trovato');
+    return;
+  }
+
+  showMarkers(currentMarkers.filter(marker => matchesFilters(marker.options.data)));
+
+  // Ripristina la vista precedente invece di zoommare sui marker
+  map.setView(currentCenter, currentZoom);
+
+  updateStatus('success', `Caricati ${currentMarkers.length} nodi`);
+}
+
+// Applica solo le modifiche ricevute, senza ricostruire il cluster.
+// Le cancellazioni vengono raccolte e tolte dalle liste in un solo passaggio:
+// un sync dei nodi importati può contenere migliaia di modifiche.
+function applyChanges(changes, fields) {
+  const deletedKeys = new Set();
+  const removedMarkers = new Set();
+  const flushDeletes = () => {
+    if (!deletedKeys.size) return;
+    allMarkersData = allMarkersData.filter(row => !deletedKeys.has(markerKey(row.ID, row.name)));
+    currentMarkers = currentMarkers.filter(marker => !removedMarkers.has(marker));
+    const removed = Array.from(removedMarkers);
+    markersCluster.removeLayers(removed.filter(marker => !marker.options.data.source));
+    sourceCluster.removeLayers(removed.filter(marker => marker.options.data.source));
+    deletedKeys.clear();
+    removedMarkers.clear();
+  };
+
+  changes.forEach(change => {
+    if (change.op === 'add') {
+      const row = rowFromValues(fields, change.node);
+      if (deletedKeys.has(markerKey(row.ID, row.name))) flushDeletes(); // Nodo aggiornato: cancellato e riaggiunto
+      allMarkersData.push(row);
+      if (tileMode) return;
+      const marker = createMarker(row);
+      if (marker) {
+        currentMarkers.push(marker);
+        if (matchesFilters(row)) clusterFor(row).addLayer(marker);
+      }
+
+    } else if (change.op === 'rename' && tileMode) {
+      const row = allMarkersData.find(row =>
+        String(row.ID) === String(change.id) && row.name === change.name);
+      if (row) row.name = change.new_name;
+
+    } else if (change.op === 'rename') {
+      const key = markerKey(change.id, change.name);
+      const list = markersByKey.get(key) || [];
+      const marker = list.shift();
+      if (!list.length) markersByKey.delete(key);
+      if (marker) {
+        const row = marker.options.data;
+        row.name = change.new_name;
+        marker.options.title = row.name;
+        marker.setPopupContent(formatPopupContent(row));
+        const newKey = markerKey(change.id, change.new_name);
+        if (!markersByKey.has(newKey)) markersByKey.set(newKey, []);
+        markersByKey.get(newKey).push(marker);
+      }
+
+    } else if (change.op === 'delete') {
+      const key = markerKey(change.id, change.name);
+      (markersByKey.get(key) || []).forEach(marker => removedMarkers.add(marker));
+      markersByKey.delete(key);
+      deletedKeys.add(key);
+    }
+  });
+  flushDeletes();
+
+  updateStatsFromData();
+  if (tileMode) drawTiles();
+  updateStatus('success', changes.length ?
+    `${changes.length} modifiche applicate (${allMarkersData.length} nodi)` :
+    `Dati aggiornati (${allMarkersData.length} nodi)`);
+}
+
+// --------------- Tile dei cluster precalcolati ---------------
+async function loadTileIndex() {
+  try {
+    const response = await fetch('/shared/tiles/index.json?t=' + Date.now());
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    return null; // Tile non disponibili: si usa il clustering nel browser
+  }
+}
+
+// Stesso nome usato dal bot per le cartelle delle frequenze ("868 MHz" -> "868mhz")
+function tileSetName() {
+  if (!activeFilters.frequency) return 'all';
+  return activeFilters.frequency.toLowerCase().replace(/[^0-9a-z]+/g, '') || 'altro';
+}
+
+function fetchTile(set, z, x, y) {
+  const url = `/shared/tiles/${set}/${z}/${x}/${y}.json?v=${tileIndex.version}`;
+  if (!tileCache.has(url)) {
+    // I tile mancanti sono semplicemente vuoti
+    const empty = { clusters: [], nodes: [] };
+    tileCache.set(url, fetch(url)
+      .then(response => response.ok ? response.json() : empty)
+      .catch(() => empty));
+  }
+  return tileCache.get(url);
+}
+
+// Attiva o disattiva la modalità tile in base alla disponibilità e al numero di nodi
+async function updateTileMode() {
+  const index = await loadTileIndex();
+  if (index && (!tileIndex || index.version !== tileIndex.version)) {
+    tileCache.clear(); // Versione cambiata: i tile in cache sono vecchi
+  }
+  tileIndex = index;
+
+  const enable = tileIndex !== null && allMarkersData.length >= TILE_MODE_MIN_NODES;
+  if (enable === tileMode) return false;
 
-    // Filtra e aggiungi i nuovi marker
-    const validMarkers = data.filter(row => {
-      const lat = parseFloat(row.lat);
-      const lon = parseFloat(row.lon);
-      return !isNaN(lat) && !isNaN(lon);
+  tileMode = enable;
+  if (tileMode) {
+    map.removeLayer(markersCluster);
+    map.removeLayer(sourceCluster);
+    map.addLayer(tileLayer);
+  } else {
+    tileLayer.clearLayers();
+    map.removeLayer(tileLayer);
+    map.addLayer(markersCluster);
+    if (sourceVisible) map.addLayer(sourceCluster);
+  }
+  return true;
+}
+
+// Disegna i cluster e i nodi dei tile visibili
+async function drawTiles() {
+  if (!tileMode || !tileIndex) return;
+  const requestId = ++tileRequestId;
+
+  const bounds = map.getBounds();
+  if (Math.round(map.getZoom()) > tileIndex.max_zoom) {
+    drawVisibleNodes(bounds);
+    return;
+  }
+
+  const z = Math.round(map.getZoom());
+  const nw = map.project(bounds.getNorthWest(), z).divideBy(256).floor();
+  const se = map.project(bounds.getSouthEast(), z).divideBy(256).floor();
+  const last = Math.pow(2, z) - 1;
+
+  const set = tileSetName();
+  const requests = [];
+  for (let x = Math.max(0, nw.x); x <= Math.min(last, se.x); x++) {
+    for (let y = Math.max(0, nw.y); y <= Math.min(last, se.y); y++) {
+      requests.push(fetchTile(set, z, x, y));
+    }
+  }
+  const tiles = await Promise.all(requests);
+  if (requestId !== tileRequestId) return; // Vista cambiata nel frattempo
+
+  tileLayer.clearLayers();
+  let visible = 0;
+  tiles.forEach(tile => {
+    tile.clusters.forEach(([lat, lon, count]) => {
+      const icon = L.divIcon({
+        html: `<div><span>${count}</span></div>`,
+        className: 'cluster-icon',
+        iconSize: L.point(40, 40)
+      });
+      L.marker([lat, lon], { icon })
+        .on('click', () => map.setView([lat, lon], Math.min(map.getZoom() + 2, map.getMaxZoom())))
+        .addTo(tileLayer);
+      visible += count;
+    });
+    tile.nodes.forEach(values => {
+      const row = rowFromValues(tileIndex.fields, values);
+      if (row.source && !sourceVisible) return; // I cluster dei tile contano comunque tutti i nodi
+      L.marker([row.lat, row.lon], { title: row.name || 'Nodo LoRa', riseOnHover: true, data: row })
+        .bindPopup(formatPopupContent(row))
+        .addTo(tileLayer);
+      visible += 1;
     });
+  });
+  updateStatus('success', `${visible} nodi nell'area visibile`);
+}
+
+// Oltre l'ultimo zoom dei tile i singoli nodi dell'area visibile vengono dai dati già caricati
+function drawVisibleNodes(bounds) {
+  tileLayer.clearLayers();
+  let visible = 0;
+  allMarkersData.forEach(row => {
+    if (!matchesFilters(row) || (row.source && !sourceVisible)) return;
+    const lat = parseFloat(row.lat);
+    const lon = parseFloat(row.lon);
+    if (isNaN(lat) || isNaN(lon) || !bounds.contains([lat, lon])) return;
+    L.marker([lat, lon], { title: row.name || 'Nodo LoRa', riseOnHover: true, data: row })
+      .bindPopup(formatPopupContent(row))
+      .addTo(tileLayer);
+    visible += 1;
+  });
+  updateStatus('success', `${visible} nodi nell'area visibile`);
+}
+
+map.on('moveend', drawTiles);
+
+// --------------- Copertura stimata (tile PNG generati dal bot) ---------------
+const coverageLayer = L.layerGroup();
+let coverageIndex = null;
+let coverageVisible = false;
 
-    if (validMarkers.length === 0) {
-      updateStatus('error', 'Nessun dato valido trovato');
+async function loadCoverageIndex() {
+  try {
+    const response = await fetch('/shared/coverage/index.json?t=' + Date.now());
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    return null;
+  }
+}
+
+// Un'immagine per ogni tile presente, posizionata con la griglia del bot (gradi per cella)
+function drawCoverage() {
+  coverageLayer.clearLayers();
+  if (!coverageVisible || !coverageIndex) return;
+
+  const { bounds, cell_deg: cell, tile_px: tilePx, height, width, version } = coverageIndex;
+  const north = bounds[2], west = bounds[1];
+  const set = tileSetName(); // Stessi insiemi dei tile dei cluster ("all" o la frequenza)
+  (coverageIndex.sets[set] || []).forEach(([row, col]) => {
+    const rows = Math.min(tilePx, height - row * tilePx); // L'ultima riga/colonna di tile può essere parziale
+    const cols = Math.min(tilePx, width - col * tilePx);
+    const top = north - row * tilePx * cell;
+    const left = west + col * tilePx * cell;
+    L.imageOverlay(`/shared/coverage/${set}/${row}_${col}.png?v=${version}`,
+      [[top - rows * cell, left], [top, left + cols * cell]],
+      { interactive: false }).addTo(coverageLayer);
+  });
+}
+
+// Ricarica l'indice e ridisegna solo se la copertura è cambiata
+async function refreshCoverage() {
+  if (!coverageVisible) return;
+  const index = await loadCoverageIndex();
+  if (!index) {
+    updateStatus('error', 'Copertura stimata non disponibile');
+    return;
+  }
+  if (!coverageIndex || index.version !== coverageIndex.version) {
+    coverageIndex = index;
+    drawCoverage();
+  }
+}
+
+function initCoverageToggle() {
+  const button = document.getElementById('coverage-toggle');
+  button.addEventListener('click', () => {
+    coverageVisible = !coverageVisible;
+    button.classList.toggle('active', coverageVisible);
+    if (coverageVisible) {
+      map.addLayer(coverageLayer);
+      coverageIndex = null; // Forza il ridisegno con l'indice aggiornato
+      refreshCoverage();
+    } else {
+      coverageLayer.clearLayers();
+      map.removeLayer(coverageLayer);
+    }
+  });
+}
+
+// Mostra o nasconde il layer dei nodi importati (attivo all'apertura della pagina)
+function initSourceToggle() {
+  const button = document.getElementById('source-toggle');
+  button.classList.toggle('active', sourceVisible);
+  button.addEventListener('click', () => {
+    sourceVisible = !sourceVisible;
+    button.classList.toggle('active', sourceVisible);
+    if (tileMode) {
+      drawTiles();
+    } else if (sourceVisible) {
+      map.addLayer(sourceCluster);
+    } else {
+      map.removeLayer(sourceCluster);
+    }
+  });
+}
+
+async function loadMarkers() {
+  updateStatus('loading', 'Caricamento dati in corso...');
+  
+  try {
+    const update = await fetchMarkerUpdate();
+
+    if (update.type === 'none') {
+      // Nessuna modifica dall'ultimo caricamento
+      appStats.lastUpdate = new Date();
+      updateHeaderStats();
+      updateStatus('success', `Dati aggiornati (${currentMarkers.length} nodi)`);
       return;
     }
 
-    validMarkers.forEach(row => {
-      const lat = parseFloat(row.lat);
-      const lon = parseFloat(row.lon);
-      
-      const marker = L.marker([lat, lon], {
-        title: row.name || 'Nodo LoRa',
-        riseOnHover: true,
-        data: row
-      }).bindPopup(formatPopupContent(row));
-      
-      currentMarkers.push(marker);
-    });
+    refreshCoverage(); // La copertura cambia con i nodi
 
-    markersCluster.addLayers(currentMarkers);
+    if (update.type === 'delta') {
+      applyChanges(update.changes, update.fields);
+      if (await updateTileMode() && !tileMode) {
+        renderAllMarkers(allMarkersData); // Tornati al clustering nel browser: servono i marker
+      } else if (tileMode) {
+        drawTiles();
+      }
+      return;
+    }
 
-    // Ripristina la vista precedente invece di zoommare sui marker
-    map.setView(currentCenter, currentZoom);
-        
-        updateStatus('success', `Caricati ${validMarkers.length} nodi`);
+    allMarkersData = update.data;
+    await updateTileMode();
+    renderAllMarkers(update.data);
     
   } catch (error) {
     console.error("Errore nel caricamento:", error);
@@ -270,6 +758,8 @@ document.addEventListener('DOMContentLoaded', () => {
   setInterval(updateHeaderStats, 60000); // Aggiorna l'orario nell'header ogni minuto
   initSearch(); // Inizializza la ricerca
   initFilters();
+  initCoverageToggle();
+  initSourceToggle();
   loadInitialPosition();
 });
 
@@ -302,24 +792,24 @@ function initFilters() {
 }
 
 function applyFilters() {
+  drawCoverage(); // Copertura della frequenza selezionata
+  if (tileMode) {
+    drawTiles(); // Ogni frequenza ha il suo insieme di tile
+    return;
+  }
   if (!currentMarkers.length) return;
 
   // Se nessun filtro attivo, mostra tutto
   if (!activeFilters.frequency) {
-    markersCluster.clearLayers();
-    markersCluster.addLayers(currentMarkers);
+    showMarkers(currentMarkers);
     updateStatus('success', `Mostrati tutti i ${currentMarkers.length} nodi`);
     return;
   }
 
   // Altrimenti applica filtro
-  const filtered = currentMarkers.filter(marker => {
-    const data = marker.options.data || {};
-    return (!activeFilters.frequency || data.frequency === activeFilters.frequency);
-  });
+  const filtered = currentMarkers.filter(marker => matchesFilters(marker.options.data || {}));
 
-  markersCluster.clearLayers();
-  markersCluster.addLayers(filtered);
+  showMarkers(filtered);
 
   updateStatus('success', `${filtered.length} nodi visibili`);
 }
@@ -361,7 +851,12 @@ function handleSearchResultClick(e) {
     const lon = parseFloat(e.target.dataset.lon);
     
     map.setView([lat, lon], 16); // Zoom a livello 16
-    markersCluster.getLayers().forEach(layer => {
+    if (tileMode) {
+      // In modalità tile il marker potrebbe non essere ancora disegnato
+      const row = allMarkersData.find(row => parseFloat(row.lat) === lat && parseFloat(row.lon) === lon);
+      if (row) L.popup().setLatLng([lat, lon]).setContent(formatPopupContent(row)).openOn(map);
+    }
+    markersCluster.getLayers().concat(sourceCluster.getLayers()).forEach(layer => {
       if (layer.getLatLng().lat === lat && layer.getLatLng().lng === lon) {
         layer.openPopup();
       }